@@ -0,0 +1,34 @@
+"""Token revocations
+
+Revision ID: a8e3f1c6d294
+Revises: f4b0d9e2c751
+Create Date: 2026-10-18 16:42:19.305871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8e3f1c6d294'
+down_revision: Union[str, None] = 'f4b0d9e2c751'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'token_revocations',
+        sa.Column('employee_id', sa.UUID(), nullable=False),
+        sa.Column('revoked_before', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['employee_id'], ['employees.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('employee_id')
+    )
+    op.create_index(op.f('ix_token_revocations_updated_at'), 'token_revocations', ['updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_token_revocations_updated_at'), table_name='token_revocations')
+    op.drop_table('token_revocations')
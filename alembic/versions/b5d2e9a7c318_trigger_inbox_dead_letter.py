@@ -0,0 +1,29 @@
+"""Trigger inbox attempt limit and status
+
+Revision ID: b5d2e9a7c318
+Revises: a8e3f1c6d294
+Create Date: 2026-10-18 17:20:41.518903
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5d2e9a7c318'
+down_revision: Union[str, None] = 'a8e3f1c6d294'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('trigger_inbox', sa.Column('max_attempts', sa.Integer(), nullable=False, server_default='10'))
+    op.add_column('trigger_inbox', sa.Column('status', sa.String(), nullable=False, server_default='pending'))
+    op.create_index(op.f('ix_trigger_inbox_status'), 'trigger_inbox', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_trigger_inbox_status'), table_name='trigger_inbox')
+    op.drop_column('trigger_inbox', 'status')
+    op.drop_column('trigger_inbox', 'max_attempts')
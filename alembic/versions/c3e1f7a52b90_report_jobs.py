@@ -0,0 +1,42 @@
+"""Report jobs
+
+Revision ID: c3e1f7a52b90
+Revises: a4070a0f9217
+Create Date: 2026-10-18 09:12:41.201337
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3e1f7a52b90'
+down_revision: Union[str, None] = 'a4070a0f9217'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+report_status = postgresql.ENUM('PENDING', 'RUNNING', 'COMPLETED', 'FAILED', name='reportstatus')
+
+
+def upgrade() -> None:
+    op.execute("ALTER TYPE reporttypes ADD VALUE IF NOT EXISTS 'LEAVES'")
+    report_status.create(op.get_bind(), checkfirst=True)
+    op.alter_column('reports', 'report_link', existing_type=sa.String(), nullable=True)
+    op.add_column('reports', sa.Column('status', report_status, nullable=False, server_default='COMPLETED'))
+    op.add_column('reports', sa.Column('category', sa.String(), nullable=True))
+    op.add_column('reports', sa.Column('category_id', sa.UUID(), nullable=True))
+    op.add_column('reports', sa.Column('file_format', sa.String(), nullable=True))
+    op.add_column('reports', sa.Column('error', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('reports', 'error')
+    op.drop_column('reports', 'file_format')
+    op.drop_column('reports', 'category_id')
+    op.drop_column('reports', 'category')
+    op.drop_column('reports', 'status')
+    op.alter_column('reports', 'report_link', existing_type=sa.String(), nullable=False)
+    report_status.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,41 @@
+"""Pending chat notifications
+
+Revision ID: c9a4d1f0e762
+Revises: b5d2e9a7c318
+Create Date: 2026-10-18 17:48:05.771240
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9a4d1f0e762'
+down_revision: Union[str, None] = 'b5d2e9a7c318'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'pending_chat_notifications',
+        sa.Column('receiver_id', sa.UUID(), nullable=False),
+        sa.Column('conversation_id', sa.UUID(), nullable=False),
+        sa.Column('title', sa.String(), nullable=False),
+        sa.Column('message', sa.String(), nullable=False),
+        sa.Column('message_id', sa.UUID(), nullable=True),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('flush_after', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['receiver_id'], ['employees.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('receiver_id', 'conversation_id')
+    )
+    op.create_index(op.f('ix_pending_chat_notifications_flush_after'), 'pending_chat_notifications', ['flush_after'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_pending_chat_notifications_flush_after'), table_name='pending_chat_notifications')
+    op.drop_table('pending_chat_notifications')
@@ -0,0 +1,49 @@
+"""Trigger inbox and processed trigger events
+
+Revision ID: d7a91c3e5f08
+Revises: c3e1f7a52b90
+Create Date: 2026-10-18 15:02:17.448210
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7a91c3e5f08'
+down_revision: Union[str, None] = 'c3e1f7a52b90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'processed_trigger_events',
+        sa.Column('event_id', sa.String(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('processed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('event_id')
+    )
+    op.create_index(op.f('ix_processed_trigger_events_processed_at'), 'processed_trigger_events', ['processed_at'], unique=False)
+    op.create_table(
+        'trigger_inbox',
+        sa.Column('event_id', sa.String(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('op', sa.String(), nullable=False, server_default='INSERT'),
+        sa.Column('data', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column('received_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('next_attempt_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('event_id')
+    )
+    op.create_index(op.f('ix_trigger_inbox_next_attempt_at'), 'trigger_inbox', ['next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_trigger_inbox_next_attempt_at'), table_name='trigger_inbox')
+    op.drop_table('trigger_inbox')
+    op.drop_index(op.f('ix_processed_trigger_events_processed_at'), table_name='processed_trigger_events')
+    op.drop_table('processed_trigger_events')
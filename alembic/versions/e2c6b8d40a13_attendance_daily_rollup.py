@@ -0,0 +1,55 @@
+"""Attendance daily rollup
+
+Revision ID: e2c6b8d40a13
+Revises: d7a91c3e5f08
+Create Date: 2026-10-18 15:31:06.912845
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2c6b8d40a13'
+down_revision: Union[str, None] = 'd7a91c3e5f08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'attendance_daily_rollup',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('employee_id', sa.UUID(), nullable=False),
+        sa.Column('department_id', sa.UUID(), nullable=True),
+        sa.Column('present', sa.Boolean(), nullable=False),
+        sa.Column('late', sa.Boolean(), nullable=True),
+        sa.Column('minutes_on_site', sa.Integer(), nullable=True),
+        sa.Column('first_clock_in', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['department_id'], ['departments.id']),
+        sa.ForeignKeyConstraint(['employee_id'], ['employees.id']),
+        sa.PrimaryKeyConstraint('day', 'employee_id')
+    )
+    op.create_index(op.f('ix_attendance_daily_rollup_department_id'), 'attendance_daily_rollup', ['department_id'], unique=False)
+    # Fill the table from the attendance history so the summaries reading it are right from the start.
+    op.execute("""
+        INSERT INTO attendance_daily_rollup (day, employee_id, department_id, present, late, minutes_on_site, first_clock_in, updated_at)
+        SELECT attendance.clock_in_date, attendance.employee_id, employees.department_id, true,
+               bool_or(attendance_state.is_late),
+               CAST(sum(CASE WHEN attendance.clock_out_time > attendance.clock_in_time
+                             THEN extract(epoch FROM attendance.clock_out_time - attendance.clock_in_time) / 60 END) AS INTEGER),
+               min(attendance.clock_in_time), now()
+        FROM attendance
+        JOIN employees ON employees.id = attendance.employee_id
+        LEFT OUTER JOIN attendance_state ON attendance_state.attendance_id = attendance.id
+        WHERE attendance.clock_in_date IS NOT NULL
+        GROUP BY attendance.clock_in_date, attendance.employee_id, employees.department_id
+        ON CONFLICT (day, employee_id) DO NOTHING
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_attendance_daily_rollup_department_id'), table_name='attendance_daily_rollup')
+    op.drop_table('attendance_daily_rollup')
@@ -0,0 +1,31 @@
+"""Report data versions
+
+Revision ID: f4b0d9e2c751
+Revises: e2c6b8d40a13
+Create Date: 2026-10-18 15:58:44.027316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4b0d9e2c751'
+down_revision: Union[str, None] = 'e2c6b8d40a13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'report_data_versions',
+        sa.Column('source', sa.String(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('source')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('report_data_versions')
@@ -1,35 +1,40 @@
-import random
-from pathlib import Path
 import os
-import io
-from typing import Optional, Any
 import uuid
 import mimetypes
 from fastapi.responses import StreamingResponse, JSONResponse
-from typing import Dict, List, Optional
+from typing import Any, Dict, Optional, Union
 from datetime import datetime, date
-from dateutil import parser
 import strawberry
-from fastapi import FastAPI, status, HTTPException, File, UploadFile, Depends, Body, Form
+from fastapi import FastAPI, Request, status, HTTPException, File, UploadFile, Depends, Form
 from fastapi.middleware.cors import CORSMiddleware
 from strawberry.fastapi import GraphQLRouter
 from schema import Mutation, Query, Subscription
 from src import models, logger
-from src.auth import create_token, get_current_user
-from src.crud import authenticate_employee, get_employee_attendance_summary, get_department_attendance_summary, attendance_percentage, average_time_in_office, average_compnay_arrival_time, get_company_name
-from src.database import engine, get_db
-from src.models import Employee, CompanySettings, Department, Attendance, AttendanceState, AppVersions, UploadedFile, Company, TextContent,\
-    EmployeeNotification, Visit, Visitor, EmployeeNotificationType, EventParticipant, ParticipantStatus, Conversation, \
-    EmployeeConversation, Attachment, Message, MessageStatus, MessageStatuses, \
-    Report, ReportTypes
-from src.schema.input_type import LoginInput
+from src.auth import create_token, get_current_admin, get_current_user
+from src.components.passwords import password_hasher
+from src.components.principal import principal_cache
+from src.components.settings import company_settings_cache
+from src.components.lateness import shift_cache
+from src.components import versions as cache_versions
+from src.components.throttle import client_ip, login_throttle
+from src.crud import authenticate_employee_async
+from src.database import engine, get_async_db
+from sqlalchemy import inspect as sa_inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.models import Employee, AppVersions, UploadedFile, Visit, Visitor
+from src.schema.input_type import LoginInput, ReportTypeEnum, CategoryTypeEnum, ReportEngineEnum, ReportJobInput
+from src.components.resolvers import stream_report_csv
+from src.components.jobs import report_jobs, ReportJobRequest, get_report_job
+from src.components.cache import report_cache, token_cache
+from src.components.ingest import trigger_queue, parse_trigger_event
+from src.components.push import push_queue
+from src.components.coalesce import notification_coalescer
+from src.components.storage import UPLOAD_BUCKET, stream_form_file, stream_to_s3
 from src.utils import (
-    is_employee_late, PineconeSigleton, upload_to_s3, generate_date_range, get_attendance_for_day,
-    calculate_time_in_building, LocalUploadStrategy, S3UploadStrategy, UploadProcessor, UploadStrategies,
+    get_attendance_by_day, calculate_time_in_building, LocalUploadStrategy, S3UploadStrategy, UploadProcessor, UploadStrategies,
     # ReportService, ChromaService, FaceDetectionService
 )
 import boto3
-from pathlib import Path
 from fastapi.staticfiles import StaticFiles
 from zoneinfo import ZoneInfo
 # from src.utilities import generate_pdf
@@ -78,6 +83,21 @@ os.makedirs('/uploads', exist_ok=True)
 
 app.mount("/uploads", StaticFiles(directory="/app/uploads"), name="uploads")
 
+@app.on_event("startup")
+async def start_background_workers():
+    await report_jobs.start()
+    await push_queue.start()
+    await notification_coalescer.start()
+    await trigger_queue.start()
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    await trigger_queue.stop()
+    await notification_coalescer.stop()
+    await push_queue.stop()
+    await report_jobs.stop()
+    password_hasher.shutdown()
+
 @app.get("/")
 def greet_json():
     return {"Hello": "World!"}
@@ -88,226 +108,120 @@ async def create_employee():
     return {"created" : "user"}
 
 @app.post("/api/v1/login")
-async  def login(user: LoginInput):
-    with next(get_db()) as db:
-        employee_with_role = authenticate_employee(db, user.phone_number, user.password)
-        # employee_with_role.firebase_token = user.firebase_token if user.firebase_token else employee_with_role.firebase_token
-        # db.commit()
-        try:
-            if employee_with_role:
-                token = create_token(employee_with_role)
-                return {
-                    "employee": employee_with_role,
-                    "token": token
-                }
-            else:
-                raise  HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect phone number or password")
-        except Exception as e:
-            logger.exception(e)
-            db.rollback()
-            db.close()
-        finally:
-            db.close()
+async  def login(user: LoginInput, request: Request, db: AsyncSession = Depends(get_async_db)):
+    if not await login_throttle.allow(user.phone_number, client_ip(request)):
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many login attempts, try again later")
+    principal = await authenticate_employee_async(db, user.phone_number, user.password)
+    # employee_with_role.firebase_token = user.firebase_token if user.firebase_token else employee_with_role.firebase_token
+    # db.commit()
+    try:
+        if principal:
+            token = create_token(principal)
+            # Same employee fields as before the principal cache (minus the password hash), with roles and level alongside.
+            employee_with_role = await db.get(Employee, principal.id)
+            employee = {
+                attr.key: getattr(employee_with_role, attr.key)
+                for attr in sa_inspect(Employee).column_attrs if attr.key != "password"
+            }
+            employee.update(roles=list(principal.roles), level=principal.level)
+            return {
+                "employee": employee,
+                "token": token
+            }
+        else:
+            raise  HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect phone number or password")
+    except Exception as e:
+        logger.exception(e)
+        await db.rollback()
 
 @app.post("/api/v1/attendance-trigger")
 async def attendance_trigger(body: Dict):
-    employee_id = body['event']['data']['new']['employee_id']
-    inserted_attendance = body['event']['data']['new']
-    print(inserted_attendance)
-
-    with next(get_db()) as db:
-        try:
-            # Get employee and company settings
-            employee = db.query(Employee.company_id).filter(Employee.id == employee_id).first()
-            company_settings = db.query(CompanySettings).filter(
-                CompanySettings.company_id == employee.company_id
-            ).first()
+    await trigger_queue.submit(parse_trigger_event("attendance", body))
+    return {"message" : "Received and printed"}
 
-            # Parse clock-in time
-            clock_in_time_unformatted = parser.isoparse(inserted_attendance['clock_in_time'])
-            clock_in_time = clock_in_time_unformatted.time().strftime('%H:%M:%S')
 
-            start_work_time = company_settings.start_work_time
-            max_late_time = company_settings.max_late_time
+@app.post("/api/v1/visit-trigger")
+async def visits_trigger(body: Dict):
+    await trigger_queue.submit(parse_trigger_event("visit", body))
+    return {"message": "Event triggered"}
 
-            # Check if the employee is late
-            is_late = is_employee_late(clock_in_time, start_work_time, max_late_time)
 
-            attendance_state = AttendanceState(
-                is_late = is_late,
-                attendance_id = inserted_attendance["id"]
-            )
-            db.add(attendance_state)
-            db.commit()
+@app.post("/api/v1/principal-trigger")
+async def principal_trigger(body: Dict, db: AsyncSession = Depends(get_async_db)):
+    """
+    Hasura trigger on employees, employee_roles and positions. Drops the cached login
+    principals the changed row feeds into, here and (through cache_versions) in the other replicas.
+    """
+    table = body['table']['name']
+    data = body['event']['data']['new'] or body['event']['data']['old']
+    if table == "positions":
+        principal_cache.invalidate_position(data['id'])
+    elif table == "employee_roles":
+        principal_cache.invalidate(data['employee_id'])
+    else:
+        principal_cache.invalidate(data['id'])
+        company_settings_cache.invalidate_employee(data['id'])
+    await db.execute(cache_versions.bump_statement(
+        [cache_versions.PRINCIPALS] + ([cache_versions.COMPANY_SETTINGS] if table == "employees" else [])
+    ))
+    await db.commit()
+    return {"message": "Event triggered"}
 
-        except Exception as e:
-            logger.exception(e)
-            db.rollback()
-            db.close()
-            raise e
-        finally:
-            db.close()
 
-    return {"message" : "Received and printed"}
+@app.post("/api/v1/shift-trigger")
+async def shift_trigger(body: Dict, db: AsyncSession = Depends(get_async_db)):
+    """Hasura trigger on shifts and employee_shifts."""
+    if body['table']['name'] == "shifts":
+        shift_cache.invalidate_shifts()
+    else:
+        for data in (body['event']['data']['old'], body['event']['data']['new']):
+            if data and data.get('employee_id'):
+                shift_cache.invalidate_employee(data['employee_id'])
+    await db.execute(cache_versions.bump_statement([cache_versions.SHIFTS]))
+    await db.commit()
+    return {"message": "Event triggered"}
 
-@app.post("/api/v1/visit-trigger")
-async def visits_trigger(body: Dict):
-    print(body)
-    data = body['event']['data']['new']
-    with next(get_db()) as db:
-        try:
 
-            db_visitor = db.query(Visitor).filter(Visitor.id == data["visitor"]).first()
-
-            print(f"Host employee ========>  {data['host_employee']}")
-            db_notif = EmployeeNotification(
-                employee_id = data["host_employee"],
-                action = "New Visitor",
-                type = EmployeeNotificationType.VISITS,
-                title = "New Visitor Alert !",
-                message=f"{db_visitor.firstname} {db_visitor.lastname} is paying you a visit!",
-                visits_id = data['id'],
-                is_read = False
-            )
+@app.post("/api/v1/company-settings-trigger")
+async def company_settings_trigger(body: Dict, db: AsyncSession = Depends(get_async_db)):
+    """Hasura trigger on company_settings. Lateness is evaluated with the new settings from now on."""
+    for data in (body['event']['data']['old'], body['event']['data']['new']):
+        if data and data.get('company_id'):
+            company_settings_cache.invalidate_company(data['company_id'])
+    await db.execute(cache_versions.bump_statement([cache_versions.COMPANY_SETTINGS]))
+    await db.commit()
+    return {"message": "Event triggered"}
 
-            print(f"Notification info: Employee: {db_notif.employee_id}, message: {db_notif.message}")
-            db.add(db_notif)
-            db.commit()
 
-        except Exception as e:
-            db.rollback()
-            db.close()
-            logger.exception(e)
-        finally:
-            db.close()
+@app.post("/api/v1/leave-trigger")
+async def leave_trigger(body: Dict, db: AsyncSession = Depends(get_async_db)):
+    await db.execute(report_cache.bump_statement(["leaves"]))
+    await db.commit()
     return {"message": "Event triggered"}
 
 
 @app.post("/api/v1/events-trigger")
 async def events_trigger(body: Dict):
-    print(body['event']['data']['new'])
-
-    event_id = body['event']['data']['new']['id']
-    event_data = body['event']['data']['new']
-    print("event id", event_id)
-
-    # Open the session once
-    with next(get_db()) as db:
-        try:
-            # Query participants of the event
-            event_participants = db.query(EventParticipant).filter(EventParticipant.event_id == event_id).all()
-            print("event participants", event_participants)
-
-            # Process each participant
-            for participant in event_participants:
-                participant.status = ParticipantStatus.PENDING
-                db_notif = EmployeeNotification(
-                    action="New events alert !",
-                    title=event_data['title'],
-                    message=event_data['description'],
-                    is_read=False,
-                    type=EmployeeNotificationType.EVENTS,
-                    employee_id=participant.employee_id,
-                    event_id = participant.event_id
-                )
-
-                db.add(db_notif)
-
-            # Commit all notifications in one transaction
-            db.commit()
-        except Exception as e:
-            # Rollback on error
-            db.rollback()
-            logger.exception(e)
-        finally:
-            # Close the session at the end
-            db.close()
+    await trigger_queue.submit(parse_trigger_event("event", body))
+    return {"message": "Event triggered"}
 
 
 @app.post("/api/v1/message-trigger")
 async def message_trigger(body: Dict):
-    icon_attachment = {
-        'DOCUMENT' : '📄',
-        'VOICE' : '🎤',
-        'IMAGE' : '🏞',
-        'AUDIO' : '🎵',
-        'VIDEO' : '🎥'
-    }
-    message_id = body['event']['data']['new']['id']
-    message_data = body['event']['data']['new']
-    conv_id = message_data['conversation_id']
-    print('message id', message_data)
-
-    with next(get_db()) as db:
-        try:
-            receiver_id = (
-                db.query(EmployeeConversation.employee_id)
-                .filter((EmployeeConversation.conversation_id == conv_id) & (EmployeeConversation.employee_id != message_data['sender_id']))
-                .scalar()
-            )
-            attachment = (
-                db.query(Attachment)
-                .join(Message, Attachment.message_id == message_id)
-                .first()
-            )
-            sender = (
-                db.query(Employee)
-                .filter(Employee.id == message_data['sender_id'])
-                .first()
-            )
-
-            message_status = MessageStatus(
-                employee_id = message_data['sender_id'],
-                status = MessageStatuses.SENT,
-                message_id = message_data['id'],
-            )
-            db.add(message_status)
-            if attachment:
-                if message_data['content'] != None:
-                    icon = f"{attachment.file_type}"
-                    content = message_data['content']
-                    print('content messages with no content  ======>', content)
-                    message = f"{icon_attachment[icon]} {content}"
-                else:
-                    icon = f"{attachment.file_type}"
-                    content = attachment.file_type.capitalize()
-                    print('content messages with no content  ======>', content)
-                    message = f"{icon_attachment[icon]} {content}"
-            else:
-                message = message_data['content']
-
-            notification = EmployeeNotification(
-                action="New message!",
-                title= f"{sender.firstname} {sender.lastname}",
-                message= message,
-                is_read=False,
-                type=EmployeeNotificationType.MESSAGES,
-                employee_id = receiver_id,
-                message_id= message_id
-            )
-
-            db.add(notification)
-            db.commit()
-        except Exception as e:
-            logger.exception(e)
-            raise Exception(f'Internal server error: {e}')
-        finally:
-            db.close()
+    await trigger_queue.submit(parse_trigger_event("message", body))
+    return {"message": "Event triggered"}
 
 
 @app.post("/api/v1/visits-trigger")
 async def visit_trigger(body: Any):
     print('Body', body)
 
-    with next(get_db()) as db:
-        try:
-            print('Body', body)
+    try:
+        print('Body', body)
 
-        except Exception as e:
-            logger.exception(e)
-            raise Exception(f"Internal server error: {e}")
-        finally:
-            db.close()
+    except Exception as e:
+        logger.exception(e)
+        raise Exception(f"Internal server error: {e}")
 
 async def upload_files(upload_type: Optional[str]='online', file: UploadFile=File(...)):
     strategies = UploadStrategies( local=LocalUploadStrategy, online=S3UploadStrategy)
@@ -322,12 +236,9 @@ async def upload_files(upload_type: Optional[str]='online', file: UploadFile=Fil
 async def insert_face(
     upload_type: Optional[str],
     face: UploadFile = File(...),
-    user: str = Depends(get_current_user)
-
+    user: str = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
     ):
-    today = date.today()
-
-
     try:
 
         result = await upload_files(upload_type, face)
@@ -335,28 +246,24 @@ async def insert_face(
     except Exception as e:
         logger.exception(e)
 
-    with next(get_db()) as db:
-        try:
-            file = UploadedFile(
-                # file_name = f"{face.filename}",
-                file_name = "",
-                file_url = result,
-                mime_type = "",
-                file_size = 0
-            )
-            db.add(file)
-            db.commit()
-            employee = db.query(Employee).filter(Employee.id == user).first()
-            employee.profile_picture = file.id
-            db.commit()
-        except Exception as e:
-
-            logger.exception(e)
-            db.rollback()
-            db.close()
-            raise e
-        finally:
-            db.close()
+    try:
+        file = UploadedFile(
+            # file_name = f"{face.filename}",
+            file_name = "",
+            file_url = result,
+            mime_type = "",
+            file_size = 0
+        )
+        db.add(file)
+        await db.commit()
+        employee = (await db.execute(select(Employee).where(Employee.id == user))).scalars().first()
+        employee.profile_picture = file.id
+        await db.commit()
+    except Exception as e:
+
+        logger.exception(e)
+        await db.rollback()
+        raise e
 
     return JSONResponse(status_code=status.HTTP_200_OK, content={"message": "Face image uploaded", "file_url": result})
 
@@ -375,69 +282,58 @@ async def insert_face(
     #     logger.exception(e)
     #     raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"{str(e)}")
 
-@app.post("/api/v1/upload-app")
-async def upload_app(name: str, version: str, apps: UploadFile = File(...)):
+@app.post("/api/v1/upload-app", openapi_extra={"requestBody": {"required": True, "content": {"multipart/form-data": {
+    "schema": {"type": "object", "required": ["apps"], "properties": {"apps": {"type": "string", "format": "binary"}}}
+}}}})
+async def upload_app(name: str, version: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    # The APK is read from the request body and sent to S3 part by part, never held whole or written to disk.
+    key = str(uuid.uuid4()) + ".apk"
     try:
-        file_path = f"uploads/app"
-        # mime_type, _ = mimetypes.guess_type(file_path)
-        # file_size = os.path.getsize(file_path)
-        with open(file_path, "wb") as f:
-            f.write(await apps.read())
+        file_url = await stream_to_s3(
+            stream_form_file(request, "apps"),
+            key=key,
+            s3=s3,
+            content_type="application/vnd.android.package-archive"
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception(e)
         raise HTTPException(status_code=500, detail=f"{str(e)}")
+
     try:
-        file_url = upload_to_s3(
-            s3_file=str(uuid.uuid4()) + ".apk",
-            s3=s3,
-            local_file=file_path,
-            bucket_name='vvims-visitor'
+        app_version = AppVersions(
+            version = version,
+            name = name,
+            url = file_url
         )
+        db.add(app_version)
+        await db.commit()
+        return {"message": "Upload successful", "file_url": file_url}
     except Exception as e:
         logger.exception(e)
-        raise e
-
-    with next(get_db()) as db:
+        await db.rollback()
+        # Without its AppVersions row nothing points at the APK: remove it rather than leave it billed.
         try:
-            app_version = AppVersions(
-                version = version,
-                name = name,
-                url = file_url
-            )
-            db.add(app_version)
-            db.commit()
-            if file_url:
-                return {"message": "Upload successful", "file_url": file_url}
-            else:
-                return {"message": "Upload failed"}
-        except Exception as e:
-            logger.exception(e)
-            db.rollback()
-            db.close()
-            raise e
-        finally:
-            db.close()
+            await asyncio.to_thread(s3.delete_object, Bucket=UPLOAD_BUCKET, Key=key)
+        except Exception as delete_error:
+            logger.exception(delete_error)
+        raise HTTPException(status_code=500, detail="The app version could not be saved")
 
 async def uploads_save(file: UploadFile, upload_type: Optional[str]):
-    UPLOAD_DIR = '/app/uploads'
-    file_path = Path(UPLOAD_DIR)/file.filename
-
-    strategies = UploadStrategies[upload_type]
-
-    # processor = strategies.upload_process(file)
-    file_url = await strategies.upload_process(file)
+    strategy = UploadStrategies[upload_type]()
+    file_url = await strategy.upload_process(file)
 
     # Determine the MIME type and file size
-    mime_type, _ = mimetypes.guess_type(file_path)
-    file_size = os.path.getsize(file_path)
-
+    mime_type = file.content_type or mimetypes.guess_type(file.filename)[0]
+    file_size = file.size
 
-    return mime_type, file_size, file_url, file.filename, file_path
+    return mime_type, file_size, file_url, file.filename
 
 @app.post("/api/v1/upload-file")
 async def upload_file_strategy(upload_type: Optional[str]='online', file: UploadFile=File(...)):
     # strategies = UploadStrategies()
-    strategy = UploadStrategies[upload_type]
+    strategy = UploadStrategies[upload_type]()
 
     # processor = UploadProcessor(strategies)
     result = await strategy.upload_process(file)
@@ -468,161 +364,117 @@ async def add_visit_with_visitor(
         reason: str = Form(...),
         reg_no: Optional[str] = Form(None),
         face: UploadFile = File(None),
-        front_id: Optional[str] = Form(None),
-        back_id: Optional[str] = Form(None),
+        front_id: Union[UploadFile, str, None] = File(None),
+        back_id: Union[UploadFile, str, None] = File(None),
         # user: str = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db),
     ):
+    """
+    front_id and back_id are files. Sending them as plain form strings, as older clients do, is
+    deprecated: the document then gets a copy of the face file's record, as it used to.
+    """
     if not host_employee and not host_service and not host_department:
         raise HTTPException(status_code=400, detail="Bad request. Missing one of these: Department, service and employee") 
-    if face:
-        # Use 'await' to call the asynchronous 'uploads_save' function
-        mime_type = ''
-        file_size = 0
-        face_file_url = ''
-        face_file_name = ''
-        try:
-            print(f"Upload type =======> {upload_type}")
-            mime_type, file_size, face_file_url, face_file_name, file_path = await uploads_save(face, upload_type=upload_type)
-            # embedding_objs = DeepFace.represent(
-            #     img_path=file_path,
-            #     model_name="VGG-Face",
-            #     enforce_detection=True
-            # )
-            metadata = {
-                "firstname": firstname or "Jonh",
-                "lastname": lastname or "Doe",
-                "date": date.today().isoformat(),
-                "phone_number": phone_number or "672021428"
-            }
-
-            # face_service = FaceDetectionService()
-            # face_service.add_face(
-            #     server_instance,
-            #     embedding=embedding_objs[0]["embedding"],
-            #     metadata=metadata
-            # )
-            print(f"type=={mime_type}, size=={file_size}, url=={face_file_url}, filename=={face_file_name}, path=={file_path}")
-
-        except Exception as e:
-            pass
-        print(mime_type, file_size, face_file_url, face_file_name)
-    # Database operations (rest of the logic stays the same)
-    with next(get_db()) as db:
-       
-        if face:
-            print("THere is a face")
-            try:
-                db_face = UploadedFile(
-                    file_name=face_file_name,
-                    file_url=face_file_url,
-                    mime_type= mime_type,
-                    file_size = file_size
-                )
-                db.add(db_face)
-                db.commit()
-                print(f"THere is a face {db_face.id}")
-            except Exception as e:
-                logger.exception(e)
-                db.rollback()
-                raise HTTPException(status_code=500, detail=str(e))
-
-        if front_id:
-            try:
-                db_front = UploadedFile(
-                    file_name= face_file_name,
-                    file_url=face_file_url,
-                    mime_type=mime_type,
-                    file_size=file_size
-                )
-                db.add(db_front)
-                db.commit()
-            except Exception as e:
-                logger.exception(e)
-                db.rollback()
-                raise HTTPException(status_code=500, detail=str(e))
-        if back_id:
-            try:
-                db_back = UploadedFile(
-                    file_name=face_file_name,
-                    file_url=face_file_url,
-                    mime_type=mime_type,
-                    file_size=file_size
-                )
-                db.add(db_back)
-                db.commit()
-            except Exception as e:
-                logger.exception(e)
-                db.rollback()
-                raise HTTPException(status_code=500, detail=str(e))
 
+    # The documents go up concurrently: check-in waits for the slowest upload, not for their sum.
+    # A failed upload is logged and the visit is still recorded, without that document.
+    documents = (("face", face), ("front_id", front_id), ("back_id", back_id))
+    uploads = {name: upload for name, upload in documents if upload and not isinstance(upload, str)}
+    legacy = [name for name, upload in documents if upload and isinstance(upload, str)]
+    if legacy:
+        logger.warning(f"add-visits called with {', '.join(legacy)} as form strings, send them as files")
+    results = await asyncio.gather(
+        *(uploads_save(upload, upload_type=upload_type) for upload in uploads.values()),
+        return_exceptions=True
+    )
+    files = {}
+    for name, result in zip(uploads, results):
+        if isinstance(result, Exception):
+            logger.error(f"Upload of {name} failed: {result}")
+            continue
+        mime_type, file_size, file_url, file_name = result
+        files[name] = UploadedFile(
+            id=uuid.uuid4(),
+            file_name=file_name,
+            file_url=file_url,
+            mime_type=mime_type,
+            file_size=file_size
+        )
+    face_file_url = files["face"].file_url if "face" in files else ''
+    if "face" in files:
+        for name in legacy:
+            face_file = files["face"]
+            files[name] = UploadedFile(
+                id=uuid.uuid4(),
+                file_name=face_file.file_name,
+                file_url=face_file.file_url,
+                mime_type=face_file.mime_type,
+                file_size=face_file.file_size
+            )
 
+    # Ids are set here so the files, the visitor and the visit go to the database in one flush.
+    try:
+        db.add_all(files.values())
+        db_visitor = None
+        db_visit = None
+        if visitor:
+            db_visit = Visit(
+                host_employee=host_employee,
+                host_department=host_department,
+                host_service=host_service,
+                visitor=visitor,
+                vehicle=vehicle,
+                status=sanitize_none(status),
+                reason=sanitize_none(reason),
+                reg_no=sanitize_none(reg_no),
+            )
+            db.add(db_visit)
+        elif firstname or lastname or phone_number or id_number:
+            db_visitor = Visitor(
+                id=uuid.uuid4(),
+                firstname=firstname,
+                lastname=lastname,
+                id_number=id_number,
+                phone_number=phone_number,
+                photo=files["face"].id if "face" in files else None,
+                front_id=files["front_id"].id if "front_id" in files else None,
+                back_id=files["back_id"].id if "back_id" in files else None
+            )
+            db_visit = Visit(
+                host_employee=host_employee,
+                host_department=host_department,
+                host_service=host_service,
+                visitor=db_visitor.id,
+                vehicle=vehicle,
+                status=sanitize_none(status),
+                reason=sanitize_none(reason),
+                reg_no=sanitize_none(reg_no),
+            )
+            db.add_all([db_visitor, db_visit])
+        await db.commit()
+    except Exception as e:
+        logger.exception(e)
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
 
-        try:
-            if visitor:
-                db_visits = Visit(
-                    host_employee=host_employee,
-                    host_department=host_department,
-                    host_service=host_service,
-                    visitor=visitor,
-                    vehicle=vehicle,
-                    status=sanitize_none(status),
-                    reason=sanitize_none(reason),
-                    reg_no=sanitize_none(reg_no),
-                )
-                db.add(db_visits)
-                db.commit()
-                return JSONResponse(status_code=200, content={"visit": str(db_visits.id)})
-            
-            elif not visitor and (firstname or lastname or phone_number or id_number):
-
-                db_visitor = Visitor(
-                    firstname=firstname,
-                    lastname=lastname,
-                    id_number=id_number,
-                    phone_number=phone_number,
-                    photo=db_face.id if face else None,
-                    front_id=db_front.id if front_id else None,
-                    back_id=db_back.id if back_id else None
-                )
-                db.add(db_visitor)
-                db.commit()
-
-                db_visit = Visit(
-                    host_employee=host_employee,
-                    host_department=host_department,
-                    host_service=host_service,
-                    visitor=db_visitor.id,
-                    vehicle=vehicle,
-                    status=sanitize_none(status),
-                    reason=sanitize_none(reason),
-                    reg_no=sanitize_none(reg_no),
-                )
-                db.add(db_visit)
-                db.commit()
-                return JSONResponse(status_code=200, content={"visitor": str(db_visitor.id), "face_file_url": face_file_url})
-        except Exception as e:
-            logger.exception(e)
-            db.rollback()
-            db.close()
-            raise HTTPException(status_code=500, detail=str(e))
-        finally:
-            db.close()
+    if db_visitor is not None:
+        return JSONResponse(status_code=200, content={"visitor": str(db_visitor.id), "face_file_url": face_file_url})
+    if db_visit is not None:
+        return JSONResponse(status_code=200, content={"visit": str(db_visit.id)})
 
 
 
 @app.get("/api/v1/get-app/")
-async def get_app():
-    with next(get_db()) as db:
-        try:
-            app_version = db.query(AppVersions).order_by(AppVersions.created_at.desc()).first()
-            print(app_version)
-            return app_version
-        except Exception as e:
-            db.rollback()
-            db.close()
-            logger.exception(e)
-        finally:
-            db.close()
+async def get_app(db: AsyncSession = Depends(get_async_db)):
+    try:
+        app_version = (await db.execute(
+            select(AppVersions).order_by(AppVersions.created_at.desc())
+        )).scalars().first()
+        print(app_version)
+        return app_version
+    except Exception as e:
+        await db.rollback()
+        logger.exception(e)
 
 
 @app.get("/api/v1/get-datetime/")
@@ -632,28 +484,71 @@ async def get_datetime():
     return {"datetime": formated_time}
 
 @app.post("/api/v1/get-attendance/")
-async def get_attendance_by_date_range(start_date, end_date):
-    date_range = list(generate_date_range(start_date, end_date))
+async def get_attendance_by_date_range(start_date, end_date, db: AsyncSession = Depends(get_async_db)):
     result = {}
-    with next(get_db()) as db:
-        for date in date_range:
-            print(f"\nDate: {date.strftime('%Y-%m-%d')}")
-            
-            attendances = get_attendance_for_day(db, date)
-            attend = []
-            if attendances:
-                for attendance in attendances:
-                    employee_name = attendance.employee.firstname
-                    clock_in = attendance.clock_in_time.strftime("%H:%M:%S")
-                    clock_out = attendance.clock_out_time.strftime("%H:%M:%S") if attendance.clock_out_time else None
-                    time_spent = calculate_time_in_building(clock_in, clock_out)
-                    attend.append([employee_name, clock_in, clock_out, time_spent])
+    for day, attendances in await db.run_sync(get_attendance_by_day, start_date, end_date):
+        attend = []
+        if attendances:
+            for attendance in attendances:
+                employee_name = attendance.employee.firstname
+                clock_in = attendance.clock_in_time.strftime("%H:%M:%S")
+                clock_out = attendance.clock_out_time.strftime("%H:%M:%S") if attendance.clock_out_time else None
+                time_spent = calculate_time_in_building(clock_in, clock_out)
+                attend.append([employee_name, clock_in, clock_out, time_spent])
                     
-                    print(f"Employee: {employee_name}, Arrived: {clock_in}, Left: {clock_out}, Time in Building: {time_spent}")
-            else:
-                print("No employees were present.")
-            result[date] = attend
-        return result
+                print(f"Employee: {employee_name}, Arrived: {clock_in}, Left: {clock_out}, Time in Building: {time_spent}")
+        else:
+            print("No employees were present.")
+        result[day] = attend
+    return result
+
+
+@app.get("/api/v1/reports/csv")
+def export_report_csv(
+        report_type: ReportTypeEnum,
+        category: CategoryTypeEnum,
+        category_id: uuid.UUID,
+        from_date: date,
+        to_date: date,
+        engine: ReportEngineEnum = ReportEngineEnum.SQL
+    ):
+    filename = f"{report_type.value}_report_{from_date.isoformat()}_{to_date.isoformat()}.csv"
+    return StreamingResponse(
+        stream_report_csv(report_type.value, category.value, category_id, from_date, to_date, engine.value),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@app.post("/api/v1/reports", status_code=status.HTTP_202_ACCEPTED)
+async def submit_report_job(request: ReportJobInput, db: AsyncSession = Depends(get_async_db)):
+    report = await db.run_sync(report_jobs.submit, ReportJobRequest(
+        report_type=request.report_type.value,
+        category=request.category.value,
+        category_id=request.category_id,
+        from_date=request.from_date,
+        to_date=request.to_date,
+        file_format=request.file_format
+    ))
+    return {"job_id": str(report.id), "status": report.status.value}
+
+
+@app.get("/api/v1/reports/{job_id}")
+async def get_report_job_status(job_id: uuid.UUID, db: AsyncSession = Depends(get_async_db)):
+    report = await db.run_sync(get_report_job, job_id)
+    if not report:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    return {
+        "job_id": str(report.id),
+        "status": report.status.value,
+        "report_link": report.report_link,
+        "error": report.error
+    }
+
+
+@app.get("/api/v1/auth/token-cache")
+async def get_token_cache_stats(user: str = Depends(get_current_admin)):
+    return token_cache.stats()
 
 
 # @app.get("/api/v1/get-attendace-report")
@@ -0,0 +1,56 @@
+"""
+Synthetic benchmark for the attendance report builder.
+
+Runs build_attendance_rows over growing employee counts and date ranges and prints
+the time per (employee, day) cell, which should stay flat if the report scales linearly.
+
+    python -m benchmarks.attendance_report
+"""
+import os
+import random
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/vvims")
+
+from src.components.resolvers import build_attendance_rows
+
+
+def synthetic_data(n_employees: int, n_days: int, seed: int = 42):
+    rng = random.Random(seed)
+    from_date = date(2025, 1, 1)
+    to_date = from_date + timedelta(days=n_days - 1)
+
+    employees = [(uuid.uuid4(), f"First{i}", f"Last{i}") for i in range(n_employees)]
+    attendances = []
+    leaves = []
+    for emp_id, _, _ in employees:
+        for d in range(n_days):
+            day = from_date + timedelta(days=d)
+            if rng.random() < 0.85:
+                clock_in = datetime.combine(day, datetime.min.time()) + timedelta(minutes=rng.randint(420, 560))
+                clock_out = clock_in + timedelta(hours=rng.randint(6, 10))
+                attendances.append((emp_id, day, clock_in, clock_out, rng.random() < 0.2))
+        if rng.random() < 0.3:
+            start = from_date + timedelta(days=rng.randint(0, n_days - 1))
+            leaves.append((emp_id, start, start + timedelta(days=rng.randint(0, 10)), "Annual leave"))
+
+    return employees, attendances, leaves, from_date, to_date
+
+
+def run(n_employees: int, n_days: int) -> float:
+    employees, attendances, leaves, from_date, to_date = synthetic_data(n_employees, n_days)
+    started = time.perf_counter()
+    rows = build_attendance_rows(employees, attendances, leaves, from_date, to_date)
+    elapsed = time.perf_counter() - started
+    assert len(rows) == n_employees * n_days
+    return elapsed
+
+
+if __name__ == "__main__":
+    print(f"{'employees':>10} {'days':>6} {'cells':>10} {'seconds':>10} {'us/cell':>10}")
+    for n_employees, n_days in [(100, 31), (200, 31), (400, 31), (800, 31), (800, 92), (1600, 92)]:
+        elapsed = run(n_employees, n_days)
+        cells = n_employees * n_days
+        print(f"{n_employees:>10} {n_days:>6} {cells:>10} {elapsed:>10.3f} {elapsed / cells * 1e6:>10.2f}")
@@ -0,0 +1,79 @@
+"""
+Event fan-out benchmark against a real PostgreSQL database.
+
+Creates an event with N participants inside a transaction, then times the old per-participant
+ORM loop against the set-based UPDATE + INSERT ... SELECT used by the trigger consumer. Everything
+is rolled back at the end, so it can point at a development database:
+
+    DATABASE_URL=postgresql://localhost/vvims python -m benchmarks.event_fanout
+"""
+import os
+import time
+import uuid
+
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/vvims")
+
+from src.components.ingest import event_notifications_statement, participant_status_statement
+from src.database import SessionLocal
+from src.models import Company, Department, Employee, EmployeeNotification, EmployeeNotificationType, Event, \
+    EventParticipant, ParticipantStatus
+
+
+def seed(db, n_participants: int) -> Event:
+    company = Company(email=f"{uuid.uuid4()}@bench.local", city="Douala", region="Littoral")
+    db.add(company)
+    db.flush()
+    department = Department(company_id=company.id)
+    db.add(department)
+    db.flush()
+    employees = [
+        Employee(firstname="Bench", lastname=str(i), phone_number=str(uuid.uuid4()), password="x",
+                 company_id=company.id, department_id=department.id, function="bench")
+        for i in range(n_participants)
+    ]
+    db.add_all(employees)
+    db.flush()
+    event = Event(title="All hands", description="Quarterly all hands", orgenizer_id=employees[0].id)
+    db.add(event)
+    db.flush()
+    db.add_all([EventParticipant(event_id=event.id, employee_id=e.id, status=ParticipantStatus.COMPLETED) for e in employees])
+    db.flush()
+    return event
+
+
+def orm_loop(db, event: Event):
+    participants = db.query(EventParticipant).filter(EventParticipant.event_id == event.id).all()
+    for participant in participants:
+        participant.status = ParticipantStatus.PENDING
+        db.add(EmployeeNotification(
+            action="New events alert !", title=event.title, message=event.description, is_read=False,
+            type=EmployeeNotificationType.EVENTS, employee_id=participant.employee_id, event_id=participant.event_id
+        ))
+    db.flush()
+    return len(participants)
+
+
+def set_based(db, event: Event):
+    db.execute(participant_status_statement([event.id]))
+    return len(db.execute(event_notifications_statement({event.id: (event.title, event.description)})).all())
+
+
+def timed(fn, db, event):
+    nested = db.begin_nested()
+    started = time.perf_counter()
+    count = fn(db, event)
+    elapsed = time.perf_counter() - started
+    nested.rollback()
+    return count, elapsed
+
+
+if __name__ == "__main__":
+    print(f"{'participants':>12} {'orm loop s':>12} {'set-based s':>12} {'speed-up':>10}")
+    for n in (100, 1000):
+        with SessionLocal() as db:
+            event = seed(db, n)
+            loop_count, loop_time = timed(orm_loop, db, event)
+            set_count, set_time = timed(set_based, db, event)
+            assert loop_count == set_count == n
+            db.rollback()
+        print(f"{n:>12} {loop_time:>12.3f} {set_time:>12.3f} {loop_time / set_time:>10.1f}x")
@@ -0,0 +1,65 @@
+"""
+Login storm benchmark for password verification.
+
+Fires 50 concurrent logins at the event loop while a probe coroutine measures how late the loop
+wakes it up, once with bcrypt inline (the old behaviour) and once through the password executor.
+Prints p50/p99 for the logins and for the probe, which stands in for every other endpoint.
+
+    python -m benchmarks.login
+"""
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/vvims")
+
+from src.components.passwords import pwd_context, password_hasher
+
+CONCURRENT_LOGINS = 50
+PROBE_INTERVAL = 0.01
+
+
+def percentile(values, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def inline_login(password: str, hashed: str) -> float:
+    started = time.perf_counter()
+    await asyncio.sleep(0)
+    pwd_context.verify(password, hashed)
+    return time.perf_counter() - started
+
+
+async def executor_login(password: str, hashed: str) -> float:
+    started = time.perf_counter()
+    await password_hasher.verify_async(password, hashed)
+    return time.perf_counter() - started
+
+
+async def probe(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - started - PROBE_INTERVAL)
+
+
+async def storm(login, hashed: str):
+    lags, stop = [], asyncio.Event()
+    probe_task = asyncio.create_task(probe(lags, stop))
+    await asyncio.sleep(PROBE_INTERVAL * 2)
+    logins = await asyncio.gather(*(login("secret-password", hashed) for _ in range(CONCURRENT_LOGINS)))
+    stop.set()
+    await probe_task
+    return logins, lags
+
+
+if __name__ == "__main__":
+    hashed = pwd_context.hash("secret-password")
+    print(f"{'mode':>10} {'login p50':>10} {'login p99':>10} {'loop p99':>10} {'loop max':>10}")
+    for name, login in [("inline", inline_login), ("executor", executor_login)]:
+        logins, lags = asyncio.run(storm(login, hashed))
+        print(f"{name:>10} {statistics.median(logins):>10.3f} {percentile(logins, 99):>10.3f} "
+              f"{percentile(lags, 99):>10.3f} {max(lags):>10.3f}")
+    password_hasher.shutdown()
@@ -0,0 +1,175 @@
+"""
+Replay benchmark for the Hasura event-trigger endpoints.
+
+Builds realistic trigger payloads (body['event']['data']['new']) from rows already in a local
+PostgreSQL database and posts them to the FastAPI app in-process through httpx.AsyncClient, at a
+fixed rate. It reports acknowledgement latency, end-to-end throughput (until the ingestion queue is
+drained) and the number of SQL statements per event.
+
+The replay writes notifications and statuses like real deliveries do, so point it at a development
+database only:
+
+    DATABASE_URL=postgresql://localhost/vvims python -m benchmarks.trigger_replay --rate 200 --events 2000
+    python -m benchmarks.trigger_replay --mix attendance=1        # attendance triggers only
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timezone
+
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/vvims")
+
+import httpx
+from sqlalchemy import event as sa_event, select
+
+from app import app
+from src.components.coalesce import NOTIFICATION_FLUSH_BATCH, notification_coalescer
+from src.components.ingest import trigger_queue
+from src.database import SessionLocal, async_engine, engine
+from src.models import Attendance, Event, Message, Visit
+
+ENDPOINTS = {
+    "attendance": "/api/v1/attendance-trigger",
+    "visit": "/api/v1/visit-trigger",
+    "event": "/api/v1/events-trigger",
+    "message": "/api/v1/message-trigger",
+}
+TABLES = {"attendance": "attendance", "visit": "visits", "event": "events", "message": "messages"}
+DEFAULT_MIX = "attendance=0.5,message=0.35,visit=0.1,event=0.05"
+
+
+def _iso(value) -> str:
+    return value.isoformat() if value is not None else None
+
+
+def load_rows(limit: int = 500) -> dict:
+    """Rows the payloads are built from, as Hasura would send them."""
+    with SessionLocal() as db:
+        attendance = [
+            {"id": str(a.id), "employee_id": str(a.employee_id), "clock_in_time": _iso(a.clock_in_time),
+             "clock_in_date": _iso(a.clock_in_date), "shift_id": str(a.shift_id) if a.shift_id else None}
+            for a in db.execute(select(Attendance).where(Attendance.clock_in_time.isnot(None)).limit(limit)).scalars()
+        ]
+        visits = [
+            {"id": str(v.id), "visitor": str(v.visitor), "host_employee": str(v.host_employee)}
+            for v in db.execute(select(Visit).where(Visit.visitor.isnot(None), Visit.host_employee.isnot(None)).limit(limit)).scalars()
+        ]
+        events = [
+            {"id": str(e.id), "title": e.title, "description": e.description or e.title}
+            for e in db.execute(select(Event).limit(limit)).scalars()
+        ]
+        messages = [
+            {"id": str(m.id), "conversation_id": str(m.conversation_id), "sender_id": str(m.sender_id), "content": m.content}
+            for m in db.execute(select(Message).limit(limit)).scalars()
+        ]
+    return {"attendance": attendance, "visit": visits, "event": events, "message": messages}
+
+
+def hasura_body(table: str, new: dict) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "table": {"schema": "public", "name": table},
+        "trigger": {"name": f"{table}_insert"},
+        "event": {"op": "INSERT", "data": {"old": None, "new": new}, "session_variables": {"x-hasura-role": "admin"}},
+        "delivery_info": {"max_retries": 3, "current_retry": 0},
+    }
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        kind, weight = part.split("=")
+        weights[kind.strip()] = float(weight)
+    return weights
+
+
+def percentile(values, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+
+    def attach(self):
+        for target in (engine, async_engine.sync_engine):
+            sa_event.listen(target, "before_cursor_execute", self)
+
+    def detach(self):
+        for target in (engine, async_engine.sync_engine):
+            sa_event.remove(target, "before_cursor_execute", self)
+
+
+async def replay(rate: float, total: int, mix: dict, seed: int = 7):
+    rng = random.Random(seed)
+    rows = load_rows()
+    kinds = [kind for kind in mix if rows.get(kind)]
+    if not kinds:
+        raise SystemExit("No rows to build payloads from; seed the database first")
+    weights = [mix[kind] for kind in kinds]
+
+    latencies = {kind: [] for kind in kinds}
+    errors = 0
+    counter = QueryCounter()
+
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def fire(kind: str):
+                nonlocal errors
+                body = hasura_body(TABLES[kind], rng.choice(rows[kind]))
+                started = time.perf_counter()
+                response = await client.post(ENDPOINTS[kind], json=body)
+                latencies[kind].append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    errors += 1
+
+            counter.attach()
+            started = time.perf_counter()
+            tasks = []
+            for i in range(total):
+                # Open-loop schedule: request i goes out at i / rate whatever the previous ones did.
+                delay = started + i / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(fire(rng.choices(kinds, weights)[0])))
+            await asyncio.gather(*tasks)
+            acked = time.perf_counter() - started
+            await trigger_queue.drain()
+            # Chat notifications still inside their coalescing window are part of the work too.
+            while await notification_coalescer.flush(everything=True) == NOTIFICATION_FLUSH_BATCH:
+                pass
+            drained = time.perf_counter() - started
+            counter.detach()
+    finally:
+        await app.router.shutdown()
+
+    everything = [value for values in latencies.values() for value in values]
+    print(f"events {total}  offered {rate:.0f}/s  errors {errors}")
+    print(f"acked in {acked:.2f}s ({total / acked:.0f}/s)  processed in {drained:.2f}s ({total / drained:.0f}/s)")
+    print(f"SQL statements {counter.count}  per event {counter.count / total:.2f}")
+    print(f"{'kind':>12} {'n':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for kind, values in list(latencies.items()) + [("all", everything)]:
+        if values:
+            print(f"{kind:>12} {len(values):>6} {statistics.median(values) * 1000:>8.2f} "
+                  f"{percentile(values, 95) * 1000:>8.2f} {percentile(values, 99) * 1000:>8.2f}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Replay Hasura trigger payloads against the app")
+    arg_parser.add_argument("--rate", type=float, default=200, help="events per second")
+    arg_parser.add_argument("--events", type=int, default=2000)
+    arg_parser.add_argument("--mix", default=DEFAULT_MIX, help="kind=weight,... over attendance, visit, event, message")
+    args = arg_parser.parse_args()
+
+    asyncio.run(replay(args.rate, args.events, parse_mix(args.mix)))
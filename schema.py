@@ -1,21 +1,29 @@
 import asyncio
+import uuid
 from datetime import datetime, timedelta, timezone
 import base64
 from typing import List
 import typing
 import strawberry
 from fastapi import Depends
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.sql.coercions import expect
 from strawberry.types import Info
 from src.auth import create_token, get_current_user, oauth2_scheme
 from src.components.resolvers import generate_report
-from src.crud import pwd_context, authenticate_employee, count_attendance_percentage, total_employee_on_leave, \
+from src.components.jobs import get_report_job
+from src.crud import authenticate_employee_async, login_employee_type, count_attendance_percentage, total_employee_on_leave, \
     get_task_completion_percentage, get_visits_group_by_week_day, get_vehicle_group_by_week_day, \
     get_weekly_attendance_summary, create_conversation, accept_participate_event, deny_participate_event, \
     insert_message, get_event_by_user, \
     update_message_status, get_appointment_today_percentage
-from src.database import get_db
-from src.models import Employee, Role, EmployeeRole, Visit, Visitor
+from src.components.cache import token_cache
+from src.components.passwords import password_hasher
+from src.components.principal import principal_cache
+from src.components import versions as cache_versions
+from src.components.throttle import client_ip, login_throttle
+from src.database import get_db, AsyncSessionLocal
+from src.models import Employee, Role, EmployeeRole, Visit, Visitor, ReportStatus
 from src.schema.input_type import CreateEmployeeInput, CreateEmployeeRole, GenerateReportInput, UpdateEmployeeInput, UpdatePasswordInputType, \
     AddVisitorBrowserInputType, AttendanceInpuType, EmployeeId, CreateConvInput, ParticipantInput, MessageInput, \
     EventByUserInput, MessageStatusInput, EmployeeAppointmentId
@@ -26,8 +34,8 @@ from src.schema.output_type import EmployeeOnLeave, AttendnacePercentage, Employ
     DayAttendanceType, \
     TaskCompletionPercentage, VisitsCountByDay, VehicleCountByDay, AttendanceCountByWeek, CreateConvOutput, \
     AcceptParcipateEvent, DenyParcipateEvent, InsertMesaageOuput, EventWithUserParticipant, MessageStatusOutput, \
-    AppointmentTodayPercentage
-from src.utils import  generate_date_range, get_attendance_for_day, calculate_time_in_building
+    AppointmentTodayPercentage, ReportJobType
+from src.utils import  generate_date_range, get_attendance_for_day, get_attendance_by_day, calculate_time_in_building
 from typing import AsyncGenerator
 
 # Custom context to hold the user info
@@ -42,7 +50,8 @@ class Context:
 async def get_context(token: typing.Optional[str] = Depends(oauth2_scheme)) -> Context:
     context = Context(token=token)
     if token:
-        user_id = get_current_user(token)
+        # Off the event loop: a cache miss decodes the JWT and may refresh the revocations from the database.
+        user_id = await run_in_threadpool(get_current_user, token)
         context.set_user(user_id)
     return context
 
@@ -63,23 +72,26 @@ class Query:
         return "Strawberry"
 
     @strawberry.field
-    def login_employee(self, phone_number: str, password: str, firebase_token: typing.Optional[str] = None) -> typing.Optional[LoginReturnType]:
-        with next(get_db()) as db:
-            employee_with_role = authenticate_employee(db, phone_number, password)
-            employee_with_role.firebase_token = firebase_token if firebase_token else employee_with_role.firebase_token
+    async def login_employee(self, info: Info, phone_number: str, password: str, firebase_token: typing.Optional[str] = None) -> typing.Optional[LoginReturnType]:
+        request = info.context["request"]
+        if not await login_throttle.allow(phone_number, client_ip(request)):
+            raise Exception("Too many login attempts, try again later")
+        async with AsyncSessionLocal() as db:
+            principal = await authenticate_employee_async(db, phone_number, password)
+            # Roles and position come from the principal; only the employee row is loaded, once the password checks out.
+            employee_with_role = await db.get(Employee, principal.id)
             if employee_with_role:
-                token = create_token(employee_with_role)
+                token = create_token(principal)
                 # token = base64.b64encode(token).decode('utf-8')
                 return LoginReturnType(
                     token = f"{token}",
-                    employee = employee_with_role
+                    employee = login_employee_type(employee_with_role, principal)
                 )
             else:
                 raise Exception("Employee not found or wrong credentials")
 
     @strawberry.field
     def get_report_attandance(self, input: AttendanceInpuType) -> List[DayAttendanceType]:
-        date_range = list(generate_date_range(input.start_date, input.end_date))
         result = []
         fmt = "%H:%M:%S"
         def time_check(clock_in, clock_out):
@@ -89,11 +101,7 @@ class Query:
                 return datetime.strptime("15:00:00", fmt)
             return clock_out
         with next(get_db()) as db:
-            for date in date_range:
-                print(f"\nDate: {date.strftime('%Y-%m-%d')}")
-                
-                attendances = get_attendance_for_day(db, date)
-
+            for date, attendances in get_attendance_by_day(db, input.start_date, input.end_date):
                 attendance_list = [
                     AttendanceType(
                         employee=EmployeeAttendatceType(id=att.employee.id, firstname=att.employee.firstname, lastname=att.employee.lastname),
@@ -236,19 +244,35 @@ class Subscription:
                 finally:
                     db.close()
 
+    @strawberry.subscription
+    async def report_job(self, job_id: uuid.UUID) -> AsyncGenerator[ReportJobType, None]:
+        while True:
+            with next(get_db()) as db:
+                report = get_report_job(db, job_id)
+                if not report:
+                    raise Exception("Report job not found")
+                yield ReportJobType(
+                    id=report.id,
+                    status=report.status.value,
+                    report_link=report.report_link,
+                    error=report.error
+                )
+                if report.status in (ReportStatus.COMPLETED, ReportStatus.FAILED):
+                    return
+            await asyncio.sleep(2)
+
 @strawberry.type
 class Mutation:
     @strawberry.mutation
-    def create_employee(self, employee: CreateEmployeeInput) -> EmployeeCreationType:
+    async def create_employee(self, employee: CreateEmployeeInput) -> EmployeeCreationType:
         """
         Function that adds an employee to the database to a specific
         department, services, company, agency if provided, and roles in the company.
         :param employee:
         :return EmployeeCreationType:
         """
+        hashed_pwd = await password_hasher.hash_async(employee.password)
         with next(get_db()) as db:
-            hashed_pwd = pwd_context.hash(employee.password)
-            print("Hashed password:", hashed_pwd)
             db_employee = Employee(
                 firstname=employee.firstname,
                 lastname=employee.lastname,
@@ -326,8 +350,10 @@ class Mutation:
                 if db.query(Employee).filter(Employee.phone_number == employee.phone_number).first() and user.phone_number != employee.phone_number :
                     raise Exception("Someone with this phone number exist already")
                 user.phone_number = employee.phone_number if employee.phone_number else user.phone_number
+                db.execute(cache_versions.bump_statement([cache_versions.PRINCIPALS]))
 
                 db.commit()
+                principal_cache.invalidate(user.id)
                 return EmployeeUpdateType(
                     id=user.id,
                     firstname=user.firstname,
@@ -343,28 +369,29 @@ class Mutation:
                 db.close()
 
     @strawberry.mutation
-    def update_employee_password(self, employeeInfo: UpdatePasswordInputType) -> UpdatePasswordOutputType:
+    async def update_employee_password(self, employeeInfo: UpdatePasswordInputType) -> UpdatePasswordOutputType:
 
-        with next(get_db()) as db:
+        async with AsyncSessionLocal() as db:
             try:
-                employee = authenticate_employee(db, employeeInfo.phone_number, employeeInfo.current_password)
-                hashed_pwd = pwd_context.hash(employeeInfo.new_password)
+                principal = await authenticate_employee_async(db, employeeInfo.phone_number, employeeInfo.current_password)
+                hashed_pwd = await password_hasher.hash_async(employeeInfo.new_password)
+                employee = await db.get(Employee, principal.id)
                 employee.password = hashed_pwd
                 employee.password_change_at = datetime.now()
-                db.commit()
-                db.refresh(employee)
+                await db.execute(token_cache.revoke_statement(employee.id, employee.password_change_at))
+                await db.execute(cache_versions.bump_statement([cache_versions.PRINCIPALS]))
+                await db.commit()
+                principal_cache.invalidate(employee.id)
+                token_cache.revoke(employee.id, employee.password_change_at)
 
                 return UpdatePasswordOutputType(
                     success = "Password successfully updated"
                 )
             except Exception as e:
 
-                db.rollback()
-                db.close()
+                await db.rollback()
                 logger.exception(e)
                 raise Exception(f"Internal error: {e}")
-            finally:
-                db.close()
 
     @strawberry.mutation
     def create_visitor(self, visitor: AddVisitorBrowserInputType) -> CreateVisitorType:
@@ -480,7 +507,8 @@ class Mutation:
                 category_id=input.category_id,
                 from_date=input.from_date,
                 to_date=input.to_date,
-                db= db
+                db= db,
+                engine=input.engine.value
             )
             except Exception as e:
                 logger.error(f"{e}")
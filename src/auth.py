@@ -3,7 +3,8 @@ from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 import jwt
 from src import logger
-from src.models import Employee
+from src.components.cache import token_cache
+from src.components.principal import EmployeePrincipal
 import time
 
 
@@ -22,13 +23,12 @@ def check_role(role_array, is_admin):
     elif "employee" in role_array:
         return "employee"
 
-def create_token(employee: Employee) -> str:
-    is_admin = any(role.role.role_name =="ADMIN" for  role in employee.roles)
-    role_array = [role.role.role_name.lower() for role in employee.roles]
-    print("Roles: ", role_array)
+def create_token(employee: EmployeePrincipal) -> str:
+    is_admin = any(role_name == "ADMIN" for role_name in employee.roles)
+    role_array = [role_name.lower() for role_name in employee.roles]
     data = {
         "sub": str(employee.id),
-        "name": employee.firstname + " " + employee.lastname,
+        "name": employee.name,
         "iat": datetime.now(timezone.utc),
         "admin": is_admin,
         "https://hasura.io/jwt/claims":{
@@ -36,29 +36,44 @@ def create_token(employee: Employee) -> str:
             "x-hasura-role": check_role(role_array, is_admin),
             "x-hasura-default-role" : check_role(role_array, is_admin),
             "x-hasura-user-id": str(employee.id),
-            "x-hasura-employee-level": str(employee.position.level)
+            "x-hasura-employee-level": str(employee.level)
         }
     }
     token = jwt.encode(data, JWT_SECRET_KEY, algorithm=ALGORITHM)
     return token
 
-def verify_token(token: str, credentials_exception):
+def verify_token_claims(token: str, credentials_exception) -> dict:
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get('sub')
-        if user_id is None:
-            raise credentials_exception
-        else:
-            print(user_id)
-            return user_id
-    except Exception as e:
+    except jwt.PyJWTError as e:
         logger.exception(e)
         raise  HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token ")
+    user_id = payload.get('sub')
+    if user_id is None:
+        raise credentials_exception
+    if token_cache.is_revoked(payload):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token revoked")
+    token_cache.put(token, payload)
+    return payload
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
+def verify_token(token: str, credentials_exception):
+    return verify_token_claims(token, credentials_exception)['sub']
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    return verify_token(token, credentials_exception)
\ No newline at end of file
+
+def get_current_user(token: str = Depends(oauth2_scheme)):
+    return verify_token(token, _credentials_exception())
+
+def get_current_admin(token: str = Depends(oauth2_scheme)):
+    claims = verify_token_claims(token, _credentials_exception())
+    if not claims.get('admin'):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
+    return claims['sub']
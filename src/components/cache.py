@@ -0,0 +1,242 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from src import logger
+from src.database import SessionLocal
+from src.models import ReportDataVersion, TokenRevocation
+from src.schema.output_type import ReportResult
+
+REPORT_CACHE_SIZE = int(os.getenv('REPORT_CACHE_SIZE', '128'))
+
+# Which data each report type is built from.
+REPORT_SOURCES = {
+    "attendance": ("attendance", "leaves"),
+    "visits": ("visits",),
+    "leaves": ("leaves",),
+}
+
+
+class ReportCache:
+    """
+    LRU cache of generated reports keyed by (report_type, category, category_id, from_date, to_date, engine).
+
+    Every entry remembers the data versions of the tables it was built from. The versions live in
+    the report_data_versions table and are bumped in the same transaction as the change they stand
+    for, so a change seen by any worker or replica makes the entries for open periods stale in all
+    of them. Reports that end before the current month are treated as closed and served without a
+    version check: generate_report does not even read the versions for them.
+    """
+
+    def __init__(self, maxsize: int = REPORT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, Tuple[Tuple[int, ...], ReportResult]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(report_type: str, category: str, category_id: uuid.UUID, from_date: date, to_date: date,
+            engine: str) -> Hashable:
+        return report_type, category, str(category_id), from_date, to_date, engine
+
+    @staticmethod
+    def is_closed(to_date: date, today: Optional[date] = None) -> bool:
+        today = today or date.today()
+        return to_date < today.replace(day=1)
+
+    @staticmethod
+    def version(db: Session, report_type: str) -> Tuple[int, ...]:
+        """Current data version of a report type, read from the shared counters (one query)."""
+        sources = REPORT_SOURCES.get(report_type, ())
+        versions = dict(db.execute(
+            select(ReportDataVersion.source, ReportDataVersion.version).where(ReportDataVersion.source.in_(sources))
+        ).all())
+        return tuple(versions.get(source, 0) for source in sources)
+
+    def get(self, report_type: str, category: str, category_id: uuid.UUID, from_date: date, to_date: date,
+            engine: str, version: Tuple[int, ...]) -> Optional[ReportResult]:
+        key = self.key(report_type, category, category_id, from_date, to_date, engine)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.is_closed(to_date) or entry[0] == version):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, report_type: str, category: str, category_id: uuid.UUID, from_date: date, to_date: date,
+            engine: str, result: ReportResult, version: Tuple[int, ...]):
+        """Stores a result under the data version read before it was built, so a concurrent bump invalidates it."""
+        key = self.key(report_type, category, category_id, from_date, to_date, engine)
+        with self._lock:
+            self._entries[key] = (version, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def bump_statement(sources: Iterable[str]):
+        """
+        Marks the given data sources ('attendance', 'visits' or 'leaves') as changed. Meant to run
+        in the transaction that changes them.
+        """
+        stmt = insert(ReportDataVersion).values([{"source": source, "version": 1} for source in sorted(sources)])
+        return stmt.on_conflict_do_update(
+            index_elements=[ReportDataVersion.source],
+            set_={"version": ReportDataVersion.version + 1, "updated_at": func.now()}
+        )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+report_cache = ReportCache()
+
+
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '4096'))
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', '300'))
+# How often each process picks up the revocations recorded by the others.
+TOKEN_REVOCATION_REFRESH_SECONDS = float(os.getenv('TOKEN_REVOCATION_REFRESH_SECONDS', '5'))
+# Re-read window behind the newest revocation seen, for transactions that committed late.
+TOKEN_REVOCATION_OVERLAP = timedelta(seconds=60)
+
+
+class TokenCache:
+    """
+    Bounded LRU of verified JWT claims keyed by a SHA-256 digest of the token.
+
+    An entry lives for TOKEN_CACHE_TTL seconds, or until the token's own `exp`, whichever comes
+    first. Revocations (every token of an employee issued before a given time, e.g. the
+    password_change_at of a password update) are stored in the token_revocations table, written
+    with revoke_statement() in the transaction that causes them. Each process reads the new rows
+    every TOKEN_REVOCATION_REFRESH_SECONDS, so a token revoked in one worker is rejected by all of
+    them within that delay, whether or not it is cached.
+    """
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, ttl: int = TOKEN_CACHE_TTL,
+                 refresh: float = TOKEN_REVOCATION_REFRESH_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.refresh = refresh
+        self._entries: "OrderedDict[bytes, Tuple[float, dict]]" = OrderedDict()
+        self._revoked_before: Dict[str, int] = {}
+        self._revocations_due = 0.0
+        self._revocations_seen: Optional[datetime] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def _is_revoked(self, claims: dict) -> bool:
+        revoked_before = self._revoked_before.get(claims.get('sub'))
+        return revoked_before is not None and int(claims.get('iat', 0)) < revoked_before
+
+    def _remember(self, user_id, issued_before: datetime):
+        user_id = str(user_id)
+        self._revoked_before[user_id] = max(self._revoked_before.get(user_id, 0), int(issued_before.timestamp()))
+
+    def refresh_revocations(self):
+        """Loads the revocations recorded since the last refresh, at most once every `refresh` seconds."""
+        now = time.monotonic()
+        with self._lock:
+            if now < self._revocations_due:
+                return
+            self._revocations_due = now + self.refresh
+            seen = self._revocations_seen
+
+        stmt = select(TokenRevocation.employee_id, TokenRevocation.revoked_before, TokenRevocation.updated_at)
+        if seen is not None:
+            stmt = stmt.where(TokenRevocation.updated_at > seen - TOKEN_REVOCATION_OVERLAP)
+        try:
+            with SessionLocal() as db:
+                rows = db.execute(stmt).all()
+        except Exception as e:
+            # Keep what is known and try again at the next refresh.
+            logger.exception(e)
+            return
+
+        with self._lock:
+            for employee_id, revoked_before, updated_at in rows:
+                self._remember(employee_id, revoked_before)
+                if updated_at is not None and (self._revocations_seen is None or updated_at > self._revocations_seen):
+                    self._revocations_seen = updated_at
+
+    def get(self, token: str) -> Optional[dict]:
+        self.refresh_revocations()
+        key = self.key(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now and not self._is_revoked(entry[1]):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, claims: dict):
+        expires_at = time.time() + self.ttl
+        if 'exp' in claims:
+            expires_at = min(expires_at, float(claims['exp']))
+        key = self.key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def is_revoked(self, claims: dict) -> bool:
+        self.refresh_revocations()
+        with self._lock:
+            return self._is_revoked(claims)
+
+    @staticmethod
+    def revoke_statement(user_id, issued_before: datetime):
+        """
+        Records that tokens of user_id issued before issued_before are revoked. Meant to run in the
+        transaction that causes the revocation; tokens from the same second stay valid.
+        """
+        stmt = insert(TokenRevocation).values(employee_id=user_id, revoked_before=issued_before.astimezone(timezone.utc))
+        return stmt.on_conflict_do_update(
+            index_elements=[TokenRevocation.employee_id],
+            set_={
+                "revoked_before": func.greatest(TokenRevocation.revoked_before, stmt.excluded.revoked_before),
+                "updated_at": func.now()
+            }
+        )
+
+    def revoke(self, user_id, issued_before: datetime):
+        """Applies a revocation committed with revoke_statement() to this process without waiting for the refresh."""
+        with self._lock:
+            self._remember(user_id, issued_before)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "revocations": len(self._revoked_before),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+
+token_cache = TokenCache()
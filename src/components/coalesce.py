@@ -0,0 +1,188 @@
+"""
+Coalescing of chat notifications.
+
+A burst of messages from one conversation to one receiver becomes a single notification row and a
+single push carrying the message count. The window opens with the first message of a burst and is
+flushed NOTIFICATION_COALESCE_MS later, so no notification is held back longer than that.
+NOTIFICATION_COALESCE_MS=0 turns coalescing off.
+
+Pending notifications are rows of pending_chat_notifications, written by pending_statement() in the
+transaction that claims the message events: a crash during the window loses nothing. A flush moves
+the due rows to employee_notifications in one transaction, then pushes. Each process flushes the
+bursts it saw when their window ends, and polls every NOTIFICATION_POLL_SECONDS for rows left by
+another process or by one that died.
+"""
+import asyncio
+import os
+import uuid
+from datetime import timedelta
+from typing import Iterable, List, Optional, Tuple
+from sqlalchemy import delete, func, insert, literal, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from src import logger
+from src.components.push import PushMessage, push_queue
+from src.database import AsyncSessionLocal
+from src.models import EmployeeNotification, EmployeeNotificationType, PendingChatNotification
+
+NOTIFICATION_COALESCE_MS = int(os.getenv('NOTIFICATION_COALESCE_MS', '2000'))
+NOTIFICATION_POLL_SECONDS = float(os.getenv('NOTIFICATION_POLL_SECONDS', '5'))
+NOTIFICATION_FLUSH_BATCH = int(os.getenv('NOTIFICATION_FLUSH_BATCH', '500'))
+NOTIFICATION_RETRY_BASE_SECONDS = float(os.getenv('NOTIFICATION_RETRY_BASE_SECONDS', '1'))
+NOTIFICATION_RETRY_MAX_SECONDS = float(os.getenv('NOTIFICATION_RETRY_MAX_SECONDS', '60'))
+
+# (receiver, conversation, title, message, message_id), in message order.
+ChatNotification = Tuple[uuid.UUID, uuid.UUID, str, str, uuid.UUID]
+
+
+def merge_notifications(notifications: Iterable[ChatNotification]) -> List[dict]:
+    """
+    One pending row per (receiver, conversation) of a batch, keeping its last message; an upsert
+    cannot touch the same row twice.
+    """
+    merged = {}
+    for receiver_id, conversation_id, title, message, message_id in notifications:
+        key = (receiver_id, conversation_id)
+        count = merged[key]["count"] + 1 if key in merged else 1
+        merged[key] = {
+            "receiver_id": receiver_id, "conversation_id": conversation_id, "title": title,
+            "message": message, "message_id": message_id, "count": count
+        }
+    return list(merged.values())
+
+
+def notification_row(pending) -> dict:
+    return {
+        "action": "New message!",
+        "title": pending.title,
+        "message": pending.message if pending.count == 1 else f"{pending.count} new messages",
+        "is_read": False,
+        "type": EmployeeNotificationType.MESSAGES,
+        "employee_id": pending.receiver_id,
+        "message_id": pending.message_id
+    }
+
+
+def notification_push(pending) -> PushMessage:
+    return PushMessage(
+        employee_id=pending.receiver_id,
+        title=pending.title,
+        body=notification_row(pending)["message"],
+        data={"message_id": str(pending.message_id), "conversation_id": str(pending.conversation_id),
+              "count": str(pending.count)}
+    )
+
+
+class NotificationCoalescer:
+    """Flushes pending_chat_notifications when their window ends, from a background task."""
+
+    def __init__(self, window_ms: int = NOTIFICATION_COALESCE_MS, poll_seconds: float = NOTIFICATION_POLL_SECONDS):
+        self.window = window_ms / 1000
+        self.poll = poll_seconds
+        self._next_flush = float('inf')
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.received = 0
+        self.flushed = 0
+        self.failed = 0
+
+    def pending_statement(self, notifications: Iterable[ChatNotification]):
+        """
+        Upserts a batch's chat notifications into pending_chat_notifications. Meant to run in the
+        transaction that claims the message events. A burst keeps the flush time of its first message.
+        """
+        rows = merge_notifications(notifications)
+        flush_after = func.now() + literal(timedelta(seconds=self.window))
+        stmt = pg_insert(PendingChatNotification).values([{**row, "flush_after": flush_after} for row in rows])
+        return stmt.on_conflict_do_update(
+            index_elements=[PendingChatNotification.receiver_id, PendingChatNotification.conversation_id],
+            set_={
+                "count": PendingChatNotification.count + stmt.excluded.count,
+                "title": stmt.excluded.title,
+                "message": stmt.excluded.message,
+                "message_id": stmt.excluded.message_id
+            }
+        )
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._flusher())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # The rows outlive the process; flushing them now only spares their receivers the wait.
+        try:
+            while await self.flush(everything=True) == NOTIFICATION_FLUSH_BATCH:
+                pass
+        except Exception as e:
+            logger.exception(e)
+
+    def schedule(self, count: int):
+        """Called once a batch's pending rows are committed: flushes them when their window ends."""
+        if count <= 0:
+            return
+        self.received += count
+        if self._task is None:
+            return
+        self._next_flush = min(self._next_flush, asyncio.get_running_loop().time() + self.window)
+        self._wakeup.set()
+
+    async def _flusher(self):
+        loop = asyncio.get_running_loop()
+        next_poll = loop.time()
+        failures = 0
+        while True:
+            delay = min(next_poll, self._next_flush) - loop.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._next_flush = float('inf')
+            try:
+                flushed = await self.flush()
+                failures = 0
+                next_poll = loop.time() if flushed == NOTIFICATION_FLUSH_BATCH else loop.time() + self.poll
+            except Exception as e:
+                # The rows are still there; try again after a backoff.
+                logger.exception(e)
+                failures += 1
+                next_poll = loop.time() + min(NOTIFICATION_RETRY_BASE_SECONDS * 2 ** (failures - 1),
+                                              NOTIFICATION_RETRY_MAX_SECONDS)
+
+    async def flush(self, everything: bool = False) -> int:
+        """
+        Moves the due pending rows (all of them with everything=True) to employee_notifications in
+        one transaction and pushes them. Rows another process is flushing are skipped.
+        :return: The number of notifications flushed.
+        """
+        due = select(PendingChatNotification.receiver_id, PendingChatNotification.conversation_id)
+        if not everything:
+            due = due.where(PendingChatNotification.flush_after <= func.now())
+        due = due.order_by(PendingChatNotification.flush_after).limit(NOTIFICATION_FLUSH_BATCH) \
+            .with_for_update(skip_locked=True)
+        async with AsyncSessionLocal() as db:
+            try:
+                pending = (await db.execute(
+                    delete(PendingChatNotification)
+                    .where(tuple_(PendingChatNotification.receiver_id, PendingChatNotification.conversation_id).in_(due))
+                    .returning(PendingChatNotification)
+                )).scalars().all()
+                if pending:
+                    await db.execute(insert(EmployeeNotification), [notification_row(p) for p in pending])
+                await db.commit()
+            except Exception:
+                self.failed += 1
+                await db.rollback()
+                raise
+        self.flushed += len(pending)
+        if pending:
+            push_queue.enqueue([notification_push(p) for p in pending])
+        return len(pending)
+
+
+notification_coalescer = NotificationCoalescer()
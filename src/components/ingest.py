@@ -0,0 +1,632 @@
+"""
+Ingestion queue for the Hasura event triggers.
+
+The trigger endpoints validate the payload, save it in the trigger_inbox table and enqueue it, so
+Hasura gets its answer as soon as the event is durable. A single consumer drains the queue in
+batches and writes each batch in one transaction: one lookup query per kind of event and one bulk
+insert per table. The batch's inbox rows are deleted in that same transaction. An event that fails
+stays in the inbox and is retried with exponential backoff; events left behind by a restart or a
+crash are picked up by the same sweep.
+
+Hasura redelivers on timeouts, so events are deduplicated on their event.id: first by an
+in-memory set of recently seen ids, then by the processed_trigger_events table, which is
+written in the same transaction as the event's effects.
+"""
+import asyncio
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from dateutil import parser
+from fastapi import HTTPException, status
+from sqlalchemy import String, and_, case, cast, column, delete, func, insert, literal, select, update, values
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from src import logger
+from src.components.cache import report_cache
+from src.components.rollup import refresh_rollup_statement
+from src.components.coalesce import notification_coalescer
+from src.components.lateness import evaluate, load_rules
+from src.components.push import PushMessage, push_queue
+from src.database import AsyncSessionLocal
+from src.models import Attachment, AttendanceState, Conversation, Employee, EmployeeConversation, \
+    EmployeeNotification, EmployeeNotificationType, EventParticipant, Message, MessageStatus, MessageStatuses, \
+    ParticipantStatus, ProcessedTriggerEvent, TriggerInbox, Visitor
+
+TRIGGER_QUEUE_SIZE = int(os.getenv('TRIGGER_QUEUE_SIZE', '10000'))
+TRIGGER_BATCH_SIZE = int(os.getenv('TRIGGER_BATCH_SIZE', '200'))
+TRIGGER_BATCH_WAIT_MS = int(os.getenv('TRIGGER_BATCH_WAIT_MS', '50'))
+TRIGGER_SEEN_SIZE = int(os.getenv('TRIGGER_SEEN_SIZE', '100000'))
+TRIGGER_EVENT_RETENTION_DAYS = int(os.getenv('TRIGGER_EVENT_RETENTION_DAYS', '7'))
+TRIGGER_SWEEP_SECONDS = int(os.getenv('TRIGGER_SWEEP_SECONDS', '15'))
+# How long a queued or swept event belongs to the process holding it before a sweep may take it.
+TRIGGER_LEASE_SECONDS = int(os.getenv('TRIGGER_LEASE_SECONDS', '60'))
+TRIGGER_RETRY_BASE_SECONDS = int(os.getenv('TRIGGER_RETRY_BASE_SECONDS', '5'))
+TRIGGER_RETRY_MAX_SECONDS = int(os.getenv('TRIGGER_RETRY_MAX_SECONDS', '3600'))
+# Attempts after which an event is marked failed and left in the inbox for an operator.
+TRIGGER_MAX_ATTEMPTS = int(os.getenv('TRIGGER_MAX_ATTEMPTS', '10'))
+INBOX_PENDING = 'pending'
+INBOX_FAILED = 'failed'
+
+# Fields of the new row each kind of event cannot be processed without.
+REQUIRED_FIELDS = {
+    "attendance": ("id", "employee_id", "clock_in_time"),
+    "visit": ("id", "visitor", "host_employee"),
+    "event": ("id", "title", "description"),
+    "message": ("id", "conversation_id", "sender_id"),
+}
+
+ATTACHMENT_ICONS = {
+    'DOCUMENT': '📄',
+    'VOICE': '🎤',
+    'IMAGE': '🏞',
+    'AUDIO': '🎵',
+    'VIDEO': '🎥'
+}
+
+
+@dataclass
+class TriggerEvent:
+    kind: str
+    event_id: Optional[str]
+    data: dict
+    op: str = "INSERT"
+
+
+@dataclass
+class TriggerBatch:
+    """Rows collected from a batch of events, written with one statement per table."""
+    attendance_states: List[dict] = field(default_factory=list)
+    notifications: List[dict] = field(default_factory=list)
+    message_statuses: List[dict] = field(default_factory=list)
+    events: Dict[uuid.UUID, Tuple[str, str]] = field(default_factory=dict)
+    pushes: List[PushMessage] = field(default_factory=list)
+    # (receiver, conversation, title, message, message_id), saved as pending chat notifications.
+    chat_notifications: List[Tuple[uuid.UUID, uuid.UUID, str, str, uuid.UUID]] = field(default_factory=list)
+    rollups: Set[Tuple[uuid.UUID, date]] = field(default_factory=set)
+    touched: Set[str] = field(default_factory=set)
+    # event_id -> reason, for events that could not be handled yet; they stay in the inbox unclaimed.
+    skipped: Dict[str, str] = field(default_factory=dict)
+
+    def skip(self, event: "TriggerEvent", reason: str):
+        logger.warning(f"{event.kind} event {event.event_id} skipped, will be retried: {reason}")
+        if event.event_id:
+            self.skipped[event.event_id] = reason
+
+
+class SeenEvents:
+    """Bounded, insertion-ordered set of the most recent Hasura event ids."""
+
+    def __init__(self, maxsize: int = TRIGGER_SEEN_SIZE):
+        self.maxsize = maxsize
+        self._ids: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def add(self, event_id: str) -> bool:
+        """Records event_id and returns False if it was already there."""
+        with self._lock:
+            if event_id in self._ids:
+                self.duplicates += 1
+                return False
+            self._ids[event_id] = None
+            while len(self._ids) > self.maxsize:
+                self._ids.popitem(last=False)
+            return True
+
+    def discard(self, event_id: str):
+        with self._lock:
+            self._ids.pop(event_id, None)
+
+
+def parse_trigger_event(kind: str, body: dict) -> TriggerEvent:
+    """
+    Validates a Hasura event-trigger body and returns the event to enqueue.
+    :param kind: One of REQUIRED_FIELDS' keys.
+    :param body: The request body Hasura posted.
+    :return:
+    """
+    try:
+        data = body['event']['data']['new']
+    except (KeyError, TypeError):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Not a Hasura event payload")
+    if not data:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Event has no new row")
+    missing = [name for name in REQUIRED_FIELDS[kind] if data.get(name) is None]
+    if missing:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Missing fields: {', '.join(missing)}")
+    return TriggerEvent(kind=kind, event_id=body.get('id'), data=data, op=body['event'].get('op') or "INSERT")
+
+
+def _attendance_day(data: dict, clock_in_time: datetime) -> date:
+    clock_in_date = data.get('clock_in_date')
+    return parser.isoparse(clock_in_date).date() if clock_in_date else clock_in_time.date()
+
+
+async def _collect_attendance(db: AsyncSession, events: List[TriggerEvent], batch: TriggerBatch):
+    # Lateness is judged once, on the clock-in. Updates (the clock-out) only refresh the day's rollup.
+    for event in events:
+        if event.op != "INSERT":
+            clock_in_time = parser.isoparse(event.data['clock_in_time'])
+            batch.rollups.add((uuid.UUID(str(event.data['employee_id'])), _attendance_day(event.data, clock_in_time)))
+    events = [event for event in events if event.op == "INSERT"]
+
+    clock_ins = [
+        (
+            uuid.UUID(str(event.data['employee_id'])),
+            parser.isoparse(event.data['clock_in_time']),
+            uuid.UUID(str(event.data['shift_id'])) if event.data.get('shift_id') else None
+        ) for event in events
+    ]
+    rules, shifts = await load_rules(db, {employee_id for employee_id, _, _ in clock_ins})
+    flags = evaluate(rules, shifts, clock_ins)
+    for event, (employee_id, clock_in_time, _), is_late in zip(events, clock_ins, flags):
+        data = event.data
+        # The day is on the dashboards whether or not its lateness could be judged yet.
+        batch.rollups.add((employee_id, _attendance_day(data, clock_in_time)))
+        if is_late is None:
+            batch.skip(event, f"no shift or company settings for employee {employee_id}, attendance {data['id']}")
+            continue
+        batch.attendance_states.append({"attendance_id": data['id'], "is_late": is_late})
+    batch.touched.add("attendance")
+
+
+async def _collect_visits(db: AsyncSession, events: List[TriggerEvent], batch: TriggerBatch):
+    visitor_ids = {uuid.UUID(str(event.data['visitor'])) for event in events}
+    visitors = {
+        row.id: row for row in (await db.execute(
+            select(Visitor.id, Visitor.firstname, Visitor.lastname).where(Visitor.id.in_(visitor_ids))
+        )).all()
+    }
+    for event in events:
+        data = event.data
+        visitor = visitors.get(uuid.UUID(str(data['visitor'])))
+        if visitor is None:
+            batch.skip(event, f"visitor {data['visitor']} not found, visit {data['id']}")
+            continue
+        batch.notifications.append({
+            "employee_id": data['host_employee'],
+            "action": "New Visitor",
+            "type": EmployeeNotificationType.VISITS,
+            "title": "New Visitor Alert !",
+            "message": f"{visitor.firstname} {visitor.lastname} is paying you a visit!",
+            "visits_id": data['id'],
+            "is_read": False
+        })
+    batch.touched.add("visits")
+
+
+async def _collect_events(db: AsyncSession, events: List[TriggerEvent], batch: TriggerBatch):
+    # Participants are never loaded here: the fan-out is two set-based statements in write_batch.
+    for event in events:
+        batch.events[uuid.UUID(str(event.data['id']))] = (event.data['title'], event.data['description'])
+
+
+def participant_status_statement(event_ids: Iterable[uuid.UUID]):
+    """UPDATE event_participants SET status = 'PENDING' WHERE event_id IN (...)."""
+    return (
+        update(EventParticipant.__table__)
+        .where(EventParticipant.event_id.in_(list(event_ids)))
+        .values(status=ParticipantStatus.PENDING)
+    )
+
+
+def event_notifications_statement(events: Dict[uuid.UUID, Tuple[str, str]]):
+    """
+    INSERT ... SELECT of one notification per participant of each event, joined against the
+    events' titles and descriptions passed as a VALUES list. Returns the inserted rows for push.
+    """
+    new_events = values(
+        column('event_id', UUID(as_uuid=True)), column('title', String), column('description', String),
+        name='new_events'
+    ).data([(event_id, title, description) for event_id, (title, description) in events.items()])
+    notifications = EmployeeNotification.__table__
+    return (
+        insert(notifications)
+        .from_select(
+            ['id', 'employee_id', 'event_id', 'action', 'title', 'message', 'is_read', 'type'],
+            select(
+                func.gen_random_uuid(),
+                EventParticipant.employee_id,
+                EventParticipant.event_id,
+                literal("New events alert !"),
+                new_events.c.title,
+                new_events.c.description,
+                literal(False),
+                cast(literal(EmployeeNotificationType.EVENTS, notifications.c.type.type), notifications.c.type.type)
+            ).join(new_events, new_events.c.event_id == EventParticipant.event_id)
+        )
+        .returning(notifications.c.employee_id, notifications.c.event_id, notifications.c.title, notifications.c.message)
+    )
+
+
+def message_fan_out_statement(message_ids: Iterable[uuid.UUID]):
+    """
+    One row per (message, receiver) for every message of the batch: sender name, conversation,
+    the message's own attachment type and each conversation member other than the sender. A
+    message nobody else can receive still yields one row with a NULL receiver.
+    """
+    # '' for an attachment without a type, NULL for no attachment at all.
+    file_type = (
+        select(func.coalesce(Attachment.file_type, ''))
+        .where(Attachment.message_id == Message.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    return (
+        select(
+            Message.id,
+            Message.sender_id,
+            Message.conversation_id,
+            Message.content,
+            Employee.firstname,
+            Employee.lastname,
+            Conversation.is_group,
+            Conversation.name.label('conversation_name'),
+            file_type.label('file_type'),
+            EmployeeConversation.employee_id.label('receiver_id')
+        )
+        .join(Employee, Employee.id == Message.sender_id)
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .outerjoin(EmployeeConversation, and_(
+            EmployeeConversation.conversation_id == Message.conversation_id,
+            EmployeeConversation.employee_id != Message.sender_id
+        ))
+        .where(Message.id.in_(list(message_ids)))
+    )
+
+
+def compose_message_notification(row) -> Tuple[str, str]:
+    """Title and text of the notification for one fan-out row."""
+    title = f"{row.firstname} {row.lastname}"
+    if row.is_group and row.conversation_name:
+        title = f"{title} ({row.conversation_name})"
+    if row.file_type is not None:
+        file_type = row.file_type or "file"
+        content = row.content if row.content is not None else file_type.capitalize()
+        return title, f"{ATTACHMENT_ICONS.get(file_type, '📎')} {content}"
+    return title, row.content or ""
+
+
+async def _collect_messages(db: AsyncSession, events: List[TriggerEvent], batch: TriggerBatch):
+    rows = (await db.execute(
+        message_fan_out_statement({uuid.UUID(str(event.data['id'])) for event in events})
+    )).all()
+    seen_messages = set()
+    for row in rows:
+        if row.id not in seen_messages:
+            seen_messages.add(row.id)
+            batch.message_statuses.append({
+                "employee_id": row.sender_id,
+                "status": MessageStatuses.SENT,
+                "message_id": row.id
+            })
+        if row.receiver_id is None:
+            continue
+        title, message = compose_message_notification(row)
+        batch.chat_notifications.append((row.receiver_id, row.conversation_id, title, message, row.id))
+
+
+COLLECTORS = {
+    "attendance": _collect_attendance,
+    "visit": _collect_visits,
+    "event": _collect_events,
+    "message": _collect_messages,
+}
+
+
+async def claim_events(db: AsyncSession, events: List[TriggerEvent]) -> List[TriggerEvent]:
+    """
+    Records the batch's event ids as processed and returns only the events that were not yet,
+    in the caller's transaction so the record and the effects commit or roll back together.
+    """
+    kinds = {event.event_id: event.kind for event in events if event.event_id}
+    if not kinds:
+        return events
+    claimed = set((await db.execute(
+        pg_insert(ProcessedTriggerEvent)
+        .values([{"event_id": event_id, "kind": kind} for event_id, kind in kinds.items()])
+        .on_conflict_do_nothing(index_elements=[ProcessedTriggerEvent.event_id])
+        .returning(ProcessedTriggerEvent.event_id)
+    )).scalars())
+    fresh = []
+    for event in events:
+        if event.event_id is None:
+            fresh.append(event)
+        elif event.event_id in claimed:
+            claimed.discard(event.event_id)
+            fresh.append(event)
+    return fresh
+
+
+def retry_statement(event_id: str, error: str):
+    """
+    Keeps an event in the inbox and pushes its next attempt back exponentially with its attempts.
+    Once it reaches its max_attempts it is marked failed and no longer swept; setting it back to
+    pending with attempts at 0 replays it. Returns the event's new status.
+    """
+    backoff = func.least(TRIGGER_RETRY_BASE_SECONDS * func.power(2, TriggerInbox.attempts), TRIGGER_RETRY_MAX_SECONDS)
+    return (
+        update(TriggerInbox)
+        .where(TriggerInbox.event_id == event_id)
+        .values(
+            attempts=TriggerInbox.attempts + 1,
+            next_attempt_at=func.now() + literal(timedelta(seconds=1)) * backoff,
+            last_error=error,
+            status=case((TriggerInbox.attempts + 1 >= TriggerInbox.max_attempts, INBOX_FAILED), else_=TriggerInbox.status)
+        )
+        .returning(TriggerInbox.status)
+    )
+
+
+async def retry_event(db: AsyncSession, event_id: str, error: str):
+    if (await db.execute(retry_statement(event_id, error))).scalar() == INBOX_FAILED:
+        logger.error(f"Trigger event {event_id} gave up after its last attempt, left failed in the inbox: {error}")
+
+
+async def write_batch(db: AsyncSession, events: List[TriggerEvent]):
+    """
+    Processes a batch of trigger events in one transaction, removes them from the inbox and commits.
+    Events a collector skipped (no lateness rules yet, visitor not found) are unclaimed and left in
+    the inbox to be retried later.
+    """
+    event_ids = {event.event_id for event in events if event.event_id}
+    events = await claim_events(db, events)
+    batch = TriggerBatch()
+    by_kind: Dict[str, List[TriggerEvent]] = {}
+    for event in events:
+        by_kind.setdefault(event.kind, []).append(event)
+    for kind, kind_events in by_kind.items():
+        await COLLECTORS[kind](db, kind_events, batch)
+
+    if batch.attendance_states:
+        await db.execute(
+            pg_insert(AttendanceState).on_conflict_do_nothing(index_elements=[AttendanceState.attendance_id]),
+            batch.attendance_states
+        )
+    if batch.events:
+        await db.execute(participant_status_statement(batch.events.keys()))
+        for row in (await db.execute(event_notifications_statement(batch.events))).all():
+            batch.pushes.append(PushMessage(
+                employee_id=row.employee_id, title=row.title, body=row.message, data={"event_id": str(row.event_id)}
+            ))
+    if batch.notifications:
+        await db.execute(insert(EmployeeNotification), batch.notifications)
+    if batch.message_statuses:
+        await db.execute(insert(MessageStatus), batch.message_statuses)
+    # The rollup reads AttendanceState.is_late, so it is refreshed after the insert.
+    if batch.rollups:
+        await db.execute(refresh_rollup_statement(batch.rollups))
+    if batch.touched:
+        await db.execute(report_cache.bump_statement(batch.touched))
+    if batch.skipped:
+        await db.execute(delete(ProcessedTriggerEvent).where(ProcessedTriggerEvent.event_id.in_(list(batch.skipped))))
+        for event_id, reason in batch.skipped.items():
+            await retry_event(db, event_id, reason)
+    if batch.chat_notifications:
+        await db.execute(notification_coalescer.pending_statement(batch.chat_notifications))
+    done = event_ids - batch.skipped.keys()
+    if done:
+        await db.execute(delete(TriggerInbox).where(TriggerInbox.event_id.in_(sorted(done))))
+    await db.commit()
+
+    push_queue.enqueue(batch.pushes)
+    notification_coalescer.schedule(len(batch.chat_notifications))
+
+
+class TriggerIngestQueue:
+    """
+    Bounded queue between the Hasura trigger endpoints and the database.
+
+    Every event is in the inbox before it is queued, so the queue is only the fast path: when it is
+    full, or the process dies, the event waits in the inbox for the sweep. If a batch fails, its
+    events are retried one per transaction so a single bad event cannot sink the others; an event
+    that fails on its own is rescheduled, never dropped. Redeliveries of an event still pending or
+    recently processed are acknowledged without being saved again.
+    """
+
+    def __init__(self, maxsize: int = TRIGGER_QUEUE_SIZE, batch_size: int = TRIGGER_BATCH_SIZE,
+                 batch_wait_ms: int = TRIGGER_BATCH_WAIT_MS):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.seen = SeenEvents()
+        self._pending: Set[str] = set()
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sweeper_task: Optional[asyncio.Task] = None
+        self._next_prune = 0.0
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._task = asyncio.create_task(self._consumer())
+        self._sweeper_task = asyncio.create_task(self._sweeper())
+
+    async def stop(self, timeout: float = 10):
+        if self._sweeper_task is not None:
+            self._sweeper_task.cancel()
+            await asyncio.gather(self._sweeper_task, return_exceptions=True)
+            self._sweeper_task = None
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(self.drain(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"{self._queue.qsize()} trigger events left in the inbox at shutdown")
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def drain(self):
+        """Waits until every queued event has been written or rescheduled."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def submit(self, event: TriggerEvent) -> bool:
+        """
+        Saves the event in the inbox, then queues it. Hasura is only answered once the event is saved:
+        when the save fails it gets a 503 and delivers the event again.
+        :return: False when the event is a redelivery of one already pending or processed.
+        """
+        if self._queue is None:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Trigger consumer is not running")
+        event.event_id = event.event_id or str(uuid.uuid4())
+        if not self.seen.add(event.event_id):
+            return False
+        try:
+            async with AsyncSessionLocal() as db:
+                saved = (await db.execute(
+                    pg_insert(TriggerInbox)
+                    .values(
+                        event_id=event.event_id,
+                        kind=event.kind,
+                        op=event.op,
+                        data=event.data,
+                        max_attempts=TRIGGER_MAX_ATTEMPTS,
+                        next_attempt_at=func.now() + timedelta(seconds=TRIGGER_LEASE_SECONDS)
+                    )
+                    .on_conflict_do_nothing(index_elements=[TriggerInbox.event_id])
+                    .returning(TriggerInbox.event_id)
+                )).scalar()
+                await db.commit()
+        except Exception as e:
+            logger.exception(e)
+            self.seen.discard(event.event_id)
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Event could not be saved, retry later")
+        if saved is None:
+            return False
+        self._enqueue(event)
+        return True
+
+    def _enqueue(self, event: TriggerEvent):
+        if event.event_id in self._pending:
+            return
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Already in the inbox; a sweep queues it once its lease runs out.
+            return
+        self._pending.add(event.event_id)
+
+    async def _next_batch(self) -> List[TriggerEvent]:
+        loop = asyncio.get_running_loop()
+        events = [await self._queue.get()]
+        deadline = loop.time() + self.batch_wait
+        while len(events) < self.batch_size:
+            if not self._queue.empty():
+                events.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                events.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return events
+
+    async def _consumer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            events = await self._next_batch()
+            try:
+                await self._process(events)
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                for event in events:
+                    self._pending.discard(event.event_id)
+                    self._queue.task_done()
+            if loop.time() >= self._next_prune:
+                self._next_prune = loop.time() + 3600
+                await self._prune()
+
+    async def _sweeper(self):
+        while True:
+            try:
+                await self._sweep()
+            except Exception as e:
+                logger.exception(e)
+            await asyncio.sleep(TRIGGER_SWEEP_SECONDS)
+
+    async def _sweep(self):
+        """
+        Queues the inbox events that are due: retries whose backoff is over and events whose lease
+        ran out (queue overflow, or a process that died). Each one is leased again while it is queued.
+        """
+        free = self.maxsize - self._queue.qsize()
+        if free <= 0:
+            return
+        due = (
+            select(TriggerInbox.event_id)
+            .where(TriggerInbox.status == INBOX_PENDING, TriggerInbox.next_attempt_at <= func.now())
+            .order_by(TriggerInbox.next_attempt_at)
+            .limit(free)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                update(TriggerInbox)
+                .where(TriggerInbox.event_id.in_(due))
+                .values(next_attempt_at=func.now() + timedelta(seconds=TRIGGER_LEASE_SECONDS))
+                .returning(TriggerInbox.event_id, TriggerInbox.kind, TriggerInbox.op, TriggerInbox.data)
+            )).all()
+            await db.commit()
+        for row in rows:
+            self.seen.add(row.event_id)
+            self._enqueue(TriggerEvent(kind=row.kind, event_id=row.event_id, data=row.data, op=row.op))
+
+    @staticmethod
+    async def _prune():
+        """Forgets processed event ids older than Hasura would ever redeliver."""
+        cutoff = datetime.now(timezone.utc) - timedelta(days=TRIGGER_EVENT_RETENTION_DAYS)
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(delete(ProcessedTriggerEvent).where(ProcessedTriggerEvent.processed_at < cutoff))
+                await db.commit()
+        except Exception as e:
+            logger.exception(e)
+
+    async def _process(self, events: List[TriggerEvent]):
+        try:
+            async with AsyncSessionLocal() as db:
+                await write_batch(db, events)
+            return
+        except Exception as e:
+            logger.exception(e)
+            failed = [(event, e) for event in events]
+
+        if len(events) > 1:
+            failed = []
+            for event in events:
+                try:
+                    async with AsyncSessionLocal() as db:
+                        await write_batch(db, [event])
+                except Exception as e:
+                    failed.append((event, e))
+        await self._reschedule(failed)
+
+    async def _reschedule(self, failed: List[Tuple[TriggerEvent, Exception]]):
+        """Keeps failed events in the inbox and pushes their next attempt back exponentially."""
+        if not failed:
+            return
+        for event, error in failed:
+            logger.error(f"{event.kind} event {event.event_id} failed, will be retried: {error}")
+            # Nothing was recorded for it, so a redelivery must not be taken for a duplicate.
+            self.seen.discard(event.event_id)
+        try:
+            async with AsyncSessionLocal() as db:
+                for event, error in failed:
+                    await retry_event(db, event.event_id, str(error))
+                await db.commit()
+        except Exception as e:
+            # The rows keep their current lease and are swept again when it runs out.
+            logger.exception(e)
+
+
+trigger_queue = TriggerIngestQueue()
@@ -0,0 +1,313 @@
+import asyncio
+import io
+import os
+import random
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import List, Literal, Optional
+import boto3
+from fastapi import HTTPException, status
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+from src import logger
+from src.components.rendering import pdf_renderer
+from src.components.resolvers import iter_report_rows, stream_report_csv
+from src.crud import get_department_attendance_summary, get_company_name
+from src.database import SessionLocal
+from src.models import Report, ReportStatus, ReportTypes, Department, Company, TextContent
+
+REPORT_BUCKET = 'vvims-visitor'
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', '2'))
+REPORT_QUEUE_SIZE = int(os.getenv('REPORT_QUEUE_SIZE', '100'))
+# A RUNNING job untouched for this long belonged to a process that died; it is made PENDING again.
+REPORT_JOB_TIMEOUT_MINUTES = int(os.getenv('REPORT_JOB_TIMEOUT_MINUTES', '30'))
+
+s3 = boto3.client(
+    's3',
+    aws_access_key_id=os.getenv('AWS_ACCESS_KEY'),
+    aws_secret_access_key=os.getenv('AWS_SECRET_KEY'),
+    region_name='eu-north-1'
+)
+
+ReportName = {
+    ReportTypes.ATTENDANCE: "Attendance Report",
+    ReportTypes.VISITS: "Visits Report",
+    ReportTypes.LEAVES: "Leaves Report",
+}
+
+CONTENT_TYPES = {
+    "csv": "text/csv",
+    "pdf": "application/pdf",
+}
+
+PDF_TEMPLATES = {
+    ReportTypes.ATTENDANCE: "reports.html",
+    ReportTypes.VISITS: "visits.html",
+}
+
+
+@dataclass
+class ReportJobRequest:
+    report_type: str
+    category: str
+    category_id: uuid.UUID
+    from_date: date
+    to_date: date
+    file_format: Literal["csv", "pdf"] = "csv"
+
+
+def _average_time(seconds: List[float]) -> Optional[str]:
+    if not seconds:
+        return None
+    return str(timedelta(seconds=int(sum(seconds) / len(seconds))))
+
+
+def _seconds_of_day(value: str) -> int:
+    moment = datetime.fromisoformat(value)
+    return moment.hour * 3600 + moment.minute * 60 + moment.second
+
+
+def attendance_pdf_context(db: Session, report: Report) -> dict:
+    rows = iter_report_rows(db, "attendance", report.category, report.category_id, report.from_date, report.to_date)
+
+    per_employee = {}
+    arrivals, durations = [], []
+    total = present = 0
+    for row in rows:
+        total += 1
+        employee = per_employee.setdefault(row.employee, {"name": row.employee, "present": 0, "arrivals": []})
+        if row.status != 'Present':
+            continue
+        present += 1
+        employee["present"] += 1
+        if row.arrival:
+            arrival = _seconds_of_day(row.arrival)
+            employee["arrivals"].append(arrival)
+            arrivals.append(arrival)
+            if row.departure:
+                durations.append((datetime.fromisoformat(row.departure) - datetime.fromisoformat(row.arrival)).total_seconds())
+
+    data = [
+        {"name": e["name"], "present": e["present"], "avr_hrs": _average_time(e["arrivals"])}
+        for e in per_employee.values()
+    ]
+    return {
+        "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "current_year": datetime.now().year,
+        "data": data,
+        "data_dept": get_department_attendance_summary(db, Department),
+        "summary": {
+            "arrival_time": _average_time(arrivals),
+            "avr_office_hours": _average_time(durations),
+            "overall_perc": "{:.1f}%".format(present * 100 / total if total else 0)
+        },
+        "company_name": get_company_name(db, Company, TextContent),
+        "chart": ""
+    }
+
+
+def visits_pdf_context(db: Session, report: Report) -> dict:
+    rows = list(iter_report_rows(db, "visits", report.category, report.category_id, report.from_date, report.to_date))
+
+    days = (report.to_date - report.from_date).days + 1
+    by_date = Counter(row.date for row in rows)
+    by_hour = Counter(row.check_in[:2] for row in rows if row.check_in)
+    return {
+        "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "company_name": get_company_name(db, Company, TextContent),
+        "service_name": "",
+        "insights_text": "",
+        "table_data": [
+            {"firstname": row.visitor_name, "lastname": "", "date": row.date, "check_in_at": row.check_in, "reason": row.reason}
+            for row in rows
+        ],
+        "summary": {
+            "total_visits": len(rows),
+            "avg_visits": round(len(rows) / days, 1) if days > 0 else 0,
+            "highest_visiting_dates": by_date.most_common(1)[0][0] if by_date else None,
+            "peack_visiting_hour": f"{by_hour.most_common(1)[0][0]}:00" if by_hour else None
+        }
+    }
+
+
+PDF_CONTEXTS = {
+    ReportTypes.ATTENDANCE: attendance_pdf_context,
+    ReportTypes.VISITS: visits_pdf_context,
+}
+
+
+def render_report(db: Session, report: Report) -> bytes:
+    """Renders a report row's parameters to file bytes in its requested format."""
+    if report.file_format == "pdf":
+        if report.types not in PDF_TEMPLATES:
+            raise ValueError(f"No PDF template for {report.types.value} reports")
+        context = PDF_CONTEXTS[report.types](db, report)
+        # The job already runs off the event loop, so it can wait on the process pool directly.
+        return pdf_renderer.submit(PDF_TEMPLATES[report.types], context).result()
+
+    chunks = stream_report_csv(
+        report.types.value,
+        report.category,
+        report.category_id,
+        report.from_date,
+        report.to_date
+    )
+    buffer = io.BytesIO()
+    for chunk in chunks:
+        buffer.write(chunk.encode('utf-8'))
+    return buffer.getvalue()
+
+
+def upload_report_to_s3(data: bytes, report: Report) -> str:
+    now = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+    random_number = str(random.randint(1, 99999)).zfill(5)
+    file_name = f"{report.types.value}_report_{now}_{random_number}.{report.file_format}"
+    s3.upload_fileobj(
+        io.BytesIO(data),
+        REPORT_BUCKET,
+        file_name,
+        ExtraArgs={"ContentType": CONTENT_TYPES.get(report.file_format, "application/octet-stream")}
+    )
+    return f"https://{REPORT_BUCKET}.s3.eu-north-1.amazonaws.com/{file_name}"
+
+
+def get_report_job(db: Session, job_id: uuid.UUID) -> Optional[Report]:
+    return db.query(Report).filter(Report.id == job_id).first()
+
+
+class ReportJobQueue:
+    """
+    Bounded background queue for report generation.
+
+    Jobs are persisted as Report rows with a status; the queue only carries their ids. A fixed
+    number of asyncio workers drain it and run rendering + upload on a dedicated thread pool of
+    the same size, so long reports never run on the event loop or on uvicorn's request threads.
+    A job only runs once its row has been moved from PENDING to RUNNING by a conditional UPDATE,
+    so a job queued by two processes, or again after a restart, is generated once.
+    """
+
+    def __init__(self, workers: int = REPORT_WORKERS, maxsize: int = REPORT_QUEUE_SIZE):
+        self.workers = workers
+        self.maxsize = maxsize
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="report-job")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+        # Jobs left behind by a previous process are picked up again.
+        loop = asyncio.get_running_loop()
+        for job_id in await loop.run_in_executor(self._executor, self._unfinished_jobs):
+            try:
+                self._enqueue(job_id)
+            except HTTPException:
+                break
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor:
+            self._executor.shutdown(wait=False)
+        pdf_renderer.shutdown()
+
+    def submit(self, db: Session, request: ReportJobRequest) -> Report:
+        if request.file_format not in CONTENT_TYPES:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Unknown file format: {request.file_format}")
+        report_type = ReportTypes(request.report_type)
+        report = Report(
+            name=ReportName.get(report_type, "Report"),
+            types=report_type,
+            status=ReportStatus.PENDING,
+            category=request.category,
+            category_id=request.category_id,
+            from_date=request.from_date,
+            to_date=request.to_date,
+            file_format=request.file_format
+        )
+        db.add(report)
+        db.commit()
+        try:
+            self._enqueue(report.id)
+        except HTTPException as e:
+            report.status = ReportStatus.FAILED
+            report.error = e.detail
+            db.commit()
+            raise
+        return report
+
+    def _enqueue(self, job_id: uuid.UUID):
+        if self._queue is None:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Report workers are not running")
+        try:
+            self._queue.put_nowait(job_id)
+        except asyncio.QueueFull:
+            logger.warning(f"Report queue full, job {job_id} stays pending")
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many reports queued, retry later")
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await loop.run_in_executor(self._executor, self._run, job_id)
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    def _unfinished_jobs() -> List[uuid.UUID]:
+        with SessionLocal() as db:
+            db.execute(
+                update(Report)
+                .where(
+                    Report.status == ReportStatus.RUNNING,
+                    Report.updated_at < func.now() - timedelta(minutes=REPORT_JOB_TIMEOUT_MINUTES)
+                )
+                .values(status=ReportStatus.PENDING)
+            )
+            db.commit()
+            rows = db.query(Report.id).filter(Report.status == ReportStatus.PENDING).order_by(Report.created_at).all()
+            return [row.id for row in rows]
+
+    @staticmethod
+    def _claim(db: Session, job_id: uuid.UUID) -> bool:
+        """Moves the job from PENDING to RUNNING; False when another worker or process already has it."""
+        claimed = db.execute(
+            update(Report)
+            .where(Report.id == job_id, Report.status == ReportStatus.PENDING)
+            .values(status=ReportStatus.RUNNING, updated_at=func.now())
+            .returning(Report.id)
+        ).scalar()
+        db.commit()
+        return claimed is not None
+
+    def _run(self, job_id: uuid.UUID):
+        with SessionLocal() as db:
+            if not self._claim(db, job_id):
+                return
+            report = get_report_job(db, job_id)
+
+            try:
+                data = render_report(db, report)
+                report.report_link = upload_report_to_s3(data, report)
+                report.status = ReportStatus.COMPLETED
+                report.error = None
+                db.commit()
+            except Exception as e:
+                logger.exception(e)
+                db.rollback()
+                report.status = ReportStatus.FAILED
+                report.error = str(e)
+                db.commit()
+
+
+report_jobs = ReportJobQueue()
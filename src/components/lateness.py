@@ -0,0 +1,291 @@
+"""
+Shift-aware lateness.
+
+An employee's expected start for a clock-in is, in order of preference: the shift recorded on the
+attendance row, the assigned shift running that weekday whose start is nearest to the clock-in,
+or the company's start_work_time. The company's max_late_time is the grace period in every case.
+Weekdays in Shift.working_days and CompanySettings.working_days are ISO numbers, 1 = Monday.
+
+A shift whose end_time is earlier than its start_time runs overnight: a clock-in before its end
+belongs to the shift that started the day before, so that day's weekday and start apply.
+
+All comparisons are done on integer seconds since midnight. Historical rows can be recomputed with
+
+    python -m src.components.lateness --from 2025-01-01 --to 2025-03-31
+"""
+import argparse
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import date, datetime, time as dt_time
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+from sqlalchemy import Select, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from src import logger
+from src.components.rollup import backfill_attendance_rollup
+from src.components.settings import CompanySettingsSnapshot, company_settings_cache
+from src.components.versions import SHIFTS, SharedVersion
+from src.models import Attendance, AttendanceState, CompanySettings, Employee, EmployeeShift, Shift
+
+SHIFT_CACHE_TTL = int(os.getenv('SHIFT_CACHE_TTL', '3600'))
+BACKFILL_BATCH_SIZE = 5000
+DAY_SECONDS = 24 * 3600
+
+
+def to_seconds(value: dt_time) -> int:
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def _days(working_days) -> Optional[FrozenSet[int]]:
+    return frozenset(working_days) if working_days else None
+
+
+def previous_weekday(weekday: int) -> int:
+    return (weekday - 2) % 7 + 1
+
+
+@dataclass(frozen=True)
+class ShiftRule:
+    shift_id: uuid.UUID
+    start: int
+    working_days: Optional[FrozenSet[int]]
+    end: Optional[int] = None
+
+    @property
+    def overnight(self) -> bool:
+        return self.end is not None and self.end < self.start
+
+    def anchor(self, weekday: int, clock_in: int) -> Tuple[int, int]:
+        """
+        The weekday the shift started on and its start in seconds from the clock-in's midnight,
+        negative for an overnight shift that started the day before.
+        """
+        if self.overnight and clock_in <= self.end:
+            return previous_weekday(weekday), self.start - DAY_SECONDS
+        return weekday, self.start
+
+    def runs_on(self, weekday: int) -> bool:
+        return self.working_days is None or weekday in self.working_days
+
+
+@dataclass(frozen=True)
+class LatenessRules:
+    """Everything needed to judge one employee's clock-ins, reduced to integers."""
+    shifts: Tuple[ShiftRule, ...]
+    company_start: Optional[int]
+    company_days: Optional[FrozenSet[int]]
+    grace: int
+
+    def expected_start(self, weekday: int, clock_in: int, shift: Optional[ShiftRule] = None) -> Optional[int]:
+        if shift is not None:
+            return shift.anchor(weekday, clock_in)[1]
+        running = []
+        for candidate in self.shifts:
+            day, start = candidate.anchor(weekday, clock_in)
+            if candidate.runs_on(day):
+                running.append(start)
+        if running:
+            return min(running, key=lambda start: abs(clock_in - start))
+        if self.company_start is None or (self.company_days is not None and weekday not in self.company_days):
+            return None
+        return self.company_start
+
+    def is_late(self, clock_in_time: datetime, shift: Optional[ShiftRule] = None) -> bool:
+        clock_in = to_seconds(clock_in_time)
+        start = self.expected_start(clock_in_time.isoweekday(), clock_in, shift)
+        return start is not None and clock_in > start + self.grace
+
+
+def build_rules(shifts: Tuple[ShiftRule, ...], settings: Optional[CompanySettingsSnapshot]) -> LatenessRules:
+    return LatenessRules(
+        shifts=shifts,
+        company_start=to_seconds(settings.start_work_time) if settings else None,
+        company_days=_days(settings.working_days) if settings else None,
+        grace=int(settings.max_late_time.total_seconds()) if settings else 0
+    )
+
+
+def evaluate(rules: Dict[uuid.UUID, LatenessRules], shifts: Dict[uuid.UUID, ShiftRule],
+             clock_ins: Iterable[Tuple[uuid.UUID, datetime, Optional[uuid.UUID]]]) -> List[Optional[bool]]:
+    """
+    Judges a batch of (employee_id, clock_in_time, shift_id) clock-ins.
+    :return: One flag per clock-in, None when the employee has neither a shift nor company settings.
+    """
+    flags = []
+    for employee_id, clock_in_time, shift_id in clock_ins:
+        employee_rules = rules.get(employee_id)
+        if employee_rules is None or clock_in_time is None:
+            flags.append(None)
+            continue
+        flags.append(employee_rules.is_late(clock_in_time, shifts.get(shift_id) if shift_id else None))
+    return flags
+
+
+def _shifts_statement() -> Select:
+    return select(Shift.id, Shift.start_time, Shift.end_time, Shift.working_days)
+
+
+def _assignments_statement(employee_ids: Optional[Iterable[uuid.UUID]] = None) -> Select:
+    stmt = select(EmployeeShift.employee_id, EmployeeShift.shift_id).where(EmployeeShift.shift_id.isnot(None))
+    if employee_ids is not None:
+        stmt = stmt.where(EmployeeShift.employee_id.in_(employee_ids))
+    return stmt
+
+
+def _shift_rules(rows) -> Dict[uuid.UUID, ShiftRule]:
+    return {row.id: ShiftRule(shift_id=row.id, start=to_seconds(row.start_time), working_days=_days(row.working_days),
+                              end=to_seconds(row.end_time) if row.end_time is not None else None)
+            for row in rows}
+
+
+class ShiftCache:
+    """
+    The shifts table (small, loaded whole) and each employee's shift assignments, both kept for
+    SHIFT_CACHE_TTL seconds and dropped early by the shift trigger, in this process directly and in
+    the others once they read the bumped 'shifts' version.
+    """
+
+    def __init__(self, ttl: int = SHIFT_CACHE_TTL):
+        self.ttl = ttl
+        self._shifts: Dict[uuid.UUID, ShiftRule] = {}
+        self._shifts_expire = 0.0
+        self._assignments: Dict[uuid.UUID, Tuple[float, Tuple[uuid.UUID, ...]]] = {}
+        self._lock = threading.Lock()
+        self.version = SharedVersion(SHIFTS)
+
+    async def _check_version(self, db: AsyncSession):
+        if await self.version.changed_async(db):
+            self.clear()
+
+    async def shifts(self, db: AsyncSession) -> Dict[uuid.UUID, ShiftRule]:
+        await self._check_version(db)
+        now = time.monotonic()
+        if self._shifts_expire <= now:
+            shifts = _shift_rules((await db.execute(_shifts_statement())).all())
+            with self._lock:
+                self._shifts, self._shifts_expire = shifts, now + self.ttl
+        return self._shifts
+
+    async def for_employees(self, db: AsyncSession, employee_ids: Iterable[uuid.UUID]) -> Dict[uuid.UUID, Tuple[uuid.UUID, ...]]:
+        await self._check_version(db)
+        employee_ids = set(employee_ids)
+        now = time.monotonic()
+        with self._lock:
+            found = {e: entry[1] for e, entry in ((e, self._assignments.get(e)) for e in employee_ids)
+                     if entry is not None and entry[0] > now}
+        missing = employee_ids - found.keys()
+        if missing:
+            loaded = {employee_id: [] for employee_id in missing}
+            for row in (await db.execute(_assignments_statement(missing))).all():
+                loaded[row.employee_id].append(row.shift_id)
+            with self._lock:
+                for employee_id, shift_ids in loaded.items():
+                    found[employee_id] = tuple(shift_ids)
+                    self._assignments[employee_id] = (now + self.ttl, tuple(shift_ids))
+        return found
+
+    def invalidate_shifts(self):
+        with self._lock:
+            self._shifts_expire = 0.0
+
+    def invalidate_employee(self, employee_id):
+        with self._lock:
+            self._assignments.pop(uuid.UUID(str(employee_id)), None)
+
+    def clear(self):
+        with self._lock:
+            self._shifts_expire = 0.0
+            self._assignments.clear()
+
+
+shift_cache = ShiftCache()
+
+
+async def load_rules(db: AsyncSession, employee_ids: Iterable[uuid.UUID]) -> Tuple[Dict[uuid.UUID, LatenessRules], Dict[uuid.UUID, ShiftRule]]:
+    """Rules for the given employees, from the caches; no query once they are warm."""
+    employee_ids = set(employee_ids)
+    settings = await company_settings_cache.for_employees(db, employee_ids)
+    shifts = await shift_cache.shifts(db)
+    assignments = await shift_cache.for_employees(db, employee_ids)
+    rules = {}
+    for employee_id in employee_ids:
+        employee_shifts = tuple(shifts[s] for s in assignments.get(employee_id, ()) if s in shifts)
+        if employee_shifts or employee_id in settings:
+            rules[employee_id] = build_rules(employee_shifts, settings.get(employee_id))
+    return rules, shifts
+
+
+def load_all_rules(db: Session) -> Tuple[Dict[uuid.UUID, LatenessRules], Dict[uuid.UUID, ShiftRule]]:
+    """Rules for every employee, straight from the database (three queries)."""
+    shifts = _shift_rules(db.execute(_shifts_statement()).all())
+    assignments: Dict[uuid.UUID, List[ShiftRule]] = {}
+    for row in db.execute(_assignments_statement()).all():
+        if row.shift_id in shifts:
+            assignments.setdefault(row.employee_id, []).append(shifts[row.shift_id])
+    settings = {
+        row.id: CompanySettingsSnapshot(
+            company_id=row.company_id,
+            start_work_time=row.start_work_time,
+            end_work_time=row.end_work_time,
+            max_late_time=row.max_late_time,
+            working_days=tuple(row.working_days) if row.working_days is not None else None
+        ) for row in db.execute(
+            select(Employee.id, CompanySettings.company_id, CompanySettings.start_work_time,
+                   CompanySettings.end_work_time, CompanySettings.max_late_time, CompanySettings.working_days)
+            .join(CompanySettings, CompanySettings.company_id == Employee.company_id)
+        ).all()
+    }
+    rules = {
+        employee_id: build_rules(tuple(assignments.get(employee_id, ())), settings.get(employee_id))
+        for employee_id in set(assignments) | set(settings)
+    }
+    return rules, shifts
+
+
+def backfill_lateness(db: Session, from_date: Optional[date] = None, to_date: Optional[date] = None) -> int:
+    """
+    Recomputes AttendanceState.is_late for a date range (the whole history by default) in one
+    streamed pass over attendance, upserting the states in batches, then rebuilds the rollup.
+    """
+    rules, shifts = load_all_rules(db)
+    stmt = select(Attendance.id, Attendance.employee_id, Attendance.clock_in_time, Attendance.shift_id) \
+        .where(Attendance.clock_in_time.isnot(None))
+    if from_date:
+        stmt = stmt.where(Attendance.clock_in_date >= from_date)
+    if to_date:
+        stmt = stmt.where(Attendance.clock_in_date <= to_date)
+
+    upsert = insert(AttendanceState.__table__)
+    upsert = upsert.on_conflict_do_update(index_elements=['attendance_id'], set_={'is_late': upsert.excluded.is_late})
+
+    count = 0
+    result = db.execute(stmt.execution_options(stream_results=True, yield_per=BACKFILL_BATCH_SIZE))
+    for rows in result.partitions():
+        flags = evaluate(rules, shifts, ((row.employee_id, row.clock_in_time, row.shift_id) for row in rows))
+        states = [{"attendance_id": row.id, "is_late": flag} for row, flag in zip(rows, flags) if flag is not None]
+        if states:
+            db.execute(upsert, states)
+            count += len(states)
+    backfill_attendance_rollup(db, from_date, to_date)
+    return count
+
+
+def _parse_date(value: str) -> date:
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+if __name__ == "__main__":
+    from src.database import SessionLocal
+
+    arg_parser = argparse.ArgumentParser(description="Recompute attendance lateness")
+    arg_parser.add_argument("--from", dest="from_date", type=_parse_date, default=None)
+    arg_parser.add_argument("--to", dest="to_date", type=_parse_date, default=None)
+    args = arg_parser.parse_args()
+
+    with SessionLocal() as db:
+        states = backfill_lateness(db, args.from_date, args.to_date)
+        logger.info(f"Lateness recomputed for {states} attendances")
@@ -0,0 +1,112 @@
+"""
+Password hashing on a bounded executor.
+
+BCRYPT_ROUNDS pins the bcrypt cost. Hashes of any other cost are rehashed on the next successful
+login. The calibration command measures this box and prints the cost that meets a latency target:
+
+    python -m src.components.passwords --target-ms 250
+"""
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+from passlib.context import CryptContext
+
+PASSWORD_WORKERS = int(os.getenv('PASSWORD_WORKERS', str(min(4, os.cpu_count() or 1))))
+BCRYPT_ROUNDS = os.getenv('BCRYPT_ROUNDS')
+BCRYPT_TARGET_MS = int(os.getenv('BCRYPT_TARGET_MS', '250'))
+
+
+def make_context(rounds: Optional[int] = None) -> CryptContext:
+    if rounds is None:
+        return CryptContext(schemes=["bcrypt"], deprecated="auto")
+    # min == max == default makes needs_update() flag every hash of another cost.
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds
+    )
+
+
+def calibrate_rounds(target_ms: int = BCRYPT_TARGET_MS, min_rounds: int = 10, max_rounds: int = 16) -> Tuple[int, dict]:
+    """
+    Times one hash per cost and returns the highest cost whose hash time stays within target_ms
+    (never below min_rounds), together with the measured times.
+    """
+    timings = {}
+    chosen = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        context = make_context(rounds)
+        started = time.perf_counter()
+        context.hash("calibration-password")
+        timings[rounds] = (time.perf_counter() - started) * 1000
+        if timings[rounds] > target_ms:
+            break
+        chosen = rounds
+    return chosen, timings
+
+
+pwd_context = make_context(int(BCRYPT_ROUNDS) if BCRYPT_ROUNDS else None)
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification on a small dedicated thread pool.
+
+    bcrypt releases the GIL while it works, so the event loop keeps serving other requests while a
+    login is verified. The pool size caps how many cores a burst of logins can take; extra attempts
+    wait in the executor queue instead of on the event loop.
+    """
+
+    def __init__(self, context: CryptContext = pwd_context, workers: int = PASSWORD_WORKERS):
+        self.context = context
+        self.workers = workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._pool
+
+    def verify(self, password: str, hashed: str) -> bool:
+        """Blocking variant for sync callers; still bounded by the pool."""
+        return self._get_pool().submit(self.context.verify, password, hashed).result()
+
+    def hash(self, password: str) -> str:
+        return self._get_pool().submit(self.context.hash, password).result()
+
+    async def verify_async(self, password: str, hashed: str) -> bool:
+        return await asyncio.wrap_future(self._get_pool().submit(self.context.verify, password, hashed))
+
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.wrap_future(self._get_pool().submit(self.context.hash, password))
+
+    async def verify_and_update_async(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verifies the password and, only when it matches and the stored hash needs_update
+        (another cost), also returns a fresh hash to store in its place.
+        """
+        return await asyncio.wrap_future(self._get_pool().submit(self.context.verify_and_update, password, hashed))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+password_hasher = PasswordHasher()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Pick the bcrypt cost for this machine")
+    arg_parser.add_argument("--target-ms", type=int, default=BCRYPT_TARGET_MS)
+    args = arg_parser.parse_args()
+
+    rounds, timings = calibrate_rounds(args.target_ms)
+    for cost, elapsed in timings.items():
+        print(f"rounds={cost:>2} {elapsed:>8.1f} ms")
+    print(f"BCRYPT_ROUNDS={rounds}")
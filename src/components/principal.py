@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import Session
+from src.components.versions import PRINCIPALS, SharedVersion
+from src.models import Employee, EmployeeRole, Position, Role
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv('PRINCIPAL_CACHE_SIZE', '4096'))
+PRINCIPAL_CACHE_TTL = int(os.getenv('PRINCIPAL_CACHE_TTL', '600'))
+
+
+@dataclass(frozen=True)
+class EmployeePrincipal:
+    """What login and token issuance need to know about an employee, and nothing more."""
+    id: uuid.UUID
+    firstname: str
+    lastname: str
+    phone_number: str
+    roles: Tuple[str, ...]
+    role_ids: Tuple[uuid.UUID, ...]
+    position_id: Optional[uuid.UUID]
+    level: Optional[int]
+    password: str
+    password_change_at: Optional[datetime]
+
+    @property
+    def name(self) -> str:
+        return self.firstname + " " + self.lastname
+
+
+def load_principal(db: Session, phone_number: str) -> Optional[EmployeePrincipal]:
+    """
+    Loads the principal of an employee in one grouped query, one row per employee
+    however many roles they hold.
+    :param db:
+    :param phone_number:
+    :return:
+    """
+    row = db.execute(
+        select(
+            Employee.id,
+            Employee.firstname,
+            Employee.lastname,
+            Employee.phone_number,
+            func.array_agg(aggregate_order_by(Role.role_name, Role.role_name)),
+            func.array_agg(aggregate_order_by(Role.id, Role.role_name)),
+            Employee.position_id,
+            Position.level,
+            Employee.password,
+            Employee.password_change_at
+        )
+        .join(EmployeeRole, Employee.id == EmployeeRole.employee_id)
+        .join(Role, EmployeeRole.role_id == Role.id)
+        .join(Position, Employee.position_id == Position.id)
+        .where(Employee.phone_number == phone_number)
+        .group_by(Employee.id, Position.level)
+    ).first()
+    if row is None:
+        return None
+    return EmployeePrincipal(
+        id=row[0], firstname=row[1], lastname=row[2], phone_number=row[3], roles=tuple(row[4]),
+        role_ids=tuple(row[5]), position_id=row[6], level=row[7], password=row[8], password_change_at=row[9]
+    )
+
+
+class PrincipalCache:
+    """
+    LRU of employee principals keyed by phone number, each kept for PRINCIPAL_CACHE_TTL seconds.
+
+    Entries are dropped by employee (roles, password or phone changed) or by position (level changed);
+    the TTL only bounds how stale a principal can get when a change bypasses both. Those drops only
+    reach the process that sees the change, so every lookup also reads the shared 'principals'
+    version and the whole cache is dropped when another process bumped it.
+    """
+
+    def __init__(self, maxsize: int = PRINCIPAL_CACHE_SIZE, ttl: int = PRINCIPAL_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, EmployeePrincipal]]" = OrderedDict()
+        self._phones: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.version = SharedVersion(PRINCIPALS, refresh=0)
+
+    def get(self, db: Session, phone_number: str) -> Optional[EmployeePrincipal]:
+        if self.version.changed(db):
+            self.clear()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(phone_number)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(phone_number)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        principal = load_principal(db, phone_number)
+        if principal is not None:
+            self.put(principal)
+        return principal
+
+    def put(self, principal: EmployeePrincipal):
+        with self._lock:
+            self._drop(str(principal.id))
+            self._entries[principal.phone_number] = (time.monotonic() + self.ttl, principal)
+            self._phones[str(principal.id)] = principal.phone_number
+            while len(self._entries) > self.maxsize:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._phones.pop(str(evicted.id), None)
+
+    def _drop(self, employee_id: str):
+        phone_number = self._phones.pop(employee_id, None)
+        if phone_number is not None:
+            self._entries.pop(phone_number, None)
+
+    def invalidate(self, employee_id):
+        with self._lock:
+            self._drop(str(employee_id))
+
+    def invalidate_position(self, position_id):
+        with self._lock:
+            stale = [str(p.id) for _, p in self._entries.values() if str(p.position_id) == str(position_id)]
+            for employee_id in stale:
+                self._drop(employee_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._phones.clear()
+
+
+principal_cache = PrincipalCache()
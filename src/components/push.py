@@ -0,0 +1,145 @@
+"""
+Background delivery of push notifications through Firebase Cloud Messaging (HTTP v1).
+
+Producers hand over whole batches after their transaction commits; a single worker looks up the
+receivers' firebase tokens in one query per batch and sends the batch's requests concurrently, at
+most PUSH_CONCURRENCY at a time, so neither the trigger consumer nor the event loop waits on FCM.
+Delivery is disabled when FIREBASE_PROJECT_ID is unset.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import google.auth.transport.requests
+import httpx
+from google.oauth2 import service_account
+from sqlalchemy import select
+from src import logger
+from src.database import AsyncSessionLocal
+from src.models import Employee
+
+FIREBASE_PROJECT_ID = os.getenv('FIREBASE_PROJECT_ID')
+FIREBASE_SERVICE_ACCOUNT_FILE = os.getenv(
+    'FIREBASE_SERVICE_ACCOUNT_FILE', './vvims-emplo-firebase-adminsdk-sg73f-d935f36b7e.json'
+)
+FCM_SCOPES = ['https://www.googleapis.com/auth/firebase.messaging']
+PUSH_QUEUE_SIZE = int(os.getenv('PUSH_QUEUE_SIZE', '1000'))
+PUSH_CONCURRENCY = int(os.getenv('PUSH_CONCURRENCY', '16'))
+
+# httpx logs every request at INFO, one line per push.
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+@dataclass
+class PushMessage:
+    employee_id: uuid.UUID
+    title: str
+    body: str
+    data: Dict[str, str] = field(default_factory=dict)
+
+
+class PushQueue:
+    """Bounded queue of push batches. When it is full the batch is dropped, notifications rows stay."""
+
+    def __init__(self, project_id: Optional[str] = FIREBASE_PROJECT_ID, maxsize: int = PUSH_QUEUE_SIZE,
+                 concurrency: int = PUSH_CONCURRENCY):
+        self.project_id = project_id
+        self.maxsize = maxsize
+        self.concurrency = concurrency
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._credentials: Optional[service_account.Credentials] = None
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        # Only the OAuth token refresh is blocking; it gets a thread of its own.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="push")
+        self._http = httpx.AsyncClient(
+            timeout=10, limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def enqueue(self, messages: List[PushMessage]):
+        if not messages or not self.project_id or self._queue is None:
+            return
+        try:
+            self._queue.put_nowait(messages)
+        except asyncio.QueueFull:
+            logger.warning(f"Push queue full, {len(messages)} pushes dropped")
+
+    async def _worker(self):
+        while True:
+            messages = await self._queue.get()
+            try:
+                await self._deliver(messages)
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                self._queue.task_done()
+
+    def _token(self) -> str:
+        """A valid FCM access token, refreshed only when it expired. Never logged."""
+        if self._credentials is None:
+            self._credentials = service_account.Credentials.from_service_account_file(
+                FIREBASE_SERVICE_ACCOUNT_FILE, scopes=FCM_SCOPES
+            )
+        if not self._credentials.valid:
+            self._credentials.refresh(google.auth.transport.requests.Request())
+        return self._credentials.token
+
+    async def _send(self, url: str, headers: Dict[str, str], message: PushMessage, device_token: str):
+        async with self._semaphore:
+            response = await self._http.post(url, headers=headers, json={
+                "message": {
+                    "token": device_token,
+                    "notification": {"title": message.title, "body": message.body},
+                    "data": message.data
+                }
+            })
+        if response.status_code >= 400:
+            logger.warning(f"Push to {message.employee_id} failed: {response.status_code} {response.text}")
+
+    async def _deliver(self, messages: List[PushMessage]):
+        employee_ids = {message.employee_id for message in messages}
+        async with AsyncSessionLocal() as db:
+            tokens = dict((await db.execute(
+                select(Employee.id, Employee.firebase_token)
+                .where(Employee.id.in_(employee_ids), Employee.firebase_token.isnot(None))
+            )).all())
+        if not tokens:
+            return
+
+        loop = asyncio.get_running_loop()
+        access_token = await loop.run_in_executor(self._executor, self._token)
+        url = f"https://fcm.googleapis.com/v1/projects/{self.project_id}/messages:send"
+        headers = {"Authorization": f"Bearer {access_token}"}
+        results = await asyncio.gather(
+            *(self._send(url, headers, message, tokens[message.employee_id])
+              for message in messages if tokens.get(message.employee_id)),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(f"Push failed: {result}")
+
+
+push_queue = PushQueue()
@@ -0,0 +1,66 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Optional
+from jinja2 import Environment, FileSystemLoader, Template
+
+TEMPLATE_DIR = "template"
+REPORT_TEMPLATES = ("reports.html", "attendance.html", "visits.html", "sec-reports.html")
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', '2'))
+
+# Per-process state, filled by _init_worker in each pool process.
+_templates: Dict[str, Template] = {}
+
+
+def _init_worker(template_dir: str):
+    env = Environment(loader=FileSystemLoader(template_dir), auto_reload=False)
+    for name in REPORT_TEMPLATES:
+        _templates[name] = env.get_template(name)
+
+
+def _render_pdf(template_name: str, context: dict) -> bytes:
+    from weasyprint import HTML
+
+    html_content = _templates[template_name].render(**context)
+    return HTML(string=html_content, base_url=TEMPLATE_DIR).write_pdf()
+
+
+class PdfRenderer:
+    """
+    Renders report templates to PDF bytes in a pool of worker processes.
+
+    Each worker compiles the report templates once at start-up and keeps them, so a render is
+    only the Jinja call plus WeasyPrint's layout. The event loop only awaits the result.
+    """
+
+    def __init__(self, workers: int = PDF_WORKERS, template_dir: str = TEMPLATE_DIR):
+        self.workers = workers
+        self.template_dir = template_dir
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.template_dir,)
+            )
+        return self._pool
+
+    def submit(self, template_name: str, context: dict) -> Future:
+        if template_name not in REPORT_TEMPLATES:
+            raise ValueError(f"Unknown report template: {template_name}")
+        return self._get_pool().submit(_render_pdf, template_name, context)
+
+    async def render(self, template_name: str, context: dict) -> bytes:
+        return await asyncio.wrap_future(self.submit(template_name, context))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+pdf_renderer = PdfRenderer()
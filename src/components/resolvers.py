@@ -1,26 +1,213 @@
 import csv
+import io
 import os
 import uuid
+from bisect import bisect_right
+from dataclasses import fields
 from datetime import date, timedelta
 from pathlib import Path
-from sqlalchemy.orm import Session
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy import Date, DateTime, Select, and_, case, cast, func, literal, literal_column, select, true
+from sqlalchemy.orm import Session, Query
+from src.components.cache import report_cache
 from src.database import SessionLocal
-from src.models import Leave, Report, Visit, Attendance, Employee, ReportTypes
+from src.models import Leave, Report, Visit, Visitor, Attendance, AttendanceState, Employee, ReportTypes
 from src.schema.output_type import AttendanceReportRow, LeaveReportRow, ReportResult, VisitReportRow
 
 REPORT_DIR = '/app/uploads'
+STREAM_BATCH_SIZE = 1000
 
 
-def generate_report(
+def _employee_filter(category: str, category_id: uuid.UUID):
+    if category == "department":
+        return Employee.department_id == category_id
+    elif category == "service":
+        return Employee.service_id == category_id
+    return Employee.id == category_id
+
+
+def _employees_query(session: Session, category: str, category_id: uuid.UUID) -> Query:
+    return session.query(Employee).filter(_employee_filter(category, category_id))
+
+
+class LeaveIntervals:
+    """
+    Per-employee interval lookup over (employee_id, start_date, end_date, comment) rows.
+    Intervals are sorted by start date with a running maximum of end dates, so a lookup
+    is a bisect plus a short walk back over the intervals that can still cover the day.
+    """
+
+    def __init__(self, leaves: Iterable[tuple]):
+        grouped: Dict[uuid.UUID, List[tuple]] = {}
+        for leave in leaves:
+            grouped.setdefault(leave[0], []).append(leave)
+
+        self._index: Dict[uuid.UUID, Tuple[List[date], List[date], List[tuple]]] = {}
+        for employee_id, rows in grouped.items():
+            rows.sort(key=lambda lv: lv[1])
+            starts = [lv[1] for lv in rows]
+            max_ends = []
+            running = None
+            for lv in rows:
+                running = lv[2] if running is None or lv[2] > running else running
+                max_ends.append(running)
+            self._index[employee_id] = (starts, max_ends, rows)
+
+    def find(self, employee_id: uuid.UUID, day: date) -> Optional[tuple]:
+        entry = self._index.get(employee_id)
+        if entry is None:
+            return None
+        starts, max_ends, rows = entry
+        i = bisect_right(starts, day) - 1
+        while i >= 0 and max_ends[i] >= day:
+            if rows[i][2] >= day:
+                return rows[i]
+            i -= 1
+        return None
+
+
+def build_attendance_rows(employees, attendances, leaves, from_date: date, to_date: date) -> List[AttendanceReportRow]:
+    """
+    Builds the day x employee attendance matrix from plain rows.
+    :param employees: (id, firstname, lastname) rows
+    :param attendances: (employee_id, clock_in_date, clock_in_time, clock_out_time, is_late) rows
+    :param leaves: (employee_id, start_date, end_date, comment) rows
+    :return: One AttendanceReportRow per employee per day, ordered by day then employee.
+    """
+    attendance_index = {}
+    for att in attendances:
+        attendance_index.setdefault((att[0], att[1]), att)
+    leave_index = LeaveIntervals(leaves)
+
+    data = []
+    curr = from_date
+    while curr <= to_date:
+        day = curr.isoformat()
+        for emp in employees:
+            att = attendance_index.get((emp[0], curr))
+
+            if att:
+                status = 'Present'
+                arrival = att[2].isoformat() if att[2] else None
+                departure = att[3].isoformat() if att[3] else None
+                late = bool(att[4])
+                reason = None
+            else:
+                lv = leave_index.find(emp[0], curr)
+                arrival = None
+                departure = None
+                late = None
+                if lv:
+                    status = 'On Leave'
+                    reason = lv[3] or None
+                else:
+                    status = 'Absent'
+                    reason = None
+
+            data.append(AttendanceReportRow(
+                employee=f"{emp[1]} {emp[2]}",
+                date=day,
+                status=status,
+                arrival=arrival,
+                departure=departure,
+                late=late,
+                reason=reason
+            ))
+
+        curr += timedelta(days=1)
+
+    return data
+
+
+def attendance_report_statement(
+    session: Session,
+    category: str,
+    category_id: uuid.UUID,
+    from_date: date,
+    to_date: date
+) -> Select:
+    """
+    Builds the whole attendance matrix in PostgreSQL: selected employees x generate_series(from_date, to_date),
+    with the day's attendance (and its state) and any covering leave attached through LATERAL joins.
+    Each result row maps 1:1 onto an AttendanceReportRow.
+    """
+    emp = (
+        _employees_query(session, category, category_id)
+        .with_entities(Employee.id, Employee.firstname, Employee.lastname)
+        .subquery('emp')
+    )
+    days = select(
+        cast(func.generate_series(
+            cast(from_date, DateTime), cast(to_date, DateTime), literal_column("interval '1 day'")
+        ), Date).label('day')
+    ).subquery('days')
+
+    att = (
+        select(
+            Attendance.id,
+            Attendance.clock_in_time,
+            Attendance.clock_out_time,
+            AttendanceState.is_late
+        )
+        .outerjoin(AttendanceState, AttendanceState.attendance_id == Attendance.id)
+        .where(Attendance.employee_id == emp.c.id, Attendance.clock_in_date == days.c.day)
+        .limit(1)
+        .lateral('att')
+    )
+    lv = (
+        select(Leave.id, Leave.comment)
+        .where(Leave.employee_id == emp.c.id, Leave.start_date <= days.c.day, Leave.end_date >= days.c.day)
+        .limit(1)
+        .lateral('lv')
+    )
+
+    present = att.c.id.isnot(None)
+    on_leave = and_(att.c.id.is_(None), lv.c.id.isnot(None))
+
+    return (
+        select(
+            func.concat(emp.c.firstname, literal(' '), emp.c.lastname).label('employee'),
+            days.c.day.label('date'),
+            case((present, 'Present'), (on_leave, 'On Leave'), else_='Absent').label('status'),
+            att.c.clock_in_time.label('arrival'),
+            att.c.clock_out_time.label('departure'),
+            case((present, func.coalesce(att.c.is_late, False)), else_=None).label('late'),
+            case((on_leave, func.nullif(lv.c.comment, '')), else_=None).label('reason')
+        )
+        .select_from(days)
+        .join(emp, true())
+        .outerjoin(att, true())
+        .outerjoin(lv, true())
+        .order_by(days.c.day, emp.c.lastname, emp.c.firstname, emp.c.id)
+    )
+
+
+def attendance_row_from_sql(row) -> AttendanceReportRow:
+    return AttendanceReportRow(
+        employee=row.employee,
+        date=row.date.isoformat(),
+        status=row.status,
+        arrival=row.arrival.isoformat() if row.arrival else None,
+        departure=row.departure.isoformat() if row.departure else None,
+        late=row.late,
+        reason=row.reason
+    )
+
+
+def iter_report_rows(
+    session: Session,
     report_type: str,
     category: str,
     category_id: uuid.UUID,
     from_date: date,
     to_date: date,
-    db: Session = None
-) -> ReportResult:
-    session: Session = db or SessionLocal()
-
+    engine: str = "python"
+) -> Iterator:
+    """
+    Yields the report rows (VisitReportRow, LeaveReportRow or AttendanceReportRow) for the given filters.
+    ORM queries use yield_per and the SQL attendance engine uses a server-side cursor, so callers that
+    consume the rows incrementally keep memory flat regardless of the date range.
+    """
     if report_type == "visits":
         filters = [
             Visit.date >= from_date,
@@ -34,67 +221,75 @@ def generate_report(
         elif category == "employee":
             filters.append(Visit.host_employee == category_id)
 
-        rows = session.query(Visit).filter(*filters).all()
+        visits = session.query(
+            Visitor.firstname,
+            Visitor.lastname,
+            Visit.date,
+            Visit.check_in_at,
+            Visit.check_out_at,
+            Visit.reason,
+            Visit.status
+        ).join(
+            Visitor, Visitor.id == Visit.visitor
+        ).filter(*filters).yield_per(STREAM_BATCH_SIZE)
 
-        data = [
-            VisitReportRow(
-                visitor_name=f"{v.visitors.firstname} {v.visitors.lastname}",
+        for v in visits:
+            yield VisitReportRow(
+                visitor_name=f"{v.firstname} {v.lastname}",
                 date=v.date.isoformat(),
                 check_in=v.check_in_at.isoformat() if v.check_in_at else None,
                 check_out=v.check_out_at.isoformat() if v.check_out_at else None,
                 reason=v.reason,
                 status=v.status
             )
-            for v in rows
-        ]
 
-        return ReportResult(type="visits", visit_data=data)
-    
     elif report_type == "leaves":
-        emp_q = session.query(Employee)
-        if category == "department":
-            emp_q = emp_q.filter(Employee.department_id == category_id)
-        elif category == "service":
-            emp_q = emp_q.filter(Employee.service_id == category_id)
-        else:
-            emp_q = emp_q.filter(Employee.id == category_id)
-
-        employees = emp_q.all()
-        emp_ids = [e.id for e in employees]
-
-        leaves = session.query(Leave).join(Employee).filter(
-            Leave.employee_id.in_(emp_ids),
+        leaves = session.query(
+            Employee.firstname,
+            Employee.lastname,
+            Leave.start_date,
+            Leave.end_date,
+            Leave.comment
+        ).join(
+            Employee, Employee.id == Leave.employee_id
+        ).filter(
+            _employee_filter(category, category_id),
             Leave.start_date <= to_date,
             Leave.end_date >= from_date
-        ).all()
+        ).yield_per(STREAM_BATCH_SIZE)
 
-        data = []
         for leave in leaves:
-            data.append(LeaveReportRow(
-                employee=f"{leave.employee.firstname} {leave.employee.lastname}",
+            yield LeaveReportRow(
+                employee=f"{leave.firstname} {leave.lastname}",
                 start_date=leave.start_date.isoformat(),
                 end_date=leave.end_date.isoformat(),
                 duration=(leave.end_date - leave.start_date).days + 1,
                 reason=leave.comment
-            ))
-            print(leave)
-            print(f"Leave for {leave.employee.firstname} {leave.employee.lastname} from {leave.start_date} to {leave.end_date}")
-
-        return ReportResult(type="leaves", leave_data=data)
+            )
 
+    elif engine == "sql":
+        rows = session.execute(
+            attendance_report_statement(session, category, category_id, from_date, to_date),
+            execution_options={"stream_results": True, "yield_per": STREAM_BATCH_SIZE}
+        )
+        for row in rows:
+            yield attendance_row_from_sql(row)
 
     else:
-        emp_q = session.query(Employee)
-        if category == "department":
-            emp_q = emp_q.filter(Employee.department_id == category_id)
-        elif category == "service":
-            emp_q = emp_q.filter(Employee.service_id == category_id)
-        else:
-            emp_q = emp_q.filter(Employee.id == category_id)
-
-        employees = emp_q.all()
+        emp_q = _employees_query(session, category, category_id)
+        employees = emp_q.with_entities(Employee.id, Employee.firstname, Employee.lastname).all()
+        emp_ids = emp_q.with_entities(Employee.id)
 
-        attendances = session.query(Attendance).filter(
+        attendances = session.query(
+            Attendance.employee_id,
+            Attendance.clock_in_date,
+            Attendance.clock_in_time,
+            Attendance.clock_out_time,
+            AttendanceState.is_late
+        ).outerjoin(
+            AttendanceState, AttendanceState.attendance_id == Attendance.id
+        ).filter(
+            Attendance.employee_id.in_(emp_ids),
             Attendance.clock_in_date >= from_date,
             Attendance.clock_in_date <= to_date
         ).all()
@@ -105,46 +300,77 @@ def generate_report(
             Leave.end_date,
             Leave.comment
         ).filter(
+            Leave.employee_id.in_(emp_ids),
             Leave.start_date <= to_date,
             Leave.end_date >= from_date
         ).all()
 
-        data = []
-        curr = from_date
-        while curr <= to_date:
-            for emp in employees:
-                att = next((a for a in attendances if a.employee_id == emp.id and a.clock_in_date == curr), None)
-                lv = next((e for e in leaves if e[0] == emp.id and e[1] <= curr <= e[2]), None)
-
-                if att:
-                    status = 'Present'
-                    arrival = att.clock_in_time.isoformat() if att.clock_in_time else None
-                    departure = att.clock_out_time.isoformat() if att.clock_out_time else None
-                    late = getattr(att.attendance_state, 'is_late', False)
-                    reason = None
-                elif lv:
-                    status = 'On Leave'
-                    arrival = None
-                    departure = None
-                    late = None
-                    reason = lv[3] or None
-                else:
-                    status = 'Absent'
-                    arrival = None
-                    departure = None
-                    late = None
-                    reason = None
+        yield from build_attendance_rows(employees, attendances, leaves, from_date, to_date)
 
-                data.append(AttendanceReportRow(
-                    employee=f"{emp.firstname} {emp.lastname}",
-                    date=curr.isoformat(),
-                    status=status,
-                    arrival=arrival,
-                    departure=departure,
-                    late=late,
-                    reason=reason
-                ))
 
-            curr += timedelta(days=1)
+def generate_report(
+    report_type: str,
+    category: str,
+    category_id: uuid.UUID,
+    from_date: date,
+    to_date: date,
+    db: Session = None,
+    engine: str = "python"
+) -> ReportResult:
+    session: Session = db or SessionLocal()
+
+    # A closed period is served without a version check, so its versions are not read either.
+    version = () if report_cache.is_closed(to_date) else report_cache.version(session, report_type)
+    cached = report_cache.get(report_type, category, category_id, from_date, to_date, engine, version)
+    if cached is not None:
+        return cached
+
+    data = list(iter_report_rows(session, report_type, category, category_id, from_date, to_date, engine))
+
+    if report_type == "visits":
+        result = ReportResult(type="visits", visit_data=data)
+    elif report_type == "leaves":
+        result = ReportResult(type="leaves", leave_data=data)
+    else:
+        result = ReportResult(type="attendance", attendance_data=data)
+
+    report_cache.put(report_type, category, category_id, from_date, to_date, engine, result, version)
+    return result
+
+
+REPORT_ROW_TYPES = {
+    "visits": VisitReportRow,
+    "leaves": LeaveReportRow,
+    "attendance": AttendanceReportRow
+}
+
+
+def stream_report_csv(
+    report_type: str,
+    category: str,
+    category_id: uuid.UUID,
+    from_date: date,
+    to_date: date,
+    engine: str = "sql"
+) -> Iterator[str]:
+    """
+    Yields the report as CSV text chunks, one chunk per STREAM_BATCH_SIZE rows.
+    Owns its session so it can be handed straight to a StreamingResponse.
+    """
+    columns = [f.name for f in fields(REPORT_ROW_TYPES.get(report_type, AttendanceReportRow))]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
 
-        return ReportResult(type="attendance", attendance_data=data)
\ No newline at end of file
+    session = SessionLocal()
+    try:
+        rows = iter_report_rows(session, report_type, category, category_id, from_date, to_date, engine)
+        for count, row in enumerate(rows, start=1):
+            writer.writerow([getattr(row, column) for column in columns])
+            if count % STREAM_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+    finally:
+        session.close()
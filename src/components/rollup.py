@@ -0,0 +1,100 @@
+"""
+Per-day, per-employee attendance rollup.
+
+The attendance trigger refreshes the (employee, day) rows a batch of events touches, all in one
+statement. The Hasura event
+trigger on attendance must fire on INSERT and on UPDATE of clock_out_time: the clock-out is what
+fills minutes_on_site. The backfill command rebuilds any historical range in one statement:
+
+    python -m src.components.rollup --from 2024-01-01 --to 2025-12-31
+"""
+import argparse
+import uuid
+from datetime import date, datetime
+from typing import Iterable, Optional, Tuple
+from sqlalchemy import Date, Integer, case, cast, column, func, literal, select, tuple_, values
+from sqlalchemy.dialects.postgresql import UUID, insert
+from sqlalchemy.orm import Session
+from src import logger
+from src.models import Attendance, AttendanceDailyRollup, AttendanceState, Employee
+
+
+def _rollup_select(*filters):
+    on_site = case(
+        (Attendance.clock_out_time > Attendance.clock_in_time,
+         func.extract('epoch', Attendance.clock_out_time - Attendance.clock_in_time) / 60),
+        else_=None
+    )
+    return (
+        select(
+            Attendance.clock_in_date,
+            Attendance.employee_id,
+            Employee.department_id,
+            literal(True),
+            func.bool_or(AttendanceState.is_late),
+            cast(func.sum(on_site), Integer),
+            func.min(Attendance.clock_in_time),
+            func.now()
+        )
+        .join(Employee, Employee.id == Attendance.employee_id)
+        .outerjoin(AttendanceState, AttendanceState.attendance_id == Attendance.id)
+        .where(Attendance.clock_in_date.isnot(None), *filters)
+        .group_by(Attendance.clock_in_date, Attendance.employee_id, Employee.department_id)
+    )
+
+
+def _upsert_statement(*filters):
+    columns = ['day', 'employee_id', 'department_id', 'present', 'late', 'minutes_on_site', 'first_clock_in', 'updated_at']
+    stmt = insert(AttendanceDailyRollup).from_select(columns, _rollup_select(*filters))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[AttendanceDailyRollup.day, AttendanceDailyRollup.employee_id],
+        set_={name: stmt.excluded[name] for name in columns[2:]}
+    )
+    return stmt
+
+
+def _upsert(db: Session, *filters) -> int:
+    return db.execute(_upsert_statement(*filters)).rowcount
+
+
+def refresh_rollup_statement(pairs: Iterable[Tuple[uuid.UUID, date]]):
+    """
+    INSERT ... SELECT ... GROUP BY recomputing the rollup rows of the given (employee, day) pairs
+    from their attendance rows, the pairs passed as a VALUES list. Idempotent: redelivered events
+    and the clock-out UPDATE rewrite the same rows.
+    """
+    touched = values(
+        column('employee_id', UUID(as_uuid=True)), column('day', Date), name='touched'
+    ).data(sorted(pairs))
+    return _upsert_statement(
+        tuple_(Attendance.employee_id, Attendance.clock_in_date).in_(select(touched.c.employee_id, touched.c.day))
+    )
+
+
+def backfill_attendance_rollup(db: Session, from_date: Optional[date] = None, to_date: Optional[date] = None) -> int:
+    """Rebuilds the rollup for a date range (the whole history by default) in a single statement."""
+    filters = []
+    if from_date:
+        filters.append(Attendance.clock_in_date >= from_date)
+    if to_date:
+        filters.append(Attendance.clock_in_date <= to_date)
+    count = _upsert(db, *filters)
+    db.commit()
+    return count
+
+
+def _parse_date(value: str) -> date:
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+if __name__ == "__main__":
+    from src.database import SessionLocal
+
+    arg_parser = argparse.ArgumentParser(description="Backfill the attendance daily rollup")
+    arg_parser.add_argument("--from", dest="from_date", type=_parse_date, default=None)
+    arg_parser.add_argument("--to", dest="to_date", type=_parse_date, default=None)
+    args = arg_parser.parse_args()
+
+    with SessionLocal() as db:
+        rows = backfill_attendance_rollup(db, args.from_date, args.to_date)
+        logger.info(f"Attendance rollup backfilled: {rows} rows")
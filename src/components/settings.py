@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import time as dt_time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.components.versions import COMPANY_SETTINGS, SharedVersion
+from src.models import CompanySettings, Employee
+
+COMPANY_SETTINGS_TTL = int(os.getenv('COMPANY_SETTINGS_TTL', '3600'))
+
+
+@dataclass(frozen=True)
+class CompanySettingsSnapshot:
+    company_id: uuid.UUID
+    start_work_time: dt_time
+    end_work_time: dt_time
+    max_late_time: timedelta
+    working_days: Optional[Tuple[int, ...]]
+
+
+class CompanySettingsCache:
+    """
+    Per-company settings plus the employee -> company mapping needed to find them.
+
+    Both maps expire after COMPANY_SETTINGS_TTL seconds. The company-settings trigger drops a
+    company as soon as its settings change, and the employees trigger drops a moved employee,
+    so the TTL only matters for changes made behind Hasura's back. The triggers reach one process;
+    the others drop everything once they read the bumped 'company_settings' version.
+    """
+
+    def __init__(self, ttl: int = COMPANY_SETTINGS_TTL):
+        self.ttl = ttl
+        self._settings: Dict[uuid.UUID, Tuple[float, CompanySettingsSnapshot]] = {}
+        self._companies: Dict[uuid.UUID, Tuple[float, uuid.UUID]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.version = SharedVersion(COMPANY_SETTINGS)
+
+    async def for_employees(self, db: AsyncSession, employee_ids: Iterable[uuid.UUID]) -> Dict[uuid.UUID, CompanySettingsSnapshot]:
+        """
+        Returns the settings of each employee's company. Costs no query when everything is cached,
+        otherwise at most one for the unknown employees and one for their companies.
+        """
+        if await self.version.changed_async(db):
+            self.clear()
+        employee_ids = set(employee_ids)
+        now = time.monotonic()
+        with self._lock:
+            companies = {e: entry[1] for e, entry in ((e, self._companies.get(e)) for e in employee_ids)
+                         if entry is not None and entry[0] > now}
+        missing_employees = employee_ids - companies.keys()
+        if missing_employees:
+            rows = (await db.execute(
+                select(Employee.id, Employee.company_id).where(Employee.id.in_(missing_employees))
+            )).all()
+            with self._lock:
+                for row in rows:
+                    companies[row.id] = row.company_id
+                    self._companies[row.id] = (now + self.ttl, row.company_id)
+
+        with self._lock:
+            settings = {c: entry[1] for c, entry in ((c, self._settings.get(c)) for c in set(companies.values()))
+                        if entry is not None and entry[0] > now}
+        missing_companies = set(companies.values()) - settings.keys()
+        if missing_companies:
+            for snapshot in await self._load(db, missing_companies):
+                settings[snapshot.company_id] = snapshot
+                with self._lock:
+                    self._settings[snapshot.company_id] = (now + self.ttl, snapshot)
+
+        with self._lock:
+            if missing_employees or missing_companies:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return {e: settings[c] for e, c in companies.items() if c in settings}
+
+    @staticmethod
+    async def _load(db: AsyncSession, company_ids) -> List[CompanySettingsSnapshot]:
+        rows = (await db.execute(
+            select(
+                CompanySettings.company_id,
+                CompanySettings.start_work_time,
+                CompanySettings.end_work_time,
+                CompanySettings.max_late_time,
+                CompanySettings.working_days
+            ).where(CompanySettings.company_id.in_(company_ids))
+        )).all()
+        return [
+            CompanySettingsSnapshot(
+                company_id=row.company_id,
+                start_work_time=row.start_work_time,
+                end_work_time=row.end_work_time,
+                max_late_time=row.max_late_time,
+                working_days=tuple(row.working_days) if row.working_days is not None else None
+            ) for row in rows
+        ]
+
+    def invalidate_company(self, company_id):
+        with self._lock:
+            self._settings.pop(uuid.UUID(str(company_id)), None)
+
+    def invalidate_employee(self, employee_id):
+        with self._lock:
+            self._companies.pop(uuid.UUID(str(employee_id)), None)
+
+    def clear(self):
+        with self._lock:
+            self._settings.clear()
+            self._companies.clear()
+
+
+company_settings_cache = CompanySettingsCache()
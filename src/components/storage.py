@@ -0,0 +1,174 @@
+"""
+Streaming uploads to S3.
+
+Bodies are sent as S3 multipart uploads of S3_PART_SIZE bytes (8 MiB by default, S3 refuses parts
+under 5 MiB), one part at a time, so an upload never holds more than about one part in memory and
+nothing is written to local disk. Bodies smaller than a part go up in a single put_object.
+"""
+import asyncio
+import os
+import re
+import uuid
+from functools import lru_cache
+from typing import AsyncIterator, List, Optional
+from fastapi import HTTPException, Request, UploadFile, status
+from src import logger
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    from multipart.multipart import MultipartParser, parse_options_header
+
+UPLOAD_BUCKET = 'vvims-visitor'
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_PART_SIZE = max(int(os.getenv('S3_PART_SIZE', str(8 * 1024 * 1024))), S3_MIN_PART_SIZE)
+READ_CHUNK_SIZE = 1024 * 1024
+MAX_KEY_NAME_LENGTH = 100
+
+
+@lru_cache(maxsize=None)
+def object_url_template(s3, bucket: str) -> str:
+    """Public URL pattern of a bucket's objects; the bucket location is looked up once per bucket."""
+    location = s3.get_bucket_location(Bucket=bucket)['LocationConstraint'] or 'us-east-1'
+    return f"https://{bucket}.s3.{location}.amazonaws.com/{{key}}"
+
+
+def object_url(s3, bucket: str, key: str) -> str:
+    return object_url_template(s3, bucket).format(key=key)
+
+
+def object_key(filename: Optional[str]) -> str:
+    """
+    A unique object key for an uploaded file: a uuid prefix, so two uploads called image.jpg never
+    overwrite each other, then the client's file name without its directories and reduced to
+    URL-safe characters.
+    """
+    name = re.split(r"[\\/]", filename or "")[-1]
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", name).lstrip(".")[-MAX_KEY_NAME_LENGTH:] or "file"
+    return f"{uuid.uuid4().hex}-{name}"
+
+
+async def iter_upload_file(file: UploadFile, chunk_size: int = READ_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    while chunk := await file.read(chunk_size):
+        yield chunk
+
+
+class _FileFieldParser:
+    """Callbacks for python-multipart that keep the data of one file field and drop everything else."""
+
+    def __init__(self, field_name: str):
+        self.field_name = field_name.encode()
+        self.found = False
+        self.chunks: List[bytes] = []
+        self._in_field = False
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+    def on_part_begin(self):
+        self._in_field = False
+        self._disposition = b""
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_field:
+            self.chunks.append(data[start:end])
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        self._in_field = not self.found and options.get(b"name") == self.field_name and b"filename" in options
+        self.found = self.found or self._in_field
+
+
+async def stream_form_file(request: Request, field_name: str) -> AsyncIterator[bytes]:
+    """
+    Yields the content of one file field of a multipart/form-data request as the body arrives,
+    without FastAPI's form parsing (which spools files over 1 MiB to a temporary file).
+    :param request: The incoming request; its body must not have been read yet.
+    :param field_name: Name of the file field.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Expected a multipart/form-data body")
+
+    field = _FileFieldParser(field_name)
+    parser = MultipartParser(params[b"boundary"], field.callbacks())
+    async for data in request.stream():
+        parser.write(data)
+        if field.chunks:
+            chunks, field.chunks = field.chunks, []
+            yield b"".join(chunks)
+    parser.finalize()
+    if not field.found:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Missing file field: {field_name}")
+
+
+async def stream_to_s3(chunks: AsyncIterator[bytes], key: str, s3, bucket: str = UPLOAD_BUCKET,
+                       content_type: Optional[str] = None, part_size: int = S3_PART_SIZE) -> str:
+    """
+    Uploads a stream of chunks to S3, reading the next chunk only once the previous part is sent.
+    A failed multipart upload is aborted so no orphan parts are billed.
+    :return: The public URL of the object.
+    """
+    extra = {"ContentType": content_type} if content_type else {}
+    buffer = bytearray()
+    upload_id = None
+    parts = []
+
+    async def send_part(body: bytearray):
+        number = len(parts) + 1
+        response = await asyncio.to_thread(
+            s3.upload_part, Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=body
+        )
+        parts.append({"ETag": response["ETag"], "PartNumber": number})
+
+    try:
+        async for chunk in chunks:
+            buffer += chunk
+            while len(buffer) >= part_size:
+                if upload_id is None:
+                    upload_id = (await asyncio.to_thread(
+                        s3.create_multipart_upload, Bucket=bucket, Key=key, **extra
+                    ))["UploadId"]
+                body = buffer[:part_size]
+                del buffer[:part_size]
+                await send_part(body)
+
+        if upload_id is None:
+            await asyncio.to_thread(s3.put_object, Bucket=bucket, Key=key, Body=bytes(buffer), **extra)
+        else:
+            if buffer:
+                await send_part(buffer)
+            await asyncio.to_thread(
+                s3.complete_multipart_upload, Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            )
+    except BaseException:
+        if upload_id is not None:
+            try:
+                await asyncio.to_thread(s3.abort_multipart_upload, Bucket=bucket, Key=key, UploadId=upload_id)
+            except Exception as e:
+                logger.exception(e)
+        raise
+
+    return await asyncio.to_thread(object_url, s3, bucket, key)
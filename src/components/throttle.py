@@ -0,0 +1,125 @@
+import ipaddress
+import os
+import time
+from typing import Dict, Optional, Tuple
+from starlette.requests import Request
+
+LOGIN_THROTTLE_REDIS_URL = os.getenv('LOGIN_THROTTLE_REDIS_URL')
+LOGIN_PHONE_BURST = int(os.getenv('LOGIN_PHONE_BURST', '5'))
+LOGIN_PHONE_PER_MINUTE = float(os.getenv('LOGIN_PHONE_PER_MINUTE', '5'))
+# The per-IP limit is off unless LOGIN_IP_PER_MINUTE is set: a whole site behind one NAT logs in
+# from one address at shift change. The per-phone limit is what stops credential stuffing.
+LOGIN_IP_BURST = int(os.getenv('LOGIN_IP_BURST', '600'))
+LOGIN_IP_PER_MINUTE = float(os.getenv('LOGIN_IP_PER_MINUTE', '0'))
+# Proxies whose X-Forwarded-For is believed: the ingress and anything else inside the cluster.
+LOGIN_TRUSTED_PROXIES = [
+    ipaddress.ip_network(network.strip())
+    for network in os.getenv('LOGIN_TRUSTED_PROXIES', '127.0.0.0/8,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16').split(',')
+    if network.strip()
+]
+
+# Refills the bucket for the elapsed time, then takes one token if there is one.
+# KEYS[1] bucket, ARGV: capacity, tokens per second, now. Returns 1 when allowed.
+TOKEN_BUCKET_SCRIPT = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(bucket[1]) or capacity
+local at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - at) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate))
+return allowed
+"""
+
+
+def _is_trusted(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in LOGIN_TRUSTED_PROXIES)
+
+
+def client_ip(request: Request) -> Optional[str]:
+    """
+    The address of the client behind the trusted proxies: X-Forwarded-For is read from the right,
+    skipping trusted hops, and only when the direct peer is itself a trusted proxy.
+    """
+    peer = request.client.host if request.client else None
+    if peer is None or not _is_trusted(peer):
+        return peer
+    hops = [hop.strip() for hop in request.headers.get('x-forwarded-for', '').split(',') if hop.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted(hop):
+            return hop
+    return hops[0] if hops else peer
+
+
+class MemoryBucketBackend:
+    """
+    Token buckets in a dict of the current process. Each uvicorn worker throttles on its own.
+    take() never awaits, so the event loop already serialises access to the dict.
+    """
+
+    def __init__(self, max_buckets: int = 100_000):
+        self.max_buckets = max_buckets
+        # key -> (tokens, last update, time at which the bucket is full again)
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+
+    async def take(self, key: str, capacity: int, rate: float) -> bool:
+        now = time.monotonic()
+        tokens, at, _ = self._buckets.get(key, (capacity, now, now))
+        tokens = min(capacity, tokens + (now - at) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+        if len(self._buckets) > self.max_buckets:
+            # A bucket that is full again is the same as no bucket.
+            self._buckets = {k: bucket for k, bucket in self._buckets.items() if bucket[2] > now}
+        return allowed
+
+
+class RedisBucketBackend:
+    """Token buckets in Redis (or anything speaking its protocol), shared by every worker."""
+
+    def __init__(self, url: str):
+        from redis.asyncio import Redis
+
+        self._redis = Redis.from_url(url)
+        self._script = self._redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def take(self, key: str, capacity: int, rate: float) -> bool:
+        return bool(await self._script(keys=[f"login-throttle:{key}"], args=[capacity, rate, time.time()]))
+
+
+class LoginThrottle:
+    """
+    Token-bucket limiter for login attempts, one bucket per phone number and, when
+    LOGIN_IP_PER_MINUTE is set, one per client IP (see client_ip()).
+
+    It is checked before the employee lookup and the bcrypt verification, so a retry loop is
+    rejected for the price of a dict (or Redis) lookup.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or (RedisBucketBackend(LOGIN_THROTTLE_REDIS_URL) if LOGIN_THROTTLE_REDIS_URL
+                                   else MemoryBucketBackend())
+
+    async def allow(self, phone_number: str, client_ip: Optional[str]) -> bool:
+        if not await self.backend.take(f"phone:{phone_number}", LOGIN_PHONE_BURST, LOGIN_PHONE_PER_MINUTE / 60):
+            return False
+        if LOGIN_IP_PER_MINUTE > 0 and client_ip and \
+                not await self.backend.take(f"ip:{client_ip}", LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE / 60):
+            return False
+        return True
+
+
+login_throttle = LoginThrottle()
@@ -0,0 +1,73 @@
+"""
+Versions of cached data, shared by every process.
+
+Two replicas run behind the service, and a Hasura trigger or a mutation reaches only one of them.
+Whatever changes the data behind a cache bumps its row of cache_versions with bump_statement(), in
+its own transaction; a process that reads a newer version than the one its cache was filled under
+drops the cache. The login principals read it on every lookup, the lateness settings and shifts at
+most every CACHE_VERSION_REFRESH_SECONDS.
+"""
+import os
+import threading
+import time
+from typing import Iterable, Optional
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from src.models import CacheVersion
+
+CACHE_VERSION_REFRESH_SECONDS = float(os.getenv('CACHE_VERSION_REFRESH_SECONDS', '5'))
+
+PRINCIPALS = 'principals'
+COMPANY_SETTINGS = 'company_settings'
+SHIFTS = 'shifts'
+
+
+def bump_statement(names: Iterable[str]):
+    """Marks the given caches as stale in every process."""
+    stmt = insert(CacheVersion).values([{"name": name, "version": 1} for name in sorted(set(names))])
+    return stmt.on_conflict_do_update(
+        index_elements=[CacheVersion.name],
+        set_={"version": CacheVersion.version + 1, "updated_at": func.now()}
+    )
+
+
+class SharedVersion:
+    """This process's view of one cache_versions row, re-read at most every `refresh` seconds."""
+
+    def __init__(self, name: str, refresh: float = CACHE_VERSION_REFRESH_SECONDS):
+        self.name = name
+        self.refresh = refresh
+        self._version: Optional[int] = None
+        self._due = 0.0
+        self._lock = threading.Lock()
+
+    def _check_due(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now < self._due:
+                return False
+            self._due = now + self.refresh
+            return True
+
+    def _observe(self, version: Optional[int]) -> bool:
+        version = version or 0
+        with self._lock:
+            changed = self._version is not None and version != self._version
+            self._version = version
+            return changed
+
+    def _statement(self):
+        return select(CacheVersion.version).where(CacheVersion.name == self.name)
+
+    def changed(self, db: Session) -> bool:
+        """True when the version moved since the last read, i.e. the cache must be dropped."""
+        if not self._check_due():
+            return False
+        return self._observe(db.execute(self._statement()).scalar())
+
+    async def changed_async(self, db: AsyncSession) -> bool:
+        if not self._check_due():
+            return False
+        return self._observe((await db.execute(self._statement())).scalar())
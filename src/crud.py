@@ -1,14 +1,17 @@
 import calendar
 from typing import Any, Optional
-from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import and_
-from sqlalchemy import func, cast, Date, Time, Numeric, select, case, desc
+from sqlalchemy import func, cast, Date, Time, Numeric, select, case, desc, true, update
 from src import logger
+from src.components.passwords import password_hasher
+from src.components.principal import EmployeePrincipal, principal_cache
 from src.models import Employee, EmployeeRole, Role, Position, Attendance, Leave, Task, TaskStatusEnum, TaskStatus, \
     Visit, Vehicle, AttendanceState, Conversation, EmployeeConversation, ParticipantStatus, EventParticipant, Message, \
-    MessageStatus, Event, MessageStatuses, Appointment, Department, Company, TextContent
-from src.schema.output_type import EmployeeType, AttendnacePercentage, EmployeeOnLeave, TaskCompletionPercentage, \
+    MessageStatus, Event, MessageStatuses, Appointment, Department, Company, TextContent, AttendanceDailyRollup
+from src.schema.output_type import EmployeeType, EmployeeRole as EmployeeRoleType, PositionType, RoleType, \
+    AttendnacePercentage, EmployeeOnLeave, TaskCompletionPercentage, \
     VisitsCountByDay, VehicleCountByDay, AttendanceCountByWeek, CreateConvOutput, AcceptParcipateEvent, \
     DenyParcipateEvent, InsertMesaageOuput, EventWithUserParticipant, EventType, ParticipantType, MessageStatusOutput, \
     AppointmentTodayPercentage
@@ -20,9 +23,6 @@ import math
 from typing import List
 from fastapi import HTTPException, status, Depends
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-
 def get_attendance_for_day(db: Session, date):
 
     return db.query(Attendance).join(Employee).filter(
@@ -55,27 +55,64 @@ def get_employee_by_phone(db: Session, phone_number: str) -> EmployeeType :
         raise Exception("Employee not found or wrong credentials")
     return employee_with_role
 
-def authenticate_employee(db: Session, phone_number: str, password: str):
+async def authenticate_employee_async(db: AsyncSession, phone_number: str, password: str) -> EmployeePrincipal:
     """
-    :param db: A database session instance used to interact with the database.
+    Authenticates against the cached employee principal instead of the full Employee graph,
+    and awaits the bcrypt check on the password executor so the event loop is never blocked by it.
+    :param db: An async database session.
     :param phone_number: The phone number of the employee attempting to authenticate.
     :param password: The password provided by the employee for authentication.
-    :return: The authenticated employee object if authentication is successful, or False if authentication fails.
+    :return: The principal of the authenticated employee.
     """
-    employee = get_employee_by_phone(db, phone_number)
-    if employee:
-        print("Employee====>")
-    if pwd_context.verify(password, employee.password):
-        print("Same password")
-
-
+    employee = await db.run_sync(principal_cache.get, phone_number)
     if not employee:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User does not exist")
-    if not pwd_context.verify(password, employee.password):
+    verified, new_hash = await password_hasher.verify_and_update_async(password, employee.password)
+    if not verified:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Wrong password")
+    if new_hash:
+        # Stored with another bcrypt cost: upgrade it now that we have the plain password.
+        # password_change_at is left alone, issued tokens stay valid.
+        await db.execute(update(Employee).where(Employee.id == employee.id).values(password=new_hash))
+        await db.commit()
+        principal_cache.invalidate(employee.id)
+
+    return employee
 
-    return  employee
 
+def login_employee_type(employee: Employee, principal: EmployeePrincipal) -> EmployeeType:
+    """
+    The employee returned by the GraphQL login: its columns from a primary-key load, its roles and
+    position from the principal it was authenticated with. The password hash is not returned.
+    :param employee: The employee row.
+    :param principal: The principal of the same employee.
+    :return:
+    """
+    return EmployeeType(
+        id=employee.id,
+        company_id=employee.company_id,
+        agency_id=employee.agency_id,
+        firstname=employee.firstname,
+        lastname=employee.lastname,
+        phone_number=employee.phone_number,
+        email=employee.email,
+        password=None,
+        service_id=employee.service_id,
+        department_id=employee.department_id,
+        position_id=employee.position_id,
+        supervisor_id=employee.supervisor_id,
+        function=employee.function,
+        profile_picture=employee.profile_picture,
+        created_at=employee.created_at,
+        updated_at=employee.updated_at,
+        roles=[
+            EmployeeRoleType(
+                id=None, employee_id=employee.id, role_id=role_id, created_at=None, updated_at=None,
+                role=RoleType(id=role_id, role_name=role_name, created_at=None, updated_at=None)
+            ) for role_id, role_name in zip(principal.role_ids, principal.roles)
+        ],
+        position=PositionType(id=principal.position_id, level=principal.level) if principal.position_id else None
+    )
 
 
 def count_attendance_percentage(db: Session) -> AttendnacePercentage:
@@ -250,13 +287,16 @@ def get_weekly_attendance_summary(session) -> List[AttendanceCountByWeek]:
     # Query to group by day of the week
     attendance_summary = (
         session.query(
-            ((func.extract('dow', Attendance.clock_in_date) + 6) % 7).label('weekday'),  # Alias as 'weekday'
-            func.count(Attendance.id).label('present_count'),
-            func.count(case((AttendanceState.is_late == False, 1), else_=None)).label('on_time_count'),
-            func.count(case((AttendanceState.is_late == True, 1), else_=None)).label('late_count'),
+            ((func.extract('dow', AttendanceDailyRollup.day) + 6) % 7).label('weekday'),  # Alias as 'weekday'
+            func.count().label('present_count'),
+            func.count(case((AttendanceDailyRollup.late == False, 1), else_=None)).label('on_time_count'),
+            func.count(case((AttendanceDailyRollup.late == True, 1), else_=None)).label('late_count'),
+        )
+        .filter(
+            AttendanceDailyRollup.present == True,
+            AttendanceDailyRollup.day >= start_of_week,
+            AttendanceDailyRollup.day <= end_of_week
         )
-        .join(AttendanceState, AttendanceState.attendance_id == Attendance.id, isouter=True)
-        .filter(Attendance.clock_in_date >= start_of_week, Attendance.clock_in_date <= end_of_week)
         .group_by('weekday')  # Use the alias here
         .order_by('weekday')  # Use the alias here
         .all()
@@ -553,29 +593,49 @@ def get_employee_attendance_summary(db: Session, employee: Employee, attendance:
 def get_department_attendance_summary(db: Session, dept: Department):
 
     total_working_days_subquery = (
-        db.query(func.count(func.distinct(Attendance.clock_in_date)).label('total_working_days'))
+        db.query(func.count(func.distinct(AttendanceDailyRollup.day)).label('total_working_days'))
+    ).subquery()
+
+    attendances_subquery = (
+        db.query(
+            AttendanceDailyRollup.department_id.label('department_id'),
+            func.count().label('total_attendances')
+        )
+        .filter(AttendanceDailyRollup.present == True)
+        .group_by(AttendanceDailyRollup.department_id)
+    ).subquery()
+
+    employees_subquery = (
+        db.query(
+            Employee.department_id.label('department_id'),
+            func.count(Employee.id).label('total_employees')
+        )
+        .group_by(Employee.department_id)
     ).subquery()
 
-    # Main query to calculate attendance percentage by department
+    total_attendances = func.coalesce(attendances_subquery.c.total_attendances, 0)
+    total_employees = func.coalesce(employees_subquery.c.total_employees, 0)
+
+    # Main query to calculate attendance percentage by department, read from the daily rollup
     query = (
         db.query(
             Department.id.label('department_id'),
             Department.abrev_code.label('department_name'),
-            func.count(Attendance.id).label('total_attendances'),
-            func.count(func.distinct(Employee.id)).label('total_employees'),
+            total_attendances.label('total_attendances'),
+            total_employees.label('total_employees'),
             cast(
                 case(
-                    (func.count(func.distinct(Employee.id)) == 0, 0),
-                    else_=(func.count(Attendance.id) * 100.0) / (
-                        func.count(func.distinct(Employee.id)) * total_working_days_subquery.c.total_working_days
+                    (total_employees * total_working_days_subquery.c.total_working_days == 0, 0),
+                    else_=(total_attendances * 100.0) / (
+                        total_employees * total_working_days_subquery.c.total_working_days
                     )
                 ),
                 Numeric(5, 1)
             ).label('attendance_percentage')
         )
-        .outerjoin(Employee, Department.id == Employee.department_id)
-        .outerjoin(Attendance, Employee.id == Attendance.employee_id)
-        .group_by(Department.id, Department.abrev_code, total_working_days_subquery.c.total_working_days)
+        .outerjoin(attendances_subquery, attendances_subquery.c.department_id == Department.id)
+        .outerjoin(employees_subquery, employees_subquery.c.department_id == Department.id)
+        .join(total_working_days_subquery, true())
     )
 
     # Execute the query
@@ -596,12 +656,13 @@ def get_department_attendance_summary(db: Session, dept: Department):
 
 
 def average_compnay_arrival_time(db: Session, attendance: Attendance):
+    # Reads the first clock-in of each employee-day from the rollup instead of the attendance history.
 
     average_arrival_query = (
         db.query(
             func.to_char(
                 func.to_timestamp(
-                    func.avg(func.extract('epoch', attendance.clock_in_time))
+                    func.avg(func.extract('epoch', AttendanceDailyRollup.first_clock_in))
                 ),
                 'HH24:MI:SS'
             ).label('average_arrival_time')
@@ -617,9 +678,7 @@ def average_time_in_office(db:Session, attendance: Attendance):
         db.query(
             func.to_char(
                 func.to_timestamp(
-                    func.avg(
-                        func.extract('epoch', attendance.clock_out_time - attendance.clock_in_time)
-                    )
+                    func.avg(AttendanceDailyRollup.minutes_on_site) * 60
                 ),
                 'HH24:MI:SS'
             ).label('average_time_on_site')
@@ -632,15 +691,17 @@ def average_time_in_office(db:Session, attendance: Attendance):
     return average_time_on_site
 
 def attendance_percentage(db: Session, attendance: Attendance, employee: Employee):
-    # Calculate total attendance records
-    total_attendance = db.query(func.count(attendance.id)).scalar()
+    # Calculate total attendance records and working days from the daily rollup
+    totals = db.query(
+        func.count().label('total_attendance'),
+        func.count(func.distinct(AttendanceDailyRollup.day)).label('total_working_days')
+    ).filter(AttendanceDailyRollup.present == True).one()
+    total_attendance = totals.total_attendance
+    total_working_days = totals.total_working_days
 
     # Calculate total number of employees
     total_employees = db.query(func.count(employee.id)).scalar()
 
-    # Calculate total working days (distinct clock_in_date values)
-    total_working_days = db.query(func.count(func.distinct(attendance.clock_in_date))).scalar()
-
     # Avoid division by zero
     if total_employees * total_working_days > 0:
         overall_attendance_percentage = (total_attendance / (total_employees * total_working_days)) * 100
@@ -1,8 +1,11 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 import os
+import uuid
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,6 +19,43 @@ engine = create_engine(DATABASE_URL, pool_size=20, max_overflow=10, pool_timeout
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+ASYNC_DRIVERS = {"postgres", "postgresql", "postgresql+psycopg2", "postgresql+psycopg", "postgresql+asyncpg"}
+
+
+def async_database_url(url: str) -> str:
+    """
+    The asyncpg form of a PostgreSQL URL. SQLAlchemy's prepared statement cache is turned off: the
+    Supabase pooler runs PgBouncer in transaction mode, where a prepared statement may be missing
+    or already exist on the server connection the next transaction lands on.
+    """
+    parsed = make_url(url)
+    if parsed.drivername not in ASYNC_DRIVERS:
+        raise ValueError(f"Cannot derive an asyncpg URL from a {parsed.drivername} URL, set ASYNC_DATABASE_URL")
+    query = dict(parsed.query)
+    if "sslmode" in query:
+        # asyncpg takes the libpq sslmode values under the name ssl.
+        query["ssl"] = query.pop("sslmode")
+    query["prepared_statement_cache_size"] = "0"
+    return parsed.set(drivername="postgresql+asyncpg", query=query).render_as_string(hide_password=False)
+
+
+# asyncpg-backed engine for the async endpoints, so a DB round trip no longer blocks the event loop.
+ASYNC_DATABASE_URL = async_database_url(os.getenv("ASYNC_DATABASE_URL") or DATABASE_URL)
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=20,
+    max_overflow=10,
+    pool_timeout=30,
+    connect_args={
+        # asyncpg's own statement cache, and unique names for the statements it still prepares.
+        "statement_cache_size": 0,
+        "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+    }
+)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False, class_=AsyncSession)
+
 Base = declarative_base()
 
 def get_db():
@@ -25,3 +65,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
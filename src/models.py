@@ -6,7 +6,7 @@ from sqlalchemy.orm import relationship
 from sqlalchemy import ForeignKey
 from src.database import Base
 from geoalchemy2 import Geometry
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import UUID, JSONB
 import uuid
 from enum import Enum as PyEnum
 
@@ -384,6 +384,72 @@ class AttendanceState(Base):
     # relationship
     attendance = relationship('Attendance', back_populates='attendance_state')
 
+
+class AttendanceDailyRollup(Base):
+    __tablename__ = 'attendance_daily_rollup'
+    day = Column(Date, primary_key=True, nullable=False)
+    employee_id = Column(UUID(as_uuid=True), ForeignKey('employees.id'), primary_key=True, nullable=False)
+    department_id = Column(UUID(as_uuid=True), ForeignKey('departments.id'), nullable=True, index=True)
+    present = Column(Boolean, nullable=False, default=True)
+    late = Column(Boolean, nullable=True)
+    minutes_on_site = Column(Integer, nullable=True)
+    first_clock_in = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class ProcessedTriggerEvent(Base):
+    __tablename__ = 'processed_trigger_events'
+    event_id = Column(String, primary_key=True, nullable=False)
+    kind = Column(String, nullable=False)
+    processed_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+
+class ReportDataVersion(Base):
+    __tablename__ = 'report_data_versions'
+    source = Column(String, primary_key=True, nullable=False)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class TriggerInbox(Base):
+    __tablename__ = 'trigger_inbox'
+    event_id = Column(String, primary_key=True, nullable=False)
+    kind = Column(String, nullable=False)
+    op = Column(String, nullable=False, default='INSERT')
+    data = Column(JSONB, nullable=False)
+    received_at = Column(DateTime(timezone=True), server_default=func.now())
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+    last_error = Column(Text, nullable=True)
+    max_attempts = Column(Integer, nullable=False, server_default='10')
+    status = Column(String, nullable=False, server_default='pending', index=True)
+
+
+class PendingChatNotification(Base):
+    __tablename__ = 'pending_chat_notifications'
+    receiver_id = Column(UUID(as_uuid=True), ForeignKey('employees.id', ondelete='CASCADE'), primary_key=True, nullable=False)
+    conversation_id = Column(UUID(as_uuid=True), ForeignKey('conversations.id', ondelete='CASCADE'), primary_key=True, nullable=False)
+    title = Column(String, nullable=False)
+    message = Column(String, nullable=False)
+    message_id = Column(UUID(as_uuid=True), ForeignKey('messages.id', ondelete='SET NULL'), nullable=True)
+    count = Column(Integer, nullable=False, default=1)
+    flush_after = Column(DateTime(timezone=True), nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class CacheVersion(Base):
+    __tablename__ = 'cache_versions'
+    name = Column(String, primary_key=True, nullable=False)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class TokenRevocation(Base):
+    __tablename__ = 'token_revocations'
+    employee_id = Column(UUID(as_uuid=True), ForeignKey('employees.id', ondelete='CASCADE'), primary_key=True, nullable=False)
+    revoked_before = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
+
 class Shift(Base):
     __tablename__ = 'shifts'
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, nullable=False)
@@ -715,6 +781,13 @@ class ReportTypes(PyEnum):
     ATTENDANCE = 'attendance'
     VISITS = 'visits'
     TASKS = 'tasks'
+    LEAVES = 'leaves'
+
+class ReportStatus(PyEnum):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
 
 class CategoryType(str, PyEnum):
     EMPLOYEE = "employee"
@@ -727,10 +800,15 @@ class Report(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
-    report_link = Column(String, nullable=False)
+    report_link = Column(String, nullable=True)
     from_date = Column(Date, nullable=False)
     to_date = Column(Date, nullable=False)
     name =Column(String, nullable=False)
     types = Column(Enum(ReportTypes), default=ReportTypes.VISITS)
+    status = Column(Enum(ReportStatus), default=ReportStatus.COMPLETED, nullable=False)
+    category = Column(String, nullable=True)
+    category_id = Column(UUID(as_uuid=True), nullable=True)
+    file_format = Column(String, nullable=True)
+    error = Column(Text, nullable=True)
 
     
\ No newline at end of file
@@ -1,4 +1,4 @@
-from typing import Optional, List
+from typing import Literal, Optional, List
 from pydantic import  BaseModel
 import strawberry
 import uuid
@@ -177,6 +177,12 @@ class ReportTypeEnum(PyEnum):
     LEAVES = "leaves"  # ← Ajouté
 
 
+@strawberry.enum
+class ReportEngineEnum(PyEnum):
+    PYTHON = "python"
+    SQL = "sql"
+
+
 @strawberry.enum
 class CategoryTypeEnum(PyEnum):
     DEPARTMENT = "department"
@@ -190,4 +196,14 @@ class GenerateReportInput:
     category: CategoryTypeEnum
     category_id: uuid.UUID
     from_date: Optional[date] = None
-    to_date: Optional[date] = None
\ No newline at end of file
+    to_date: Optional[date] = None
+    engine: ReportEngineEnum = ReportEngineEnum.PYTHON
+
+
+class ReportJobInput(BaseModel):
+    report_type: ReportTypeEnum
+    category: CategoryTypeEnum
+    category_id: uuid.UUID
+    from_date: date
+    to_date: date
+    file_format: Literal["csv", "pdf"] = "csv"
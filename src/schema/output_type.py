@@ -243,3 +243,12 @@ class ReportResult:
     visit_data: Optional[List[VisitReportRow]] = None
     attendance_data: Optional[List[AttendanceReportRow]] = None
     leave_data: Optional[List[LeaveReportRow]] = None  # <--- Ajouté
+
+
+
+@strawberry.type
+class ReportJobType:
+    id: uuid.UUID
+    status: str
+    report_link: Optional[str] = None
+    error: Optional[str] = None
@@ -4,7 +4,7 @@ from typing import Callable, Type
 from fastapi import UploadFile, File, HTTPException
 from abc import abstractmethod, ABC
 from sqlalchemy import and_, text
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 import uuid
 from datetime import datetime, timedelta, time, date
 import requests
@@ -14,6 +14,7 @@ import google.auth
 from google.oauth2 import service_account
 import google.auth.transport.requests
 from src import logger
+from src.components.storage import iter_upload_file, object_key, object_url, stream_to_s3
 from src.models import Attendance, Employee
 # from src.schema.input_type import ReportTypes, CategoryType, ReportRequest
 from src.database import engine, get_db
@@ -48,31 +49,9 @@ def auth_firebase_token() -> str:
     request =google.auth.transport.requests.Request()
     credentials.refresh(request)
     access_token = credentials.token
-    print(access_token)
     return access_token
 
 
-def is_employee_late(clock_in_time, start_work_time, max_late_time: timedelta) -> bool:
-    # Convert clock_in_time to datetime.time if it's a string
-    if isinstance(clock_in_time, str):
-        clock_in_time = datetime.strptime(clock_in_time, "%H:%M:%S").time()
-
-    # Convert start_work_time to datetime.time if it's a string
-    if isinstance(start_work_time, str):
-        start_work_time = datetime.strptime(start_work_time, "%H:%M:%S").time()
-
-    # Combine start work time with today's date
-    start_work_datetime = datetime.combine(datetime.today(), start_work_time)
-
-    # Add max late time (timedelta) to start work time
-    max_allowed_time = start_work_datetime + max_late_time
-
-    # Combine clock in time with today's date
-    clock_in_datetime = datetime.combine(datetime.today(), clock_in_time)
-
-    # Check if the employee is late
-    return clock_in_datetime > max_allowed_time
-
 def enforce_date(value):
     if isinstance(value, str):
         try:
@@ -115,6 +94,33 @@ def get_attendance_for_day(db, date):
         )
     ).all()
 
+def get_attendance_by_day(db, start_date, end_date) -> List[tuple]:
+    """
+    Loads every attendance of the range in one query, with its employee eagerly joined,
+    and buckets the rows per day.
+    :return: (day, attendances) pairs for every day of the range, in order, as get_attendance_for_day would give.
+    """
+    date_range = list(generate_date_range(start_date, end_date))
+    if not date_range:
+        return []
+
+    buckets = {day.date(): [] for day in date_range}
+    attendances = db.query(Attendance).options(
+        joinedload(Attendance.employee, innerjoin=True)
+    ).filter(
+        and_(
+            Attendance.clock_in_time >= date_range[0],
+            Attendance.clock_in_time < date_range[-1] + timedelta(days=1)
+        )
+    ).all()
+
+    for att in attendances:
+        bucket = buckets.get(att.clock_in_time.date())
+        if bucket is not None:
+            bucket.append(att)
+
+    return [(day, buckets[day.date()]) for day in date_range]
+
 def run_hasura_mutation(mutation, variables, url, admin_secret):
     """
     Execute a GraphQL mutation against a Hasura instance.
@@ -152,8 +158,7 @@ def upload_to_s3(local_file, bucket_name, s3_file, s3, is_apk=False):
         print(f'Successfully uploaded {local_file} to {bucket_name}/{s3_file}')
 
         # Construct the file's URL
-        location = s3.get_bucket_location(Bucket=bucket_name)['LocationConstraint']
-        file_url = f"https://{bucket_name}.s3.{location}.amazonaws.com/{s3_file}"
+        file_url = object_url(s3, bucket_name, s3_file)
 
         return file_url
 
@@ -175,39 +180,28 @@ class S3UploadStrategy(UploadStrategy):
 
     async def upload_process(self, file: UploadFile = File(...)) -> str:
         try:
-            file_path = f"uploads/{file.filename}"
-            # mime_type, _ = mimetypes.guess_type(file_path)
-            # file_size = os.path.getsize(file_path)
-            with open(file_path, "wb") as f:
-                f.write(await file.read())
-        except Exception as e:
-            logger.exception(e)
-            raise HTTPException(status_code=500, detail=f"{str(e)}")
-        try:
-            file_name = str(uuid.uuid4())
-            file_url = upload_to_s3(
-                s3_file=str(file.filename),
+            return await stream_to_s3(
+                iter_upload_file(file),
+                key=object_key(file.filename),
                 s3=s3,
-                local_file=file_path,
-                bucket_name='vvims-visitor'
+                content_type=file.content_type
             )
-            print(file_name)
-
-            return f"{file_url}"
         except Exception as e:
             logger.exception(e)
+            raise HTTPException(status_code=500, detail=f"{str(e)}")
 
 
 class LocalUploadStrategy(UploadStrategy):
 
     async def upload_process(self, file: UploadFile = File(...)) -> str:
         try:
-            folder = Path(UPLOAD_DIR) / file.filename
+            key = object_key(file.filename)
+            folder = Path(UPLOAD_DIR) / key
 
             with open(folder, "wb") as f:
                 f.write(await file.read())
 
-            return  f"http://172.17.15.28:30088/uploads/{file.filename}"
+            return  f"http://172.17.15.28:30088/uploads/{key}"
         except Exception as e:
             logger.exception(e)
             raise e
@@ -0,0 +1,4 @@
+import os
+
+# src.database builds its engines at import time; the tests below bring their own SQLite engine.
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/vvims")
@@ -0,0 +1,146 @@
+import asyncio
+import uuid
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from src.components import coalesce
+from src.components.coalesce import NotificationCoalescer, merge_notifications, notification_push, notification_row
+
+RECEIVER, OTHER, CONVERSATION = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+
+
+def pending(count: int, receiver_id: uuid.UUID = RECEIVER) -> SimpleNamespace:
+    return SimpleNamespace(receiver_id=receiver_id, conversation_id=CONVERSATION, title="Ada Lovelace",
+                           message="hello", message_id=uuid.uuid4(), count=count)
+
+
+class FakeSession:
+    """Answers the flush's DELETE ... RETURNING with `rows` and records the rest."""
+
+    def __init__(self, rows: list, fail_on_insert: bool = False):
+        self.rows = rows
+        self.fail_on_insert = fail_on_insert
+        self.inserted: List[dict] = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, stmt, parameters=None):
+        if parameters is not None:
+            if self.fail_on_insert:
+                raise RuntimeError("insert failed")
+            self.inserted.extend(parameters)
+        return self
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self.rows
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def pushes(monkeypatch) -> list:
+    pushes = []
+    monkeypatch.setattr(coalesce.push_queue, "enqueue", pushes.extend)
+    return pushes
+
+
+def test_merge_keeps_the_last_message_and_counts_the_burst():
+    first, last = uuid.uuid4(), uuid.uuid4()
+    rows = merge_notifications([
+        (RECEIVER, CONVERSATION, "Ada", "one", first),
+        (OTHER, CONVERSATION, "Ada", "one", first),
+        (RECEIVER, CONVERSATION, "Ada", "two", last),
+    ])
+    assert len(rows) == 2
+    mine = next(row for row in rows if row["receiver_id"] == RECEIVER)
+    assert (mine["message"], mine["message_id"], mine["count"]) == ("two", last, 2)
+
+
+def test_a_burst_becomes_one_notification_with_its_count():
+    assert notification_row(pending(1))["message"] == "hello"
+    assert notification_row(pending(3))["message"] == "3 new messages"
+    push = notification_push(pending(3))
+    assert push.employee_id == RECEIVER
+    assert push.body == "3 new messages"
+    assert push.data["count"] == "3"
+
+
+def test_pending_statement_adds_to_a_pending_burst():
+    statement = NotificationCoalescer(window_ms=2000).pending_statement([
+        (RECEIVER, CONVERSATION, "Ada", "one", uuid.uuid4()),
+        (RECEIVER, CONVERSATION, "Ada", "two", uuid.uuid4()),
+    ])
+    text = str(statement.compile(dialect=postgresql.dialect()))
+    assert text.startswith("INSERT INTO pending_chat_notifications")
+    assert "ON CONFLICT (receiver_id, conversation_id) DO UPDATE" in text
+    assert "count = (pending_chat_notifications.count + excluded.count)" in text
+    # The burst keeps the flush time of its first message.
+    assert "flush_after = " not in text
+    assert statement.compile().params["count_m0"] == 2
+
+
+def test_flush_moves_pending_rows_to_notifications_and_pushes(monkeypatch, pushes):
+    db = FakeSession([pending(1), pending(4, OTHER)])
+    monkeypatch.setattr(coalesce, "AsyncSessionLocal", lambda: db)
+    coalescer = NotificationCoalescer()
+
+    assert asyncio.run(coalescer.flush()) == 2
+    assert [row["message"] for row in db.inserted] == ["hello", "4 new messages"]
+    assert db.commits == 1
+    assert [push.employee_id for push in pushes] == [RECEIVER, OTHER]
+    assert coalescer.flushed == 2
+
+
+def test_flush_with_nothing_due(monkeypatch, pushes):
+    db = FakeSession([])
+    monkeypatch.setattr(coalesce, "AsyncSessionLocal", lambda: db)
+    assert asyncio.run(NotificationCoalescer().flush()) == 0
+    assert db.inserted == []
+    assert pushes == []
+
+
+def test_a_failed_flush_rolls_back_and_pushes_nothing(monkeypatch, pushes):
+    db = FakeSession([pending(1)], fail_on_insert=True)
+    monkeypatch.setattr(coalesce, "AsyncSessionLocal", lambda: db)
+    coalescer = NotificationCoalescer()
+    with pytest.raises(RuntimeError):
+        asyncio.run(coalescer.flush())
+    assert (db.rollbacks, db.commits, coalescer.failed, coalescer.flushed) == (1, 0, 1, 0)
+    assert pushes == []
+
+
+def test_flusher_flushes_a_burst_when_its_window_ends(monkeypatch, pushes):
+    db = FakeSession([])
+    monkeypatch.setattr(coalesce, "AsyncSessionLocal", lambda: db)
+
+    async def run() -> NotificationCoalescer:
+        # Polls once at start, then only when a window ends.
+        coalescer = NotificationCoalescer(window_ms=10, poll_seconds=3600)
+        await coalescer.start()
+        await asyncio.sleep(0.01)
+        db.rows = [pending(2)]
+        coalescer.schedule(2)
+        await asyncio.sleep(0.1)
+        db.rows = []
+        await coalescer.stop()
+        return coalescer
+
+    coalescer = asyncio.run(run())
+    assert len(pushes) == 1
+    assert (coalescer.received, coalescer.flushed) == (2, 1)
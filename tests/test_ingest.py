@@ -0,0 +1,242 @@
+import asyncio
+import uuid
+from types import SimpleNamespace
+from typing import Callable, List, Optional
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.dialects import postgresql
+
+from src.components import ingest
+from src.components.ingest import SeenEvents, TriggerEvent, TriggerIngestQueue, parse_trigger_event, write_batch
+
+
+def sql(stmt) -> str:
+    return str(stmt.compile(dialect=postgresql.dialect()))
+
+
+class FakeResult:
+    def __init__(self, rows: Optional[list] = None):
+        self.rows = rows or []
+
+    def all(self):
+        return self.rows
+
+    def scalars(self):
+        return iter(self.rows)
+
+    def scalar(self):
+        return self.rows[0] if self.rows else None
+
+
+class FakeSession:
+    """
+    Records the statements it is given instead of running them. `answer` maps a statement's SQL to
+    the rows it returns; by default every event is claimed and nothing else returns rows.
+    """
+
+    def __init__(self, answer: Callable[[str, object], Optional[list]] = None):
+        self.answer = answer or (lambda text, stmt: None)
+        self.statements: List[str] = []
+        self.parameters: List[object] = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, stmt, parameters=None):
+        text = sql(stmt)
+        self.statements.append(text)
+        self.parameters.append(parameters)
+        rows = self.answer(text, stmt)
+        if rows is None and text.startswith("INSERT INTO processed_trigger_events"):
+            rows = [value for name, value in stmt.compile().params.items() if name.startswith("event_id")]
+        return FakeResult(rows)
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+    def executed(self, prefix: str) -> List[str]:
+        return [text for text in self.statements if text.startswith(prefix)]
+
+
+def hasura_body(new: dict, event_id: str = "evt-1", op: str = "INSERT") -> dict:
+    return {"id": event_id, "event": {"op": op, "data": {"old": None, "new": new}}}
+
+
+def visit_event(event_id: str, visitor_id: uuid.UUID) -> TriggerEvent:
+    return TriggerEvent(kind="visit", event_id=event_id, data={
+        "id": str(uuid.uuid4()), "visitor": str(visitor_id), "host_employee": str(uuid.uuid4())
+    })
+
+
+def test_seen_events_reports_duplicates_and_stays_bounded():
+    seen = SeenEvents(maxsize=2)
+    assert seen.add("a")
+    assert not seen.add("a")
+    assert seen.duplicates == 1
+    seen.add("b")
+    seen.add("c")
+    assert seen.add("a")
+    seen.discard("c")
+    assert seen.add("c")
+
+
+def test_parse_trigger_event():
+    attendance_id, employee_id = str(uuid.uuid4()), str(uuid.uuid4())
+    event = parse_trigger_event("attendance", hasura_body(
+        {"id": attendance_id, "employee_id": employee_id, "clock_in_time": "2024-01-01T08:00:00"}, op="UPDATE"
+    ))
+    assert (event.kind, event.event_id, event.op, event.data["id"]) == ("attendance", "evt-1", "UPDATE", attendance_id)
+
+
+@pytest.mark.parametrize("body", [
+    {},
+    {"event": {"data": {"new": None}}},
+    hasura_body({"id": "1", "employee_id": "2"}),
+])
+def test_parse_trigger_event_rejects_bad_payloads(body):
+    with pytest.raises(HTTPException) as error:
+        parse_trigger_event("attendance", body)
+    assert error.value.status_code == 422
+
+
+def test_claim_events_drops_events_already_processed():
+    events = [TriggerEvent(kind="visit", event_id=event_id, data={}) for event_id in ("a", "b")] + \
+        [TriggerEvent(kind="visit", event_id=None, data={})]
+    db = FakeSession(lambda text, stmt: ["b"] if text.startswith("INSERT INTO processed_trigger_events") else None)
+    fresh = asyncio.run(ingest.claim_events(db, events))
+    assert [event.event_id for event in fresh] == ["b", None]
+
+
+def test_write_batch_writes_a_batch_with_one_statement_per_table():
+    visitor_id = uuid.uuid4()
+    events = [visit_event(f"evt-{i}", visitor_id) for i in range(3)]
+
+    def answer(text, stmt):
+        if text.startswith("SELECT visitors.id"):
+            return [SimpleNamespace(id=visitor_id, firstname="Ada", lastname="Lovelace")]
+
+    db = FakeSession(answer)
+    asyncio.run(write_batch(db, events))
+
+    assert len(db.executed("SELECT visitors.id")) == 1
+    notifications = db.executed("INSERT INTO employee_notifications")
+    assert len(notifications) == 1
+    rows = db.parameters[db.statements.index(notifications[0])]
+    assert [row["message"] for row in rows] == ["Ada Lovelace is paying you a visit!"] * 3
+    assert len(db.executed("DELETE FROM trigger_inbox")) == 1
+    assert not db.executed("UPDATE trigger_inbox")
+    assert db.commits == 1
+
+
+def test_events_claimed_by_another_process_are_only_removed_from_the_inbox():
+    events = [visit_event("evt-1", uuid.uuid4())]
+    db = FakeSession(lambda text, stmt: [] if text.startswith("INSERT INTO processed_trigger_events") else None)
+    asyncio.run(write_batch(db, events))
+    assert not db.executed("SELECT visitors.id")
+    assert len(db.executed("DELETE FROM trigger_inbox")) == 1
+    assert db.commits == 1
+
+
+def queue_with(batch_size: int, events: List[TriggerEvent]) -> TriggerIngestQueue:
+    queue = TriggerIngestQueue(maxsize=10, batch_size=batch_size, batch_wait_ms=1)
+    queue._queue = asyncio.Queue(maxsize=queue.maxsize)
+    for event in events:
+        queue._enqueue(event)
+    return queue
+
+
+def test_next_batch_takes_up_to_batch_size_events():
+    async def batches():
+        events = [TriggerEvent(kind="visit", event_id=f"evt-{i}", data={}) for i in range(5)]
+        queue = queue_with(3, events + [events[0]])
+        return [len(await queue._next_batch()), len(await queue._next_batch())]
+
+    # The redelivered evt-0 is still queued, so it is not queued twice.
+    assert asyncio.run(batches()) == [3, 2]
+
+
+def test_a_failed_batch_is_retried_one_event_at_a_time(monkeypatch):
+    written, sessions = [], []
+
+    async def fake_write_batch(db, events):
+        if any(event.event_id == "bad" for event in events):
+            raise ValueError("bad row")
+        written.extend(event.event_id for event in events)
+
+    def session_factory():
+        sessions.append(FakeSession(lambda text, stmt: ["pending"] if text.startswith("UPDATE trigger_inbox") else None))
+        return sessions[-1]
+
+    monkeypatch.setattr(ingest, "write_batch", fake_write_batch)
+    monkeypatch.setattr(ingest, "AsyncSessionLocal", session_factory)
+    events = [TriggerEvent(kind="visit", event_id=event_id, data={}) for event_id in ("a", "bad", "b")]
+    queue = TriggerIngestQueue()
+    for event in events:
+        queue.seen.add(event.event_id)
+
+    asyncio.run(queue._process(events))
+
+    assert written == ["a", "b"]
+    retried = sessions[-1]
+    assert len(retried.executed("UPDATE trigger_inbox")) == 1
+    assert retried.commits == 1
+    # Nothing was recorded for it: a redelivery is not a duplicate.
+    assert queue.seen.add("bad")
+    assert not queue.seen.add("a")
+
+
+def attendance_event(event_id: str, employee_id: uuid.UUID, op: str = "INSERT") -> TriggerEvent:
+    return TriggerEvent(kind="attendance", event_id=event_id, op=op, data={
+        "id": str(uuid.uuid4()), "employee_id": str(employee_id), "clock_in_time": "2024-01-01T08:30:00"
+    })
+
+
+def test_unjudged_clock_in_is_skipped_and_retried(monkeypatch):
+    judged, unjudged = uuid.uuid4(), uuid.uuid4()
+
+    async def load_rules(db, employee_ids):
+        return {}, {}
+
+    def evaluate(rules, shifts, clock_ins):
+        return [False if employee_id == judged else None for employee_id, _, _ in clock_ins]
+
+    monkeypatch.setattr(ingest, "load_rules", load_rules)
+    monkeypatch.setattr(ingest, "evaluate", evaluate)
+    db = FakeSession(lambda text, stmt: ["pending"] if text.startswith("UPDATE trigger_inbox") else None)
+    asyncio.run(write_batch(db, [attendance_event("judged", judged), attendance_event("unjudged", unjudged)]))
+
+    states = db.executed("INSERT INTO attendance_state ")
+    assert len(states) == 1
+    assert len(db.parameters[db.statements.index(states[0])]) == 1
+    # Its day is on the dashboards already; its verdict comes with the retry.
+    rollup = [stmt for stmt in db.statements if "attendance_daily_rollup" in stmt]
+    assert len(rollup) == 1
+    # Unclaimed so the retry is not taken for a duplicate, and kept in the inbox with a backoff.
+    assert len(db.executed("DELETE FROM processed_trigger_events")) == 1
+    assert len(db.executed("UPDATE trigger_inbox")) == 1
+    assert len(db.executed("DELETE FROM trigger_inbox")) == 1
+    assert db.commits == 1
+
+
+def test_retry_statement_marks_the_last_attempt_failed():
+    text = sql(ingest.retry_statement("evt-1", "boom"))
+    assert "CASE WHEN (trigger_inbox.attempts + %(attempts_2)s >= trigger_inbox.max_attempts)" in text
+    assert "RETURNING trigger_inbox.status" in text
+
+
+def test_retry_event_logs_events_that_gave_up(monkeypatch):
+    errors = []
+    monkeypatch.setattr(ingest.logger, "error", errors.append)
+    asyncio.run(ingest.retry_event(FakeSession(lambda text, stmt: [ingest.INBOX_PENDING]), "evt-1", "boom"))
+    assert errors == []
+    asyncio.run(ingest.retry_event(FakeSession(lambda text, stmt: [ingest.INBOX_FAILED]), "evt-1", "boom"))
+    assert len(errors) == 1
@@ -0,0 +1,69 @@
+import uuid
+from datetime import datetime, time, timedelta
+
+from src.components.lateness import LatenessRules, ShiftRule, build_rules, evaluate, to_seconds
+from src.components.settings import CompanySettingsSnapshot
+
+GRACE = 15 * 60
+MONDAY = datetime(2024, 1, 1)
+
+
+def shift_rule(start: time, end: time, working_days=None) -> ShiftRule:
+    return ShiftRule(shift_id=uuid.uuid4(), start=to_seconds(start), working_days=working_days, end=to_seconds(end))
+
+
+def rules(*shifts: ShiftRule, company_start: time = None, company_days=None) -> LatenessRules:
+    return LatenessRules(
+        shifts=shifts,
+        company_start=to_seconds(company_start) if company_start else None,
+        company_days=company_days,
+        grace=GRACE
+    )
+
+
+def at(day: datetime, hour: int, minute: int = 0) -> datetime:
+    return day.replace(hour=hour, minute=minute)
+
+
+def test_day_shift_grace_period():
+    day_rules = rules(shift_rule(time(8), time(17)))
+    assert not day_rules.is_late(at(MONDAY, 8, 15))
+    assert day_rules.is_late(at(MONDAY, 8, 16))
+
+
+def test_overnight_shift_clock_in_after_midnight_is_late():
+    night_rules = rules(shift_rule(time(22), time(6)))
+    assert night_rules.is_late(at(MONDAY, 0, 5))
+    assert not night_rules.is_late(at(MONDAY, 22, 10))
+    assert not night_rules.is_late(at(MONDAY, 21, 50))
+
+
+def test_overnight_shift_uses_the_weekday_it_started_on():
+    # Runs Sunday nights only: Monday 00:05 belongs to Sunday's shift, Tuesday 00:05 to no shift.
+    sunday_night = rules(shift_rule(time(22), time(6), frozenset({7})))
+    assert sunday_night.is_late(at(MONDAY, 0, 5))
+    assert sunday_night.expected_start(MONDAY.isoweekday(), to_seconds(time(0, 5))) == to_seconds(time(22)) - 24 * 3600
+    assert sunday_night.expected_start((MONDAY + timedelta(days=1)).isoweekday(), to_seconds(time(0, 5))) is None
+
+
+def test_recorded_overnight_shift_is_anchored_too():
+    night = shift_rule(time(22), time(6))
+    assert rules(company_start=time(8)).is_late(at(MONDAY, 0, 5), night)
+
+
+def test_nearest_running_shift_wins():
+    two_shifts = rules(shift_rule(time(6), time(14)), shift_rule(time(14), time(22)))
+    assert not two_shifts.is_late(at(MONDAY, 14, 5))
+    assert two_shifts.is_late(at(MONDAY, 6, 30))
+
+
+def test_company_fallback_and_missing_rules():
+    settings = CompanySettingsSnapshot(company_id=uuid.uuid4(), start_work_time=time(8), end_work_time=time(17),
+                                       max_late_time=timedelta(minutes=10), working_days=(1, 2, 3, 4, 5))
+    employee, stranger = uuid.uuid4(), uuid.uuid4()
+    flags = evaluate(
+        {employee: build_rules((), settings)}, {},
+        [(employee, at(MONDAY, 8, 11), None), (employee, at(MONDAY + timedelta(days=5), 9), None),
+         (stranger, at(MONDAY, 9), None)]
+    )
+    assert flags == [True, False, None]
@@ -0,0 +1,63 @@
+"""
+The visits and leaves report rows must come from one joined query, however many rows there are.
+Runs on an in-memory SQLite database holding just the tables those reports read.
+"""
+import uuid
+from datetime import date, time, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event as sa_event
+from sqlalchemy.orm import Session
+
+from src.components.resolvers import iter_report_rows
+from src.models import Employee, Leave, Visit, Visitor
+
+ROWS = 50
+FROM_DATE = date(2024, 1, 1)
+TO_DATE = date(2024, 3, 31)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    tables = [model.__table__ for model in (Employee, Visitor, Visit, Leave)]
+    Employee.metadata.create_all(engine, tables=tables)
+    with Session(engine) as db:
+        department_id = uuid.uuid4()
+        for i in range(ROWS):
+            employee = Employee(
+                firstname=f"Employee{i}", lastname="Test", phone_number=f"6{i:08d}", password="x",
+                company_id=uuid.uuid4(), department_id=department_id, function="staff"
+            )
+            visitor = Visitor(firstname=f"Visitor{i}", lastname="Test", id_number=f"ID{i}")
+            db.add_all([employee, visitor])
+            db.flush()
+            day = FROM_DATE + timedelta(days=i)
+            db.add(Visit(visitor=visitor.id, host_department=department_id, date=day,
+                         check_in_at=time(9), check_out_at=time(10), reason="meeting", status="done"))
+            db.add(Leave(employee_id=employee.id, start_date=day, end_date=day + timedelta(days=2), comment="rest"))
+        db.commit()
+        yield db, department_id
+    engine.dispose()
+
+
+@pytest.mark.parametrize("report_type", ["visits", "leaves"])
+def test_report_rows_use_a_single_query(session, report_type):
+    db, department_id = session
+    counter = QueryCounter()
+    sa_event.listen(db.get_bind(), "before_cursor_execute", counter)
+    try:
+        rows = list(iter_report_rows(db, report_type, "department", department_id, FROM_DATE, TO_DATE))
+    finally:
+        sa_event.remove(db.get_bind(), "before_cursor_execute", counter)
+
+    assert len(rows) == ROWS
+    assert counter.count == 1
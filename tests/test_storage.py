@@ -0,0 +1,145 @@
+import asyncio
+import re
+from typing import AsyncIterator, List
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from src.components.storage import object_key, stream_form_file, stream_to_s3
+
+KEY = re.compile(r"^[0-9a-f]{32}-[A-Za-z0-9._-]+$")
+
+
+def test_same_file_names_get_different_keys():
+    assert object_key("image.jpg") != object_key("image.jpg")
+    assert object_key("image.jpg").endswith("-image.jpg")
+
+
+def test_file_names_are_sanitised():
+    for filename in ("../../etc/passwd", "C:\\Users\\me\\photo 1.png", "été?.jpg", ".hidden", "", None):
+        key = object_key(filename)
+        assert KEY.match(key), key
+        assert not key.split("-", 1)[1].startswith(".")
+    assert object_key("../../etc/passwd").endswith("-passwd")
+    assert object_key("C:\\Users\\me\\photo 1.png").endswith("-photo_1.png")
+    assert object_key(None).endswith("-file")
+
+
+BOUNDARY = "----boundary"
+
+
+def multipart_body(*fields) -> bytes:
+    """fields: (name, filename or None, content)."""
+    body = b""
+    for name, filename, content in fields:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + content + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def form_request(body: bytes, chunk_size: int = 7, content_type: str = None) -> Request:
+    async def receive():
+        nonlocal body
+        chunk, body = body[:chunk_size], body[chunk_size:]
+        return {"type": "http.request", "body": chunk, "more_body": bool(body)}
+
+    content_type = content_type or f"multipart/form-data; boundary={BOUNDARY}"
+    return Request({"type": "http", "headers": [(b"content-type", content_type.encode())]}, receive)
+
+
+def read_field(request: Request, field_name: str) -> List[bytes]:
+    async def read():
+        return [chunk async for chunk in stream_form_file(request, field_name)]
+
+    return asyncio.run(read())
+
+
+def test_stream_form_file_yields_only_the_file_field():
+    content = bytes(range(256)) * 10
+    body = multipart_body(("note", None, b"not a file"), ("file", "a.bin", content), ("other", "b.bin", b"other"))
+    chunks = read_field(form_request(body), "file")
+    assert b"".join(chunks) == content
+    # Yielded as the body arrives, not once it has all been read.
+    assert len(chunks) > 1
+
+
+def test_stream_form_file_takes_the_first_file_of_a_repeated_field():
+    body = multipart_body(("file", "a.bin", b"first"), ("file", "b.bin", b"second"))
+    assert b"".join(read_field(form_request(body), "file")) == b"first"
+
+
+def test_stream_form_file_ignores_a_text_field_of_the_same_name():
+    with pytest.raises(HTTPException) as error:
+        read_field(form_request(multipart_body(("file", None, b"text"))), "file")
+    assert error.value.status_code == 422
+
+
+def test_stream_form_file_rejects_other_bodies():
+    with pytest.raises(HTTPException) as error:
+        read_field(form_request(b"{}", content_type="application/json"), "file")
+    assert error.value.status_code == 422
+
+
+class FakeS3:
+    def __init__(self, fail_on_part: int = None):
+        self.fail_on_part = fail_on_part
+        self.calls: List[str] = []
+        self.parts: List[bytes] = []
+        self.objects = {}
+
+    def get_bucket_location(self, Bucket):
+        return {"LocationConstraint": "eu-west-3"}
+
+    def put_object(self, Bucket, Key, Body, **extra):
+        self.calls.append("put_object")
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key, **extra):
+        self.calls.append("create_multipart_upload")
+        return {"UploadId": "upload-1"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.calls.append("upload_part")
+        if PartNumber == self.fail_on_part:
+            raise ConnectionError("part lost")
+        self.parts.append(bytes(Body))
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.calls.append("complete_multipart_upload")
+        assert [part["PartNumber"] for part in MultipartUpload["Parts"]] == list(range(1, len(self.parts) + 1))
+        self.objects[Key] = b"".join(self.parts)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append("abort_multipart_upload")
+
+
+async def chunks_of(data: bytes, size: int) -> AsyncIterator[bytes]:
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def test_small_body_goes_up_in_one_put():
+    s3 = FakeS3()
+    url = asyncio.run(stream_to_s3(chunks_of(b"small", 2), "key-1", s3, bucket="bucket", part_size=10))
+    assert s3.calls == ["put_object"]
+    assert s3.objects["key-1"] == b"small"
+    assert url == "https://bucket.s3.eu-west-3.amazonaws.com/key-1"
+
+
+def test_large_body_goes_up_part_by_part():
+    s3 = FakeS3()
+    data = bytes(range(256)) * 4
+    asyncio.run(stream_to_s3(chunks_of(data, 100), "key-2", s3, bucket="bucket", part_size=300))
+    assert s3.calls == ["create_multipart_upload"] + ["upload_part"] * 4 + ["complete_multipart_upload"]
+    assert [len(part) for part in s3.parts] == [300, 300, 300, 124]
+    assert s3.objects["key-2"] == data
+
+
+def test_failed_multipart_upload_is_aborted():
+    s3 = FakeS3(fail_on_part=2)
+    with pytest.raises(ConnectionError):
+        asyncio.run(stream_to_s3(chunks_of(b"x" * 1000, 100), "key-3", s3, bucket="bucket", part_size=300))
+    assert s3.calls[-1] == "abort_multipart_upload"
+    assert "complete_multipart_upload" not in s3.calls
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+from src.components import throttle
+from src.components.throttle import LoginThrottle, MemoryBucketBackend, client_ip
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(throttle.time, "monotonic", clock)
+    return clock
+
+
+def take(backend: MemoryBucketBackend, key: str, capacity: int = 3, rate: float = 1.0) -> bool:
+    return asyncio.run(backend.take(key, capacity, rate))
+
+
+def request(peer: str, forwarded_for: str = None) -> Request:
+    headers = [(b"x-forwarded-for", forwarded_for.encode())] if forwarded_for else []
+    return Request({"type": "http", "client": (peer, 1234), "headers": headers})
+
+
+def test_burst_then_rejected(clock):
+    backend = MemoryBucketBackend()
+    assert [take(backend, "phone:1") for _ in range(4)] == [True, True, True, False]
+
+
+def test_bucket_refills_with_time(clock):
+    backend = MemoryBucketBackend()
+    for _ in range(3):
+        take(backend, "phone:1")
+    clock.now += 0.5
+    assert not take(backend, "phone:1")
+    clock.now += 0.5
+    assert take(backend, "phone:1")
+    # Never more than the burst, however long it waited.
+    clock.now += 3600
+    assert [take(backend, "phone:1") for _ in range(4)] == [True, True, True, False]
+
+
+def test_buckets_are_independent(clock):
+    backend = MemoryBucketBackend()
+    for _ in range(3):
+        take(backend, "phone:1")
+    assert not take(backend, "phone:1")
+    assert take(backend, "phone:2")
+
+
+def test_full_buckets_are_dropped_past_max_buckets(clock):
+    backend = MemoryBucketBackend(max_buckets=2)
+    take(backend, "phone:1")
+    take(backend, "phone:2")
+    clock.now += 10
+    take(backend, "phone:3")
+    assert set(backend._buckets) == {"phone:3"}
+
+
+def test_login_throttle_limits_each_phone(clock, monkeypatch):
+    monkeypatch.setattr(throttle, "LOGIN_PHONE_BURST", 2)
+    login = LoginThrottle(MemoryBucketBackend())
+    assert asyncio.run(login.allow("111", "1.2.3.4"))
+    assert asyncio.run(login.allow("111", "1.2.3.4"))
+    assert not asyncio.run(login.allow("111", "5.6.7.8"))
+    assert asyncio.run(login.allow("222", "1.2.3.4"))
+
+
+def test_login_throttle_limits_each_ip_when_enabled(clock, monkeypatch):
+    monkeypatch.setattr(throttle, "LOGIN_IP_BURST", 2)
+    monkeypatch.setattr(throttle, "LOGIN_IP_PER_MINUTE", 60)
+    login = LoginThrottle(MemoryBucketBackend())
+    assert asyncio.run(login.allow("111", "1.2.3.4"))
+    assert asyncio.run(login.allow("222", "1.2.3.4"))
+    assert not asyncio.run(login.allow("333", "1.2.3.4"))
+    assert asyncio.run(login.allow("333", None))
+
+
+def test_client_ip_from_an_untrusted_peer_ignores_forwarded_for():
+    assert client_ip(request("203.0.113.7", "198.51.100.1")) == "203.0.113.7"
+
+
+def test_client_ip_skips_trusted_hops_from_the_right():
+    assert client_ip(request("10.0.0.2", "198.51.100.1, 203.0.113.9, 10.0.0.5")) == "203.0.113.9"
+    assert client_ip(request("10.0.0.2", "10.0.0.9")) == "10.0.0.9"
+    assert client_ip(request("10.0.0.2")) == "10.0.0.2"
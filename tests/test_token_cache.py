@@ -0,0 +1,138 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import pytest
+from fastapi import HTTPException
+
+from src import auth
+from src.components import cache
+from src.components.cache import TokenCache
+
+NOW = datetime.now(timezone.utc).replace(microsecond=0)
+
+
+class RevocationTable:
+    """Stands in for token_revocations, shared by every cache of a test like the real table."""
+
+    def __init__(self):
+        self.rows = []
+        self.reads = 0
+
+    def revoke(self, user_id, issued_before: datetime):
+        self.rows.append((user_id, issued_before, datetime.now(timezone.utc)))
+
+    def session(self):
+        return FakeSession(self)
+
+
+class FakeSession:
+    def __init__(self, table: RevocationTable):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, stmt):
+        self.table.reads += 1
+        return self
+
+    def all(self):
+        return list(self.table.rows)
+
+
+@pytest.fixture
+def table(monkeypatch) -> RevocationTable:
+    table = RevocationTable()
+    monkeypatch.setattr(cache, "SessionLocal", table.session)
+    return table
+
+
+def claims(user_id, issued_at: datetime = NOW, **extra) -> dict:
+    return {"sub": str(user_id), "iat": int(issued_at.timestamp()), **extra}
+
+
+def test_put_then_get(table):
+    tokens = TokenCache(refresh=0)
+    user_claims = claims(uuid.uuid4())
+    assert tokens.get("token") is None
+    tokens.put("token", user_claims)
+    assert tokens.get("token") == user_claims
+    assert tokens.stats()["hits"] == 1
+    assert tokens.stats()["misses"] == 1
+
+
+def test_entry_expires_with_the_token(table):
+    tokens = TokenCache(refresh=0)
+    tokens.put("token", claims(uuid.uuid4(), exp=int(NOW.timestamp()) - 1))
+    assert tokens.get("token") is None
+
+
+def test_least_recently_used_entry_is_evicted(table):
+    tokens = TokenCache(maxsize=2, refresh=0)
+    tokens.put("a", claims(uuid.uuid4()))
+    tokens.put("b", claims(uuid.uuid4()))
+    tokens.get("a")
+    tokens.put("c", claims(uuid.uuid4()))
+    assert tokens.get("b") is None
+    assert tokens.get("a") is not None
+    assert tokens.get("c") is not None
+
+
+def test_revoke_applies_to_tokens_issued_before(table):
+    tokens = TokenCache(refresh=0)
+    user_id = uuid.uuid4()
+    old, new = claims(user_id, NOW - timedelta(minutes=5)), claims(user_id, NOW)
+    tokens.put("old", old)
+    tokens.put("new", new)
+    tokens.revoke(user_id, NOW)
+    assert tokens.get("old") is None
+    assert tokens.is_revoked(old)
+    # Tokens from the same second stay valid.
+    assert tokens.get("new") == new
+
+
+def test_revocation_reaches_every_cache(table):
+    user_id = uuid.uuid4()
+    user_claims = claims(user_id, NOW - timedelta(minutes=5))
+    here, there = TokenCache(refresh=0), TokenCache(refresh=0)
+    here.put("token", user_claims)
+    there.put("token", user_claims)
+
+    # Committed by `there`'s process: `here` only learns about it from the table.
+    table.revoke(user_id, NOW)
+    there.revoke(user_id, NOW)
+
+    assert here.get("token") is None
+    assert there.get("token") is None
+    assert here.stats()["revocations"] == 1
+
+
+def test_revocations_are_read_at_most_once_per_refresh(table):
+    tokens = TokenCache(refresh=3600)
+    user_id = uuid.uuid4()
+    tokens.put("token", claims(user_id, NOW - timedelta(minutes=5)))
+    assert tokens.get("token") is not None
+    table.revoke(user_id, NOW)
+    assert tokens.get("token") is not None
+    assert table.reads == 1
+
+
+def test_verify_token_claims_reports_revoked_tokens(table, monkeypatch):
+    tokens = TokenCache(refresh=0)
+    monkeypatch.setattr(auth, "token_cache", tokens)
+    user_id = uuid.uuid4()
+    token = jwt.encode(claims(user_id, NOW - timedelta(minutes=5)), auth.JWT_SECRET_KEY, algorithm=auth.ALGORITHM)
+    assert auth.verify_token(token, auth._credentials_exception()) == str(user_id)
+
+    table.revoke(user_id, NOW)
+    with pytest.raises(HTTPException) as revoked:
+        auth.verify_token(token, auth._credentials_exception())
+    assert revoked.value.detail == "Token revoked"
+
+    with pytest.raises(HTTPException) as invalid:
+        auth.verify_token("not a token", auth._credentials_exception())
+    assert invalid.value.detail == "Invalid token "